@@ -0,0 +1,86 @@
+"""Helpers shared by the benchmark scripts."""
+import json
+import math
+import os
+import sys
+import tempfile
+from typing import Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_FILENAME = 'car_rental.db'
+
+
+def load_backend(workdir: Optional[str] = None):
+    """Imports backend/main.py with workdir as the working directory.
+
+    Once started (its lifespan, or Database.initialize), the app opens
+    car_rental.db and creates uploads/ relative to the working directory.
+    Benchmarks therefore run it from a scratch directory, or from a directory
+    holding a generated database, never from backend/ itself.
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix='bench_')
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    import main
+    return main
+
+
+def percentile(sorted_samples: List[float], q: float) -> float:
+    # Nearest-rank percentile over an already sorted list.
+    if not sorted_samples:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_samples)))
+    return sorted_samples[rank - 1]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds for a list of durations in seconds."""
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'mean_ms': sum(ordered) / len(ordered) * 1000 if ordered else 0.0,
+        'p50_ms': percentile(ordered, 50) * 1000,
+        'p95_ms': percentile(ordered, 95) * 1000,
+        'p99_ms': percentile(ordered, 99) * 1000,
+    }
+
+
+def print_table(results: Dict[str, Dict[str, float]], columns: List[str]):
+    width = max([len(name) for name in results] + [10]) + 2
+    print(f'{"name":<{width}}' + ''.join(f'{col:>12}' for col in columns))
+    for name, row in results.items():
+        cells = ''.join(
+            f'{row[col]:>12.2f}' if isinstance(row.get(col), float) else f'{row.get(col, ""):>12}'
+            for col in columns)
+        print(f'{name:<{width}}' + cells)
+
+
+def save_results(path: str, results: Dict[str, Dict[str, float]], meta: Dict):
+    with open(path, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=2, sort_keys=True)
+    print(f'Saved results to {path}')
+
+
+def compare_results(baseline_path: str, results: Dict[str, Dict[str, float]],
+                    metric: str = 'p95_ms', tolerance: float = 0.10) -> List[str]:
+    """Prints current vs baseline for metric; returns the names that regressed
+    by more than tolerance (a fraction, e.g. 0.10 for 10%)."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+    regressions = []
+    width = max([len(name) for name in results] + [10]) + 2
+    print(f'\n{"name":<{width}}{"baseline":>12}{"current":>12}{"change":>10}  ({metric})')
+    for name, row in results.items():
+        if name not in baseline:
+            print(f'{name:<{width}}{"-":>12}{row[metric]:>12.2f}{"new":>10}')
+            continue
+        before, after = baseline[name][metric], row[metric]
+        change = (after - before) / before if before else 0.0
+        marker = ''
+        if change > tolerance:
+            regressions.append(name)
+            marker = '  REGRESSION'
+        print(f'{name:<{width}}{before:>12.2f}{after:>12.2f}{change:>+10.1%}{marker}')
+    return regressions
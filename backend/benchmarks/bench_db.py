@@ -0,0 +1,212 @@
+"""Micro-benchmarks for Database methods against a generated database.
+
+Read methods run against the database as-is. With --writes, the write methods
+run against a copy of it, so the generated data stays reusable. Rows that a
+write consumes (open rentals to return, rentals awaiting a sale) are inserted
+into the copy before timing starts, one per run.
+
+    cd backend && python benchmarks/bench_db.py --db-dir bench_data --repeat 50
+    python benchmarks/bench_db.py --db-dir bench_data --save db_baseline.json
+    python benchmarks/bench_db.py --db-dir bench_data --compare db_baseline.json
+"""
+import argparse
+import fnmatch
+import io
+import itertools
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _common import DB_FILENAME, compare_results, load_backend, print_table, save_results, summarize  # noqa: E402
+
+
+def max_id(db, table: str) -> int:
+    return db.conn.execute(f'SELECT COALESCE(MAX(id), 1) FROM {table}').fetchone()[0]
+
+
+def read_cases(backend, db, rng: random.Random) -> List[Tuple[str, Callable[[], object]]]:
+    cars, customers, rentals = max_id(db, 'cars'), max_id(db, 'customers'), max_id(db, 'rentals')
+    sold = [row[0] for row in db.conn.execute('SELECT rental_id FROM sales ORDER BY id DESC LIMIT 1000')]
+    today = datetime.now()
+    day = lambda offset: (today + timedelta(days=offset)).strftime('%Y-%m-%d')  # noqa: E731
+    car = lambda: rng.randint(1, cars)  # noqa: E731
+    return [
+        ('get_all_cars', lambda: db.get_all_cars()),
+        ('get_all_cars(limit=100)', lambda: db.get_all_cars(limit=100, cursor=rng.randint(0, cars))),
+        ('get_available_cars', lambda: db.get_available_cars()),
+        ('get_car_by_id', lambda: db.get_car_by_id(car())),
+        ('get_cars_with_maintenance_summary', lambda: db.get_cars_with_maintenance_summary()),
+        ('get_all_customers(limit=100)', lambda: db.get_all_customers(limit=100, cursor=rng.randint(0, customers))),
+        ('get_all_customers(q)', lambda: db.get_all_customers(limit=50, q=f'customer{rng.randint(1, customers)}@')),
+        ('get_customer_by_id', lambda: db.get_customer_by_id(rng.randint(1, customers))),
+        ('get_all_rentals(limit=100)', lambda: db.get_all_rentals(limit=100, cursor=rng.randint(100, rentals))),
+        ('get_all_rentals(active)', lambda: db.get_all_rentals(limit=100, status='active')),
+        ('get_all_rentals(car_id)', lambda: db.get_all_rentals(limit=100, car_id=car())),
+        ('get_rental_by_id', lambda: db.get_rental_by_id(rng.randint(1, rentals))),
+        ('get_active_rentals', lambda: db.get_active_rentals()),
+        ('get_sale_by_rental_id', lambda: db.get_sale_by_rental_id(rng.choice(sold))),
+        ('check_car_availability', lambda: db.check_car_availability(car(), day(1), day(rng.randint(2, 14)))),
+        ('get_cars_free_between', lambda: db.get_cars_free_between(day(1), day(rng.randint(2, 14)))),
+        ('get_invoice', lambda: db.get_invoice(rng.choice(sold))),
+        ('get_invoices(limit=100)', lambda: db.get_invoices(limit=100)),
+        ('get_invoices(rental_ids)', lambda: db.get_invoices(rental_ids=rng.sample(sold, 50))),
+        ('iter_invoices(month)', lambda: sum(len(rows) for rows in db.iter_invoices(day(-30), day(0)))),
+        ('get_insurance_by_car', lambda: db.get_insurance_by_car(car())),
+        ('get_legal_docs_by_car', lambda: db.get_legal_docs_by_car(car())),
+        ('get_compliance_matrix', lambda: db.get_compliance_matrix()),
+        ('get_upcoming_maintenance', lambda: db.get_upcoming_maintenance(30)),
+        ('get_notifications', lambda: db.get_notifications()),
+        ('get_users', lambda: db.get_users()),
+        ('get_credentials', lambda: db.get_credentials('admin@local')),
+        ('get_stats', lambda: db.get_stats()),
+        ('_compute_stats', lambda: db._compute_stats(day(0))),
+        ('get_settings', lambda: db.get_settings()),
+        ('iter_export(sales, month)', lambda: sum(len(rows) for rows in db.iter_export('sales', day(-30), day(0)))),
+    ]
+
+
+def scratch_rentals(db, count: int, start_date: str, end_date) -> List[int]:
+    """Inserts count rentals directly, outside any timed call, and returns their ids."""
+    cars, customers = max_id(db, 'cars'), max_id(db, 'customers')
+    c = db.conn.cursor()
+    ids = []
+    with db.conn:
+        for n in range(count):
+            c.execute('INSERT INTO rentals (car_id, customer_id, start_date, end_date, total_cost) VALUES (?, ?, ?, ?, 0)',
+                      ((n % cars) + 1, (n % customers) + 1, start_date, end_date))
+            ids.append(c.lastrowid)
+    return ids
+
+
+def write_cases(backend, db, rng: random.Random, repeat: int) -> List[Tuple[str, Callable[[], object]]]:
+    cars, customers = max_id(db, 'cars'), max_id(db, 'customers')
+    now = datetime.now()
+    today, yesterday = now.strftime('%Y-%m-%d'), (now - timedelta(days=1)).strftime('%Y-%m-%d')
+    counter = iter(range(10**9))
+    runs = repeat + 1  # including the warm-up call
+    admin_id = db.get_user_by_email('admin@local').id
+    token, _ = db.create_session(admin_id)
+    to_end = iter(scratch_rentals(db, runs, yesterday, None))
+    to_return = iter(scratch_rentals(db, runs * 10, yesterday, None))
+    to_invoice = iter(scratch_rentals(db, runs, yesterday, today))
+    # One car to itself, booked on a new far-future day each run.
+    rental_car = db.add_car(backend.Car(make='Bench', model='Rental', year=2020, price_per_day=5000.0))
+    rental_days = (datetime(2100, 1, 1) + timedelta(days=2 * n) for n in itertools.count())
+    # password_hash is passed so add_user times the insert, not PBKDF2.
+    user_id = db.add_user(backend.User(name='Bench', email='bench-user@example.com'), password_hash='x')
+    roles = itertools.cycle(['manager', 'staff'])
+    maint_id = db.add_maintenance(backend.Maintenance(car_id=1, maint_type='Bench', due_date=today))
+    statuses = itertools.cycle(['completed', 'pending'])
+
+    def import_rows(make_row, count: int = 100):
+        return [(line, make_row()) for line in range(2, count + 2)]
+
+    def book_rental():
+        day = next(rental_days)
+        return db.add_rental(backend.Rental(
+            car_id=rental_car, customer_id=rng.randint(1, customers), start_date=day.strftime('%Y-%m-%d'),
+            end_date=(day + timedelta(days=1)).strftime('%Y-%m-%d')))
+
+    def spooled_upload():
+        data = f'%PDF bench {next(counter)}'.encode()
+        return backend.save_upload(backend.UploadFile(file=io.BytesIO(data), filename='bench.pdf'), 'legal_docs')
+
+    return [
+        ('add_car', lambda: db.add_car(backend.Car(make='Bench', model='Car', year=2020, price_per_day=5000.0))),
+        ('add_customer', lambda: db.add_customer(backend.Customer(name='Bench', email=f'bench{next(counter)}@example.com'))),
+        ('add_insurance', lambda: db.add_insurance(backend.Insurance(
+            car_id=rng.randint(1, cars), provider='Bench', policy_number='B-1', start_date=today, end_date=today))),
+        ('add_legal_doc', lambda: db.add_legal_doc(backend.LegalDocument(
+            car_id=rng.randint(1, cars), doc_type='Bench', expiry_date=today))),
+        ('add_maintenance', lambda: db.add_maintenance(backend.Maintenance(
+            car_id=rng.randint(1, cars), maint_type='Bench', due_date=today))),
+        ('update_maintenance_status', lambda: db.update_maintenance_status(maint_id, next(statuses))),
+        ('add_rental', book_rental),
+        ('add_rentals_batch(10)', lambda: db.add_rentals_batch([
+            backend.Rental(car_id=rng.randint(1, cars), customer_id=rng.randint(1, customers),
+                           start_date='2099-01-01', days=1) for _ in range(10)])),
+        ('update_rental_end', lambda: db.update_rental_end(next(to_end), today, 5000.0)),
+        ('return_rentals_batch(10)', lambda: db.return_rentals_batch([next(to_return) for _ in range(10)])),
+        ('add_sale', lambda: db.add_sale(backend.Sale(
+            rental_id=next(to_invoice), customer_id=1, car_id=1, total_cost=5000.0, sale_date=today))),
+        ('import_cars(100)', lambda: db.import_cars(import_rows(lambda: {
+            'make': 'Bench', 'model': 'Import', 'year': '2020', 'price_per_day': '5000'}))),
+        ('import_customers(100)', lambda: db.import_customers(import_rows(lambda: {
+            'name': 'Bench', 'email': f'import{next(counter)}@example.com'}))),
+        ('add_user', lambda: db.add_user(backend.User(name='Bench', email=f'user{next(counter)}@example.com'),
+                                         password_hash='x')),
+        ('update_user', lambda: db.update_user(user_id, role=next(roles))),
+        ('create_session', lambda: db.create_session(admin_id)),
+        ('get_session', lambda: db.get_session(token)),
+        ('save_upload+register_blob', lambda: db.register_blob(spooled_upload())),
+        ('gc_uploads', lambda: db.gc_uploads(grace_seconds=0)),
+        ('save_settings', lambda: db.save_settings({'general': {'companyName': 'Bench'}})),
+    ]
+
+
+def run(cases, repeat: int, pattern: str) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name, fn in cases:
+        if not fnmatch.fnmatch(name, pattern):
+            continue
+        fn()  # warm up caches and lazy indexes
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - started)
+        results[name] = summarize(samples)
+        print(f'  {name:<36}{results[name]["p50_ms"]:>10.2f} ms p50', flush=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db-dir', default='bench_data', help=f'directory holding a generated {DB_FILENAME}')
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--only', default='*', help='glob over benchmark names, e.g. "get_all_*"')
+    parser.add_argument('--writes', action='store_true', help='also benchmark writes (on a copy of the database)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help='write results to this JSON file')
+    parser.add_argument('--compare', help='compare p95 against a saved JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    args = parser.parse_args()
+
+    db_path = os.path.abspath(os.path.join(args.db_dir, DB_FILENAME))
+    if not os.path.exists(db_path):
+        raise SystemExit(f'{db_path} not found; run benchmarks/generate.py first.')
+    backend = load_backend()
+    rng = random.Random(args.seed)
+
+    print(f'Read benchmarks on {db_path} ({args.repeat} runs each)')
+    db = backend.Database(db_path)
+    db.initialize()
+    results = run(read_cases(backend, db, rng), args.repeat, args.only)
+    db.close()
+
+    if args.writes:
+        scratch = os.path.join(tempfile.mkdtemp(prefix='bench_db_'), DB_FILENAME)
+        shutil.copyfile(db_path, scratch)
+        print(f'Write benchmarks on a copy at {scratch}')
+        db = backend.Database(scratch)
+        db.initialize()
+        results.update(run(write_cases(backend, db, rng, args.repeat), args.repeat, args.only))
+        db.close()
+
+    print()
+    print_table(results, ['count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'])
+    meta = {'db': db_path, 'repeat': args.repeat, 'run_at': datetime.now().isoformat(timespec='seconds')}
+    if args.save:
+        save_results(args.save, results, meta)
+    if args.compare and compare_results(args.compare, results, tolerance=args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
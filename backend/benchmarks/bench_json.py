@@ -0,0 +1,93 @@
+"""Compare list-endpoint serialization: per-row models vs the orjson fast path.
+
+The "legacy" app below serves the same rows the way the list endpoints used
+to: one Pydantic model per row (or the rental dicts) returned through
+response_model, so FastAPI validates and jsonable_encodes every row before
+json.dumps. The "fast" numbers come from the real endpoints in main.py.
+
+    cd backend && python benchmarks/bench_json.py --rows 5000 --repeat 20
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _common import load_backend  # noqa: E402
+
+
+def seed(db, rows: int):
+    with db.conn:
+        c = db.conn.cursor()
+        c.executemany(
+            'INSERT INTO cars (make, model, year, price_per_day, available) VALUES (?, ?, ?, ?, 1)',
+            [(f'Make{i % 20}', f'Model{i}', 2000 + i % 25, 3500.0 + i % 100) for i in range(rows)])
+        c.executemany(
+            'INSERT INTO customers (name, email, phone) VALUES (?, ?, ?)',
+            [(f'Customer {i}', f'customer{i}@example.com', f'+94 77 {i:07d}') for i in range(rows)])
+        c.executemany(
+            'INSERT INTO rentals (car_id, customer_id, start_date, end_date, total_cost, deposit_amount, is_paid, payment_method)'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [(i + 1, i + 1, '2024-01-01', '2024-01-05', 14000.0, 5000.0, i % 2, 'cash') for i in range(rows)])
+
+
+def legacy_app(main, db):
+    from fastapi import FastAPI
+
+    app = FastAPI()
+
+    @app.get('/cars', response_model=List[main.Car])
+    def cars():
+        return [main.Car(**row) for row in db.get_all_cars()]
+
+    @app.get('/customers', response_model=List[main.Customer])
+    def customers():
+        return [main.Customer(**row) for row in db.get_all_customers()]
+
+    @app.get('/rentals', response_model=List[dict])
+    def rentals():
+        return db.get_all_rentals()
+
+    return app
+
+
+def timed(client, path: str, repeat: int) -> float:
+    client.get(path)  # warm up
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(path)
+        samples.append(time.perf_counter() - start)
+        response.raise_for_status()
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    backend = load_backend()
+    from fastapi.testclient import TestClient
+
+    # Entering the client runs the app's lifespan, which creates the schema.
+    app = backend.create_app()
+    with TestClient(app) as fast:
+        db = app.state.services.db
+        seed(db, args.rows)
+        legacy = TestClient(legacy_app(backend, db))
+        for path in ['/cars', '/customers', '/rentals']:
+            assert fast.get(path).json() == legacy.get(path).json(), f'{path}: response shapes differ'
+
+        print(f'{args.rows} rows, median of {args.repeat} requests')
+        print(f'{"endpoint":<12}{"legacy ms":>12}{"fast ms":>12}{"speedup":>10}')
+        for path in ['/cars', '/customers', '/rentals']:
+            slow_ms, fast_ms = timed(legacy, path, args.repeat), timed(fast, path, args.repeat)
+            print(f'{path:<12}{slow_ms:>12.1f}{fast_ms:>12.1f}{slow_ms / fast_ms:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
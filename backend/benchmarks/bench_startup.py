@@ -0,0 +1,91 @@
+"""Cold-start timing: importing main.py and running the app's lifespan startup.
+
+Each run is a fresh interpreter, so import costs are real. "cold" starts
+against a new, empty directory (migrations plus the default admin's PBKDF2);
+"warm" starts against the database the cold runs left behind, or against
+--db-dir. Exits non-zero when the p95 import + startup time is over --budget-ms.
+
+    cd backend && python benchmarks/bench_startup.py --repeat 10 --budget-ms 1500
+    python benchmarks/bench_startup.py --db-dir bench_data --save startup_baseline.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _common import BACKEND_DIR, compare_results, print_table, save_results, summarize  # noqa: E402
+
+CHILD = '''
+import asyncio, json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import main
+imported = time.perf_counter()
+
+
+async def start():
+    app = main.create_app()
+    async with app.router.lifespan_context(app):
+        return time.perf_counter()
+
+ready = asyncio.run(start())
+print(json.dumps({'import': imported - started, 'startup': ready - imported, 'total': ready - started}))
+'''
+
+
+def measure(workdir: str) -> Dict[str, float]:
+    out = subprocess.run([sys.executable, '-c', CHILD, BACKEND_DIR], cwd=workdir, check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def run(label: str, workdirs: List[str]) -> Dict[str, Dict[str, float]]:
+    samples: Dict[str, List[float]] = {'import': [], 'startup': [], 'total': []}
+    for workdir in workdirs:
+        for key, value in measure(workdir).items():
+            samples[key].append(value)
+    results = {f'{label} {key}': summarize(values) for key, values in samples.items()}
+    print(f'  {label:<8}{results[f"{label} total"]["p50_ms"]:>10.1f} ms p50 total', flush=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--db-dir', help='directory holding a generated car_rental.db, for the warm runs')
+    parser.add_argument('--budget-ms', type=float, default=2000.0, help='p95 import + startup budget')
+    parser.add_argument('--save', help='write results to this JSON file')
+    parser.add_argument('--compare', help='compare p95 against a saved JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    args = parser.parse_args()
+
+    scratch = [tempfile.mkdtemp(prefix='bench_startup_') for _ in range(args.repeat)]
+    print(f'Startup benchmarks ({args.repeat} runs each)')
+    results = run('cold', scratch)
+    warm_dir = os.path.abspath(args.db_dir) if args.db_dir else scratch[0]
+    results.update(run('warm', [warm_dir] * args.repeat))
+
+    print()
+    print_table(results, ['count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'])
+    meta = {'db_dir': warm_dir, 'repeat': args.repeat, 'run_at': datetime.now().isoformat(timespec='seconds')}
+    if args.save:
+        save_results(args.save, results, meta)
+    failed = False
+    for label in ('cold', 'warm'):
+        p95 = results[f'{label} total']['p95_ms']
+        if p95 > args.budget_ms:
+            print(f'{label} start p95 {p95:.0f} ms is over the {args.budget_ms:.0f} ms budget')
+            failed = True
+    if args.compare and compare_results(args.compare, results, tolerance=args.tolerance):
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
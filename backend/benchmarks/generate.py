@@ -0,0 +1,237 @@
+"""Build a synthetic car_rental.db at a configurable scale.
+
+The output depends only on the arguments: the same --seed, --as-of and sizes
+always produce the same rows. The schema comes from Database itself
+(migrations plus the default admin, admin@local / admin123). Rows are then
+bulk-loaded over a separate connection.
+
+    cd backend && python benchmarks/generate.py --out-dir bench_data \\
+        --cars 10000 --customers 500000 --rentals 5000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import Iterator, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _common import DB_FILENAME, load_backend  # noqa: E402
+
+MAKES = {
+    'Toyota': ['Aqua', 'Prius', 'Corolla', 'Axio', 'Vitz', 'KDH'],
+    'Honda': ['Fit', 'Vezel', 'Civic', 'Grace'],
+    'Suzuki': ['Alto', 'Wagon R', 'Swift', 'Every'],
+    'Nissan': ['Leaf', 'X-Trail', 'Sunny', 'Caravan'],
+    'Mitsubishi': ['Montero', 'Lancer', 'Outlander'],
+    'Mercedes-Benz': ['C200', 'E250'],
+}
+FIRST_NAMES = ['Nimal', 'Kamal', 'Sunil', 'Ruwan', 'Chamari', 'Dilani', 'Ishara', 'Tharindu', 'Nadeesha', 'Kasun',
+               'Ayesha', 'Priyanka', 'Lahiru', 'Sanjaya', 'Malini', 'Dinesh', 'Shanika', 'Roshan']
+LAST_NAMES = ['Perera', 'Fernando', 'Silva', 'Jayasinghe', 'Bandara', 'Wickramasinghe', 'Gunawardena',
+              'Rajapaksa', 'Herath', 'Dissanayake', 'Kumara', 'Mendis']
+PAYMENT_METHODS = ['cash', 'card', 'bank_transfer']
+INSURERS = ['Ceylinco', 'Allianz', 'Sri Lanka Insurance', 'AIA', 'LOLC']
+DOC_TYPES = [('Registration', 720), ('Revenue License', 365), ('Emission Test', 365)]
+MAINTENANCE_TYPES = ['Oil change', 'Tyre rotation', 'Brake service', 'Full service', 'A/C service']
+
+BATCH_SIZE = 50_000
+
+
+def batched(rows: Iterator[tuple], size: int = BATCH_SIZE) -> Iterator[List[tuple]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iso(d: date) -> str:
+    return d.strftime('%Y-%m-%d')
+
+
+class Generator:
+    def __init__(self, cars: int, customers: int, rentals: int, seed: int, as_of: date):
+        self.cars, self.customers, self.rentals = cars, customers, rentals
+        self.seed, self.as_of = seed, as_of
+        self.prices: List[float] = []
+        self.rented_out = set()
+
+    def rng(self, table: str) -> random.Random:
+        # One stream per table, so changing one table's size leaves the others unchanged.
+        return random.Random(f'{self.seed}:{table}')
+
+    def car_rows(self) -> Iterator[tuple]:
+        rng = self.rng('cars')
+        makes = list(MAKES)
+        for _ in range(self.cars):
+            make = rng.choice(makes)
+            price = float(rng.randrange(4000, 25000, 500))
+            self.prices.append(price)
+            yield make, rng.choice(MAKES[make]), rng.randint(2005, self.as_of.year), price
+
+    def customer_rows(self) -> Iterator[tuple]:
+        rng = self.rng('customers')
+        for i in range(1, self.customers + 1):
+            name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+            yield name, f'customer{i}@example.com', f'+94 7{rng.randint(0, 8)} {rng.randint(0, 9999999):07d}'
+
+    def rental_rows(self) -> Iterator[Tuple[tuple, tuple]]:
+        """Yields (rental, sale) pairs in rental id order; sale is None for active rentals.
+
+        Each car gets a run of rentals laid out backwards from as_of, with at
+        least a day between one rental's end and the next one's start (the
+        app treats both dates as booked). Only the last rental of a run can
+        reach past as_of; it is left open (and the car unavailable), so no
+        sale is ever dated after as_of.
+        """
+        rng = self.rng('rentals')
+        per_car, extra = divmod(self.rentals, self.cars)
+        rental_id = 0
+        for car_index in range(self.cars):
+            count = per_car + (1 if car_index < extra else 0)
+            if not count:
+                continue
+            car_id, price = car_index + 1, self.prices[car_index]
+            # The latest rental starts on or before as_of; each earlier one
+            # ends 1-6 days before the next starts.
+            run = []
+            start = self.as_of - timedelta(days=rng.randint(0, 7))
+            days = rng.randint(1, 14)
+            for _ in range(count):
+                run.append((start, start + timedelta(days=days), days))
+                days = rng.randint(1, 14)
+                start -= timedelta(days=days + 1 + rng.randint(0, 5))
+            run.reverse()
+            for n, (start, end, days) in enumerate(run):
+                customer_id = rng.randint(1, self.customers)
+                deposit = float(rng.choice([0, 5000, 10000]))
+                rental_id += 1
+                if n == count - 1 and end > self.as_of:
+                    self.rented_out.add(car_id)
+                    yield (car_id, customer_id, iso(start), None, None, deposit, 0, None), None
+                else:
+                    total = days * price
+                    rental = (car_id, customer_id, iso(start), iso(end), total, deposit,
+                              int(rng.random() < 0.9), rng.choice(PAYMENT_METHODS))
+                    yield rental, (rental_id, customer_id, car_id, total, iso(end))
+
+    def insurance_rows(self) -> Iterator[tuple]:
+        rng = self.rng('insurances')
+        for car_id in range(1, self.cars + 1):
+            end = self.as_of + timedelta(days=rng.randint(-30, 365))
+            for start in [end - timedelta(days=730), end - timedelta(days=365)]:
+                policy_end = start + timedelta(days=365)
+                yield (car_id, rng.choice(INSURERS), f'POL-{car_id:06d}-{start.year}', iso(start), iso(policy_end),
+                       rng.choice(['Comprehensive', 'Third party']))
+
+    def legal_doc_rows(self) -> Iterator[tuple]:
+        rng = self.rng('legal_documents')
+        for car_id in range(1, self.cars + 1):
+            for doc_type, validity in DOC_TYPES:
+                expiry = self.as_of + timedelta(days=rng.randint(-15, validity))
+                yield car_id, doc_type, f'{doc_type[:3].upper()}-{car_id:06d}', iso(expiry - timedelta(days=validity)), iso(expiry)
+
+    def maintenance_rows(self) -> Iterator[tuple]:
+        rng = self.rng('maintenance')
+        for car_id in range(1, self.cars + 1):
+            for back in (180, 90):
+                due = self.as_of - timedelta(days=back + rng.randint(0, 30))
+                yield car_id, rng.choice(MAINTENANCE_TYPES), iso(due), 'completed', float(rng.randrange(2000, 40000, 500)), None
+            due = self.as_of + timedelta(days=rng.randint(-10, 90))
+            yield car_id, rng.choice(MAINTENANCE_TYPES), iso(due), 'pending', 0.0, None
+
+
+def load(conn: sqlite3.Connection, label: str, sql: str, rows: Iterator[tuple]) -> int:
+    started, total = time.perf_counter(), 0
+    for batch in batched(rows):
+        with conn:
+            conn.executemany(sql, batch)
+        total += len(batch)
+    print(f'  {label:<16}{total:>12,} rows  {time.perf_counter() - started:8.1f}s')
+    return total
+
+
+def generate(out_dir: str, cars: int, customers: int, rentals: int, seed: int = 42,
+             as_of: date = None, force: bool = False) -> str:
+    as_of = as_of or date.today()
+    path = os.path.abspath(os.path.join(out_dir, DB_FILENAME))
+    if os.path.exists(path):
+        if not force:
+            raise SystemExit(f'{path} already exists; pass --force to replace it.')
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Schema and default admin exactly as the app creates them.
+    backend = load_backend(os.path.dirname(path))
+    db = backend.Database(path)
+    db.initialize()
+    db.close()
+
+    gen = Generator(cars, customers, rentals, seed, as_of)
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute('PRAGMA cache_size=-200000')
+    print(f'Generating {path} (seed={seed}, as_of={iso(as_of)})')
+    started = time.perf_counter()
+    load(conn, 'cars', 'INSERT INTO cars (make, model, year, price_per_day, available) VALUES (?, ?, ?, ?, 1)',
+         gen.car_rows())
+    load(conn, 'customers', 'INSERT INTO customers (name, email, phone) VALUES (?, ?, ?)', gen.customer_rows())
+
+    sales: List[tuple] = []
+
+    def rentals_with_sales():
+        for rental, sale in gen.rental_rows():
+            if sale:
+                sales.append(sale)
+            yield rental
+            if len(sales) >= BATCH_SIZE:
+                with conn:
+                    conn.executemany('INSERT INTO sales (rental_id, customer_id, car_id, total_cost, sale_date)'
+                                     ' VALUES (?, ?, ?, ?, ?)', sales)
+                sales.clear()
+
+    load(conn, 'rentals + sales',
+         'INSERT INTO rentals (car_id, customer_id, start_date, end_date, total_cost, deposit_amount, is_paid,'
+         ' payment_method) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rentals_with_sales())
+    with conn:
+        conn.executemany('INSERT INTO sales (rental_id, customer_id, car_id, total_cost, sale_date)'
+                         ' VALUES (?, ?, ?, ?, ?)', sales)
+        conn.executemany('UPDATE cars SET available = 0 WHERE id = ?', [(car_id,) for car_id in sorted(gen.rented_out)])
+    load(conn, 'insurances', 'INSERT INTO insurances (car_id, provider, policy_number, start_date, end_date, coverage)'
+         ' VALUES (?, ?, ?, ?, ?, ?)', gen.insurance_rows())
+    load(conn, 'legal_documents', 'INSERT INTO legal_documents (car_id, doc_type, number, issue_date, expiry_date)'
+         ' VALUES (?, ?, ?, ?, ?)', gen.legal_doc_rows())
+    load(conn, 'maintenance', 'INSERT INTO maintenance (car_id, maint_type, due_date, status, cost, notes)'
+         ' VALUES (?, ?, ?, ?, ?, ?)', gen.maintenance_rows())
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+    size_mb = os.path.getsize(path) / 1e6
+    print(f'Done in {time.perf_counter() - started:.1f}s, {size_mb:,.1f} MB')
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--out-dir', default='bench_data', help=f'directory for {DB_FILENAME}')
+    parser.add_argument('--cars', type=int, default=10_000)
+    parser.add_argument('--customers', type=int, default=500_000)
+    parser.add_argument('--rentals', type=int, default=5_000_000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--as-of', type=lambda s: datetime.strptime(s, '%Y-%m-%d').date(), default=None,
+                        help='date the data is generated around (default: today)')
+    parser.add_argument('--force', action='store_true', help='replace an existing database')
+    args = parser.parse_args()
+    generate(args.out_dir, args.cars, args.customers, args.rentals, args.seed, args.as_of, args.force)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""HTTP load driver for the API endpoints.
+
+Runs each scenario for a fixed number of requests at a fixed concurrency and
+reports p50/p95/p99 latency and throughput. It targets either a running
+server (--url) or the app in-process over ASGI (--db-dir, no network). It
+can save a baseline and compare later runs against it.
+
+    uvicorn main:create_app --factory --port 8000   # started from a directory with a generated car_rental.db
+    python benchmarks/load.py --url http://localhost:8000 --save http_baseline.json
+    python benchmarks/load.py --url http://localhost:8000 --compare http_baseline.json
+
+    python benchmarks/load.py --db-dir bench_data --requests 100 --only "GET /cars*"
+"""
+import argparse
+import asyncio
+import contextlib
+import fnmatch
+import io
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, NamedTuple
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _common import compare_results, load_backend, print_table, save_results, summarize  # noqa: E402
+
+
+class Scenario(NamedTuple):
+    name: str                 # "<METHOD> <route template>", matched by --only
+    method: str
+    build: Callable[['Context'], dict]   # -> httpx request kwargs (url, params, json, data, files, ...)
+    auth: bool = False
+    write: bool = False
+
+
+class Context:
+    """Ids sampled from the target before the run, plus a seeded RNG."""
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.car_ids: List[int] = []
+        self.customer_ids: List[int] = []
+        self.completed_rental_ids: List[int] = []
+        self.counter = 0
+
+    def car(self) -> int:
+        return self.rng.choice(self.car_ids)
+
+    def customer(self) -> int:
+        return self.rng.choice(self.customer_ids)
+
+    def completed(self) -> int:
+        return self.rng.choice(self.completed_rental_ids)
+
+    def unique(self) -> int:
+        self.counter += 1
+        return self.counter
+
+    @staticmethod
+    def day(offset: int) -> str:
+        return (datetime.now() + timedelta(days=offset)).strftime('%Y-%m-%d')
+
+
+def get(path, **params) -> Callable[[Context], dict]:
+    # path and parameter values may be callables taking the Context.
+    return lambda ctx: {'url': path(ctx) if callable(path) else path,
+                        'params': {k: v(ctx) if callable(v) else v for k, v in params.items()}}
+
+
+SCENARIOS: List[Scenario] = [
+    Scenario('GET /cars', 'GET', get('/cars')),
+    Scenario('GET /cars?limit', 'GET', get('/cars', limit=100)),
+    Scenario('GET /cars/inventory', 'GET', get('/cars/inventory')),
+    Scenario('GET /cars/available', 'GET', get('/cars/available')),
+    Scenario('GET /cars/available?start&end', 'GET',
+             get('/cars/available', start=lambda c: c.day(1), end=lambda c: c.day(c.rng.randint(2, 14)))),
+    Scenario('GET /customers?limit', 'GET', get('/customers', limit=100, cursor=lambda c: c.customer())),
+    Scenario('GET /customers?q', 'GET', get('/customers', limit=20, q=lambda c: f'customer{c.customer()}@')),
+    Scenario('GET /rentals?limit', 'GET', get('/rentals', limit=100)),
+    Scenario('GET /rentals?status=active', 'GET', get('/rentals', limit=100, status='active')),
+    Scenario('GET /rentals?car_id', 'GET', get('/rentals', limit=100, car_id=lambda c: c.car())),
+    Scenario('GET /rentals/active', 'GET', get('/rentals/active')),
+    Scenario('GET /invoices?limit', 'GET', get('/invoices', limit=100)),
+    Scenario('GET /invoices?rental_ids', 'GET',
+             lambda c: {'url': '/invoices', 'params': [('rental_ids', c.completed()) for _ in range(20)]}),
+    Scenario('GET /rentals/{rental_id}/invoice', 'GET', get(lambda c: f'/rentals/{c.completed()}/invoice')),
+    Scenario('GET /rentals/{rental_id}/invoice.pdf', 'GET', get(lambda c: f'/rentals/{c.completed()}/invoice.pdf')),
+    Scenario('GET /invoices/pdf', 'GET', get('/invoices/pdf', **{'from': lambda c: c.day(-1), 'to': lambda c: c.day(0)})),
+    Scenario('GET /cars/{car_id}/insurance', 'GET', get(lambda c: f'/cars/{c.car()}/insurance')),
+    Scenario('GET /cars/{car_id}/legal-docs', 'GET', get(lambda c: f'/cars/{c.car()}/legal-docs')),
+    Scenario('GET /compliance/matrix', 'GET', get('/compliance/matrix')),
+    Scenario('GET /notifications', 'GET', get('/notifications')),
+    Scenario('GET /maintenance/upcoming', 'GET', get('/maintenance/upcoming')),
+    Scenario('GET /users', 'GET', get('/users'), auth=True),
+    Scenario('GET /stats', 'GET', get('/stats')),
+    Scenario('GET /settings', 'GET', get('/settings')),
+    Scenario('GET /export/{dataset}.{fmt}', 'GET',
+             get('/export/sales.ndjson', date_from=lambda c: c.day(-7), date_to=lambda c: c.day(0))),
+    # Writes: only with --writes, and never against data you care about.
+    Scenario('POST /auth/login', 'POST', lambda c: {'url': '/auth/login', 'json': LOGIN}, write=True),
+    Scenario('POST /cars', 'POST', lambda c: {'url': '/cars', 'json': {
+        'make': 'Load', 'model': f'Test {c.unique()}', 'year': 2020, 'price_per_day': 5000}}, write=True),
+    Scenario('POST /customers', 'POST', lambda c: {'url': '/customers', 'data': {
+        'name': 'Load Test', 'email': f'load{time.time_ns()}.{c.unique()}@example.com'}}, write=True),
+    Scenario('POST /rentals/batch', 'POST', lambda c: {'url': '/rentals/batch', 'json': [
+        {'car_id': c.car(), 'customer_id': c.customer(), 'start_date': c.day(3000 + c.unique()), 'days': 1}]},
+        write=True),
+    Scenario('POST /cars/{car_id}/insurance', 'POST', lambda c: {'url': f'/cars/{c.car()}/insurance', 'data': {
+        'provider': 'Load', 'policy_number': f'L-{c.unique()}', 'start_date': c.day(0), 'end_date': c.day(365)}},
+        write=True),
+    Scenario('POST /cars/{car_id}/legal-docs', 'POST', lambda c: {'url': f'/cars/{c.car()}/legal-docs', 'data': {
+        'doc_type': 'Load Test', 'expiry_date': c.day(365)}}, write=True),
+    Scenario('POST /maintenance', 'POST', lambda c: {'url': '/maintenance', 'json': {
+        'car_id': c.car(), 'maint_type': 'Load', 'due_date': c.day(20)}}, write=True),
+    Scenario('POST /import/customers', 'POST', lambda c: {'url': '/import/customers', 'files': {'file': (
+        'customers.csv', io.BytesIO(f'name,email\nLoad,import{time.time_ns()}.{c.unique()}@example.com\n'.encode()),
+        'text/csv')}}, write=True),
+]
+LOGIN = {'email': 'admin@local', 'password': 'admin123'}
+
+
+async def prepare(client: httpx.AsyncClient, ctx: Context, login: dict) -> Dict[str, str]:
+    ctx.car_ids = [car['id'] for car in (await client.get('/cars', params={'limit': 1000})).json()]
+    ctx.customer_ids = [cu['id'] for cu in (await client.get('/customers', params={'limit': 1000})).json()]
+    ctx.completed_rental_ids = [inv['rental_id'] for inv in (await client.get('/invoices', params={'limit': 1000})).json()]
+    if not (ctx.car_ids and ctx.customer_ids and ctx.completed_rental_ids):
+        raise SystemExit('Target has no cars, customers or completed rentals; run benchmarks/generate.py first.')
+    response = await client.post('/auth/login', json=login)
+    token = response.json().get('token') if response.status_code == 200 else None
+    return {'Authorization': f'Bearer {token}'} if token else {}
+
+
+async def run_scenario(client: httpx.AsyncClient, ctx: Context, scenario: Scenario, requests: int,
+                       concurrency: int, auth_headers: Dict[str, str]) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            kwargs = scenario.build(ctx)
+            if scenario.auth:
+                kwargs['headers'] = auth_headers
+            started = time.perf_counter()
+            try:
+                response = await client.request(scenario.method, **kwargs)
+                await response.aread()
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    result = summarize(latencies)
+    result.update({'errors': errors, 'rps': len(latencies) / elapsed if elapsed else 0.0})
+    return result
+
+
+def uncovered_routes(app, scenarios: List[Scenario]) -> List[str]:
+    covered = {s.name.split('?')[0] for s in scenarios}
+    missing = []
+    for route in app.routes:
+        for method in sorted(getattr(route, 'methods', None) or []):
+            if method in ('HEAD', 'OPTIONS') or route.path.startswith(('/docs', '/redoc', '/openapi')):
+                continue
+            if f'{method} {route.path}' not in covered:
+                missing.append(f'{method} {route.path}')
+    return missing
+
+
+async def main_async(args) -> int:
+    if args.url:
+        transport, base_url, app = None, args.url.rstrip('/'), None
+        lifespan = contextlib.nullcontext()
+    else:
+        backend = load_backend(os.path.abspath(args.db_dir))
+        app = backend.create_app()
+        transport, base_url = httpx.ASGITransport(app=app), 'http://bench'
+        # ASGITransport does not send lifespan events; start the app directly.
+        lifespan = app.router.lifespan_context(app)
+    scenarios = [s for s in SCENARIOS
+                 if fnmatch.fnmatch(s.name, args.only) and (args.writes or not s.write)]
+    ctx = Context(random.Random(args.seed))
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with lifespan, httpx.AsyncClient(base_url=base_url, transport=transport, limits=limits,
+                                           timeout=120) as client:
+        auth_headers = await prepare(client, ctx, LOGIN)
+        print(f'{len(scenarios)} scenarios x {args.requests} requests, concurrency {args.concurrency}'
+              f' against {args.url or args.db_dir}')
+        results = {}
+        for scenario in scenarios:
+            for _ in range(args.warmup):
+                kwargs = scenario.build(ctx)
+                await client.request(scenario.method, headers=auth_headers if scenario.auth else None, **kwargs)
+            results[scenario.name] = await run_scenario(
+                client, ctx, scenario, args.requests, args.concurrency, auth_headers)
+            print(f'  {scenario.name:<40}{results[scenario.name]["p95_ms"]:>10.2f} ms p95', flush=True)
+
+    print()
+    print_table(results, ['count', 'errors', 'rps', 'p50_ms', 'p95_ms', 'p99_ms'])
+    if app is not None and args.only == '*':
+        missing = uncovered_routes(app, SCENARIOS)
+        if missing:
+            print('\nRoutes without a scenario: ' + ', '.join(missing))
+    meta = {'target': args.url or os.path.abspath(args.db_dir), 'requests': args.requests,
+            'concurrency': args.concurrency, 'run_at': datetime.now().isoformat(timespec='seconds')}
+    if args.save:
+        save_results(args.save, results, meta)
+    if args.compare and compare_results(args.compare, results, tolerance=args.tolerance):
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--url', help='base URL of a running server')
+    target.add_argument('--db-dir', help='run the app in-process from this directory (holding car_rental.db)')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=3, help='unmeasured requests per scenario')
+    parser.add_argument('--only', default='*', help='glob over scenario names, e.g. "GET /rentals*"')
+    parser.add_argument('--writes', action='store_true', help='include scenarios that modify data')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help='write results to this JSON file')
+    parser.add_argument('--compare', help='compare p95 against a saved JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
+
+
+if __name__ == '__main__':
+    main()
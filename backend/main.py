@@ -1,26 +1,288 @@
-from fastapi import FastAPI, HTTPException, Query, UploadFile, File, Form
+from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException, Query, Request, UploadFile, File, Form, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional, Any, Dict
+from pydantic import BaseModel, ValidationError
+from typing import List, Optional, Any, Dict, Iterator, AsyncIterator, Iterable, Callable
 import sqlite3
 import traceback
 from datetime import datetime, timedelta
 import logging
 
 import json
+import re
+import sys
+import threading
+from collections import namedtuple
+import tempfile
+import mimetypes
+import bisect
+import copy
+from collections import OrderedDict
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import time
+import csv
+import io
+import zipfile
+import heapq
+from contextlib import asynccontextmanager, contextmanager
+import zlib
+import glob
+from collections import deque
 
 import secrets
+import random
 import hashlib
+import orjson
 from typing import Tuple
 
 
 import os
+try:
+    import fcntl
+except ImportError:  # Windows: startup falls back to the migrations' own locking
+    fcntl = None
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse, FileResponse
+from starlette.staticfiles import NotModifiedResponse
+from starlette.datastructures import Headers
+from starlette.concurrency import run_in_threadpool
 
 # Helper to sanitize filenames for uploads
 def _safe_filename(fname: str) -> str:
     return fname.replace("/", "_").replace("\\", "_")
 
+# Upload pipeline: uploads are streamed in fixed-size chunks to a temp file,
+# checked against the category's size and type limits, and stored once per
+# SHA-256 digest under uploads/blobs/<aa>/<digest><ext>. Identical files from
+# any category share one blob; Database.gc_uploads removes unreferenced ones.
+# Files only enter or leave uploads/blobs/<aa>/ under the database write lock
+# (register_blob and gc_uploads), so a collection can never remove a blob that
+# an identical upload is registering at the same moment.
+UPLOAD_ROOT = 'uploads'
+BLOB_DIR = 'blobs'
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+_DOCUMENT_TYPES = {'application/pdf', 'image/jpeg', 'image/png', 'image/webp', 'image/heic', 'image/heif'}
+UPLOAD_LIMITS: Dict[str, Tuple[int, set]] = {
+    'customers': (15 * 1024 * 1024, _DOCUMENT_TYPES),
+    'insurances': (25 * 1024 * 1024, _DOCUMENT_TYPES),
+    'legal_docs': (25 * 1024 * 1024, _DOCUMENT_TYPES),
+    'branding': (2 * 1024 * 1024, {'image/jpeg', 'image/png', 'image/webp', 'image/gif', 'image/svg+xml'}),
+}
+
+StoredUpload = namedtuple('StoredUpload', 'url digest size content_type tmp_path')
+
+def save_upload(upload: UploadFile, category: str) -> StoredUpload:
+    """Spools an upload to a temp file in the blob store and returns where it will land.
+
+    Blocking; call it through run_in_threadpool from async endpoints, then
+    pass the result to Database.register_blob, which moves it into place.
+    """
+    max_bytes, allowed_types = UPLOAD_LIMITS[category]
+    content_type = upload.content_type
+    if not content_type or content_type == 'application/octet-stream':
+        content_type = mimetypes.guess_type(upload.filename)[0]
+    if content_type not in allowed_types:
+        raise HTTPException(status_code=415, detail=f"Unsupported file type for {category}: {content_type or 'unknown'}")
+    blob_root = os.path.join(UPLOAD_ROOT, BLOB_DIR)
+    os.makedirs(blob_root, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=blob_root, prefix='.upload-')
+    try:
+        size = 0
+        digest = hashlib.sha256()
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = upload.file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"File too large: {category} uploads are limited to {max_bytes // (1024 * 1024)} MB")
+                digest.update(chunk)
+                out.write(chunk)
+        hexdigest = digest.hexdigest()
+        ext = os.path.splitext(_safe_filename(upload.filename))[1].lower()
+        if not re.fullmatch(r'\.[a-z0-9]{1,8}', ext):
+            ext = mimetypes.guess_extension(content_type) or ''
+        rel_path = f"{BLOB_DIR}/{hexdigest[:2]}/{hexdigest}{ext}"
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return StoredUpload(f"/uploads/{rel_path}", hexdigest, size, content_type, tmp_path)
+
+# Helper to join optional SQL filter clauses
+def _where(clauses: List[str]) -> str:
+    return (' WHERE ' + ' AND '.join(clauses)) if clauses else ''
+
+# Password hashing. Hashes are stored as "pbkdf2_sha256$<iterations>$<salt>$<hash>";
+# the legacy "<salt>$<hash>" form implies 100k iterations. Raising
+# PASSWORD_ITERATIONS upgrades stored hashes the next time each user logs in.
+PASSWORD_ITERATIONS = int(os.environ.get('PASSWORD_ITERATIONS', 100_000))
+LEGACY_PASSWORD_ITERATIONS = 100_000
+
+def _pbkdf2(password: str, salt: str, iterations: int) -> str:
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), bytes.fromhex(salt), iterations).hex()
+
+def _parse_password_hash(stored: str) -> Tuple[int, str, str]:
+    parts = stored.split('$')
+    if len(parts) == 2:
+        return LEGACY_PASSWORD_ITERATIONS, parts[0], parts[1]
+    algorithm, iterations, salt, hexhash = parts
+    if algorithm != 'pbkdf2_sha256':
+        raise ValueError(f"Unsupported password hash algorithm '{algorithm}'")
+    return int(iterations), salt, hexhash
+
+def hash_password(password: str, iterations: int = PASSWORD_ITERATIONS) -> str:
+    salt = secrets.token_hex(16)
+    return f"pbkdf2_sha256${iterations}${salt}${_pbkdf2(password, salt, iterations)}"
+
+def verify_password(password: str, stored: str) -> bool:
+    try:
+        iterations, salt, hexhash = _parse_password_hash(stored)
+        return secrets.compare_digest(_pbkdf2(password, salt, iterations), hexhash)
+    except Exception:
+        return False
+
+def password_needs_rehash(stored: str, iterations: int = PASSWORD_ITERATIONS) -> bool:
+    try:
+        return _parse_password_hash(stored)[0] != iterations or stored.count('$') == 1
+    except Exception:
+        return True
+
+
+# --- Invoice PDFs ---
+# A deliberately small PDF writer (one A4 page, built-in Helvetica), so the
+# backend can produce invoices without a rendering dependency. The layout
+# mirrors InvoicePDF in Invoices.jsx. Output is deterministic for a given
+# invoice and settings, which is what makes caching the files safe.
+INVOICE_DEFAULTS = {
+    'companyName': 'Akalanka Enterprises',
+    'address': 'Colombo, Sri Lanka',
+    'phone': '+94 77 000 0000',
+    'email': 'billing@akalanka.lk',
+    'currency': 'LKR',
+}
+# Helvetica advance widths (1/1000 em) for the characters that appear in
+# right-aligned amounts; anything else is approximated.
+_HELVETICA_WIDTHS = {**dict.fromkeys('0123456789', 556), ',': 278, '.': 278, ' ': 278, '-': 333,
+                     '#': 556, ':': 278, 'K': 667, 'L': 556, 'R': 722}
+
+
+def _pdf_string(text: str) -> bytes:
+    raw = str(text).encode('cp1252', errors='replace')
+    return b'(' + raw.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def _pdf_text_width(text: str, size: float) -> float:
+    return sum(_HELVETICA_WIDTHS.get(ch, 667 if ch.isupper() else 556) for ch in text) * size / 1000
+
+
+def _pdf_color(hex_color: str, default=(0.15, 0.39, 0.92)) -> Tuple[float, float, float]:
+    m = re.fullmatch(r'#?([0-9a-fA-F]{6})', hex_color or '')
+    if not m:
+        return default
+    return tuple(int(m.group(1)[i:i + 2], 16) / 255 for i in (0, 2, 4))
+
+
+def _pdf_document(content: bytes) -> bytes:
+    stream = zlib.compress(content)
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+        b'/Resources << /Font << /F1 4 0 R /F2 5 0 R >> >> /Contents 6 0 R >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+        b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(stream) + stream + b'\nendstream',
+    ]
+    out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def render_invoice_pdf(invoice: Dict[str, Any], settings: Dict[str, Any]) -> bytes:
+    """Renders one invoice (the dict returned by GET /rentals/{id}/invoice) as PDF bytes.
+
+    Module-level so it can run on a process pool.
+    """
+    general = {**INVOICE_DEFAULTS, **{k: v for k, v in (settings.get('general') or {}).items() if v}}
+    branding = settings.get('branding') or {}
+    company, currency = general['companyName'], general['currency']
+    ops: List[bytes] = []
+
+    def text(x, y, value, size=10, bold=False, align='left', gray=0.22):
+        if align == 'right':
+            x -= _pdf_text_width(str(value), size)
+        ops.append(b'BT %.3f g /%s %g Tf %.2f %.2f Td %s Tj ET' % (
+            gray, b'F2' if bold else b'F1', size, x, y, _pdf_string(value)))
+
+    def rule(y, width=0.5, color=(0.82, 0.84, 0.86)):
+        ops.append(b'%.3f %.3f %.3f RG %g w 40 %.2f m 555 %.2f l S' % (*color, width, y, y))
+
+    def money(n):
+        return f"{currency} {float(n or 0):,.2f}"
+
+    accent = _pdf_color(branding.get('accent'))
+    total = float(invoice.get('total_cost') or 0)
+    deposit = float(invoice.get('deposit_amount') or 0)
+
+    # Letterhead
+    text(40, 790, company, size=18, bold=True, gray=0.07)
+    text(40, 772, 'Vehicle Rentals & Services', size=10, gray=0.42)
+    text(555, 790, 'INVOICE', size=20, bold=True, align='right', gray=0.07)
+    text(555, 772, f"Invoice #: {invoice['sale_id']}", size=10, align='right')
+    text(555, 758, f"Date: {invoice['sale_date']}", size=10, align='right')
+    rule(744, width=2, color=accent)
+
+    # Parties
+    text(40, 722, 'From', size=11, bold=True, gray=0.07)
+    for i, line in enumerate([company, general['address'], f"Phone: {general['phone']}", f"Email: {general['email']}"]):
+        text(40, 706 - 14 * i, line)
+    text(320, 722, 'Bill To', size=11, bold=True, gray=0.07)
+    text(320, 706, invoice['customer_name'])
+    text(320, 692, invoice['customer_email'])
+
+    # Line item
+    ops.append(b'0.953 0.957 0.965 rg 40 618 515 20 re f')
+    for x, label, align in [(48, 'Qty', 'left'), (90, 'Description', 'left'), (440, 'Rate', 'right'), (547, 'Amount', 'right')]:
+        text(x, 624, label, size=10, bold=True, align=align, gray=0.07)
+    vehicle = f"{invoice['car_year']} {invoice['car_make']} {invoice['car_model']}"
+    text(48, 600, '1')
+    text(90, 600, f"Car Rental \u2014 {vehicle} (Rental #{invoice['rental_id']})")
+    text(90, 586, f"Period: {invoice['start_date']} to {invoice['end_date']}")
+    text(440, 600, money(total), align='right')
+    text(547, 600, money(total), align='right')
+    rule(574)
+
+    # Totals
+    for i, (label, value, strong) in enumerate([
+        ('Subtotal', money(total), False),
+        ('Deposit Paid', f"- {money(deposit)}", False),
+        ('Total Due', money(total - deposit), True),
+    ]):
+        y = 552 - 18 * i
+        text(360, y, label, bold=strong, gray=0.07 if strong else 0.22)
+        text(547, y, value, bold=strong, align='right', gray=0.07 if strong else 0.22)
+    text(40, 552, f"Status: {'Paid' if invoice.get('is_paid') else 'Unpaid'}")
+    text(40, 538, f"Payment method: {invoice.get('payment_method') or 'N/A'}")
+
+    # Notes and footer
+    text(40, 480, f"Thank you for choosing {company}. Please make payment within 7 days of the", size=9, gray=0.42)
+    text(40, 468, f"invoice date. For bank transfers, use Invoice #{invoice['sale_id']} as the reference.", size=9, gray=0.42)
+    rule(60)
+    text(40, 46, branding.get('footerNote') or 'This is a system-generated invoice.', size=9, gray=0.42)
+    return _pdf_document(b'\n'.join(ops))
+
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -110,194 +372,947 @@ class User(BaseModel):
     password: Optional[str] = None  # write-only on create
 
 
+OPEN_END_DATE = '9999-12-31'
+
+
+class AvailabilityIndex:
+    """In-memory booking intervals per car, built from the rentals table.
+
+    Each car keeps its bookings sorted by start date together with a running
+    maximum of end dates, so "does anything overlap [start, end]?" is a single
+    bisect: O(log n) per car instead of a table scan. Dates are YYYY-MM-DD
+    strings; an open-ended rental ends at OPEN_END_DATE.
+    """
+
+    def __init__(self, rows=()):
+        # car_id -> [starts, ends, rental_ids, prefix max of ends]
+        self._cars: Dict[int, List[list]] = {}
+        self._lock = threading.Lock()
+        for rental_id, car_id, start, end in rows:
+            starts, ends, ids, _ = self._cars.setdefault(car_id, [[], [], [], []])
+            starts.append(start)
+            ends.append(end or OPEN_END_DATE)
+            ids.append(rental_id)
+        for car in self._cars.values():
+            order = sorted(range(len(car[0])), key=car[0].__getitem__)
+            car[0], car[1], car[2] = [[col[i] for i in order] for col in car[:3]]
+            self._refresh(car, 0)
+
+    @staticmethod
+    def _refresh(car: List[list], i: int):
+        starts, ends, _, max_end = car
+        del max_end[i:]
+        for end in ends[i:]:
+            max_end.append(max(end, max_end[-1]) if max_end else end)
+
+    def add(self, car_id: int, rental_id: int, start: str, end: Optional[str]):
+        with self._lock:
+            car = self._cars.setdefault(car_id, [[], [], [], []])
+            i = bisect.bisect_right(car[0], start)
+            car[0].insert(i, start)
+            car[1].insert(i, end or OPEN_END_DATE)
+            car[2].insert(i, rental_id)
+            self._refresh(car, i)
+
+    def set_end(self, car_id: int, rental_id: int, end: Optional[str]):
+        with self._lock:
+            car = self._cars.get(car_id)
+            if car and rental_id in car[2]:
+                i = car[2].index(rental_id)
+                car[1][i] = end or OPEN_END_DATE
+                self._refresh(car, i)
+
+    def is_free(self, car_id: int, start: str, end: Optional[str]) -> bool:
+        with self._lock:
+            car = self._cars.get(car_id)
+            if not car:
+                return True
+            # Bookings starting on or before `end` overlap unless all of them
+            # finished before `start`.
+            i = bisect.bisect_right(car[0], end or OPEN_END_DATE)
+            return i == 0 or car[3][i - 1] < start
+
+
+class Metrics:
+    """In-process counters, gauges and histograms, rendered in the Prometheus
+    text format by GET /metrics.
+
+    Series are keyed by a tuple of label values. Every update is one dict
+    lookup plus a bisect under a single lock, cheap enough to leave on.
+    Counts are per process; with several workers, scrape each one or sum.
+    """
+
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> (type, help, label names, buckets)
+        self._meta: Dict[str, Tuple[str, str, Tuple[str, ...], Tuple[float, ...]]] = OrderedDict()
+        self._values: Dict[str, Dict[tuple, Any]] = {}
+        self._gauges: Dict[str, Callable[[], Dict[tuple, float]]] = {}
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self._meta[name] = ('counter', help, labels, ())
+        self._values[name] = {}
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self._meta[name] = ('histogram', help, labels, tuple(buckets))
+        self._values[name] = {}
+
+    def gauge(self, name: str, help: str, labels: Tuple[str, ...], collect: Callable[[], Dict[tuple, float]]):
+        # Gauges are read at scrape time from collect().
+        self._meta[name] = ('gauge', help, labels, ())
+        self._gauges[name] = collect
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1):
+        series = self._values[name]
+        with self._lock:
+            series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name: str, labels: tuple, value: float):
+        buckets = self._meta[name][3]
+        series = self._values[name]
+        with self._lock:
+            entry = series.get(labels)
+            if entry is None:
+                # [per-bucket counts (last one is +Inf), sum]
+                entry = series[labels] = [[0] * (len(buckets) + 1), 0.0]
+            entry[0][bisect.bisect_left(buckets, value)] += 1
+            entry[1] += value
+
+    @staticmethod
+    def _labels(names: Tuple[str, ...], values: tuple, extra: str = '') -> str:
+        parts = ['%s="%s"' % (n, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                 for n, v in zip(names, values)]
+        if extra:
+            parts.append(extra)
+        return '{' + ','.join(parts) + '}' if parts else ''
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            snapshot = {name: {k: copy.deepcopy(v) for k, v in series.items()} for name, series in self._values.items()}
+        for name, (kind, help, labels, buckets) in self._meta.items():
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'gauge':
+                for values, value in self._gauges[name]().items():
+                    lines.append(f'{name}{self._labels(labels, values)} {value}')
+            elif kind == 'counter':
+                for values, value in snapshot[name].items():
+                    lines.append(f'{name}{self._labels(labels, values)} {value}')
+            else:
+                for values, (counts, total) in snapshot[name].items():
+                    cumulative = 0
+                    for bound, count in zip(buckets + (float('inf'),), counts):
+                        cumulative += count
+                        le = 'le="%s"' % ('+Inf' if bound == float('inf') else repr(bound))
+                        lines.append(f'{name}_bucket{self._labels(labels, values, le)} {cumulative}')
+                    lines.append(f'{name}_sum{self._labels(labels, values)} {total}')
+                    lines.append(f'{name}_count{self._labels(labels, values)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+metrics.counter('http_requests_total', 'HTTP requests by route template and status.', ('method', 'route', 'status'))
+metrics.histogram('http_request_duration_seconds', 'HTTP request latency by route template.', ('method', 'route'))
+metrics.histogram('db_method_duration_seconds', 'Time spent in each Database method.', ('method',))
+metrics.counter('db_method_rows_total', 'Rows returned by Database list methods.', ('method',))
+metrics.counter('db_method_errors_total', 'Database methods that raised, by kind.', ('method', 'kind'))
+metrics.counter('db_busy_retries_total', 'BEGIN IMMEDIATE attempts retried after the busy timeout.')
+metrics.counter('db_cache_invalidations_total', 'Process-local caches dropped after another process wrote.')
+metrics.histogram('db_lock_wait_seconds', 'Waits for contended in-process locks and for the SQLite write lock.',
+                  ('lock',), buckets=(0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+
+
+class TimedLock:
+    """threading.Lock that reports contended acquisitions to db_lock_wait_seconds."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        # Uncontended acquires take the fast path and record nothing.
+        if not self._lock.acquire(blocking=False):
+            started = time.perf_counter()
+            self._lock.acquire()
+            metrics.observe('db_lock_wait_seconds', (self.name,), time.perf_counter() - started)
+        return self
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+
+class _TracedCursor(sqlite3.Cursor):
+    # Ends the traced statement once its rows are fetched, or right after
+    # execute for statements that return none.
+
+    def execute(self, *args):
+        super().execute(*args)
+        if self.description is None:
+            self.connection.tracer.statement_done()
+        return self
+
+    def executemany(self, *args):
+        super().executemany(*args)
+        self.connection.tracer.statement_done()
+        return self
+
+    def fetchone(self):
+        row = super().fetchone()
+        self.connection.tracer.statement_done()
+        return row
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self.connection.tracer.statement_done()
+        return rows
+
+
+class _TracedConnection(sqlite3.Connection):
+    tracer: 'QueryTracer'
+
+    def cursor(self, factory=_TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+
+class QueryTracer:
+    """Opt-in per-statement SQL profiler (SQL_TRACE=1).
+
+    Attached to each connection with set_trace_callback, which reports every
+    statement SQLite starts, including those run by triggers, with its
+    parameters already expanded into the text. Connections are opened with
+    cursors that mark a statement finished once its rows are fetched (or
+    after execute, when it returns none); anything else ends at the next
+    statement on the same thread or at the end of the Database method.
+
+    Statements are grouped by their text with literals replaced by '?'; the
+    literal types form the parameter shape. Any statement slower than slow_ms
+    is logged with the calling Database methods and its EXPLAIN QUERY PLAN,
+    which is captured once per distinct statement.
+    """
+
+    _LITERAL = re.compile(r"(?i)(x'[0-9a-f]*')|('(?:[^']|'')*')|(?<![\w.])(\d+\.\d*(?:e[+-]?\d+)?|\d+)(?![\w.])")
+    _IN_LIST = re.compile(r'(?i)\bIN \(\?(?:, ?\?)+\)')
+    _EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+    def __init__(self, slow_ms: float = 100.0, max_statements: int = 1000):
+        self.slow_s = slow_ms / 1000
+        self.max_statements = max_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # normalized SQL -> calls, total/max seconds, last shape and callers, plan
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._method_codes: Dict[Any, str] = {}
+
+    def watch(self, cls):
+        # Code objects of cls's functions, unwrapping _instrument, to name the
+        # calling methods from the stack.
+        for name, fn in vars(cls).items():
+            fn = getattr(fn, '__func__', fn)
+            fn = getattr(fn, '__wrapped__', fn)
+            if hasattr(fn, '__code__'):
+                self._method_codes[fn.__code__] = name
+
+    def connect(self, db_name: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(db_name, check_same_thread=False, factory=_TracedConnection)
+        conn.tracer = self
+        conn.set_trace_callback(self._on_statement)
+        return conn
+
+    def statement_done(self):
+        if not getattr(self._local, 'explaining', False):
+            self._close(time.perf_counter())
+
+    @classmethod
+    def normalize(cls, sql: str) -> Tuple[str, str]:
+        """('SELECT ... WHERE id = ?', '(int)') for an expanded statement."""
+        types: List[str] = []
+
+        def literal(m):
+            types.append('bytes' if m.group(1) else 'str' if m.group(2) else 'float' if '.' in m.group(3) else 'int')
+            return '?'
+
+        text = cls._LITERAL.sub(literal, ' '.join(sql.split()))
+        text = cls._IN_LIST.sub('IN (?, ...)', text)
+        runs: List[List[Any]] = []
+        for t in types:
+            if runs and runs[-1][0] == t:
+                runs[-1][1] += 1
+            else:
+                runs.append([t, 1])
+        return text, '(' + ', '.join(t if n == 1 else f'{t}*{n}' for t, n in runs) + ')'
+
+    def _callers(self) -> str:
+        names = []
+        frame = sys._getframe(2)
+        while frame is not None:
+            name = self._method_codes.get(frame.f_code)
+            if name and (not names or names[-1] != name):
+                names.append(name)
+            frame = frame.f_back
+        return ' > '.join(reversed(names)) or '?'
+
+    def _on_statement(self, sql: str):
+        local = self._local
+        if getattr(local, 'explaining', False):
+            return
+        current = getattr(local, 'current', None)
+        if current is not None and current[0] == sql:
+            return  # trigger sub-statements are reported with the parent's text
+        now = time.perf_counter()
+        self._close(now)
+        local.current = (sql, now, self._callers())
+
+    def _close(self, now: float):
+        local = self._local
+        current = getattr(local, 'current', None)
+        if current is None:
+            return
+        local.current = None
+        sql, started, callers = current
+        elapsed = now - started
+        text, shape = self.normalize(sql)
+        with self._lock:
+            entry = self._stats.get(text)
+            if entry is None:
+                if len(self._stats) >= self.max_statements:
+                    return
+                entry = self._stats[text] = {'sql': text, 'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                                             'slow_calls': 0, 'shape': shape, 'callers': callers, 'plan': None}
+            entry['calls'] += 1
+            entry['total_ms'] += elapsed * 1000
+            entry['max_ms'] = max(entry['max_ms'], elapsed * 1000)
+            entry['shape'], entry['callers'] = shape, callers
+            if elapsed < self.slow_s:
+                return
+            entry['slow_calls'] += 1
+        if not hasattr(local, 'slow'):
+            local.slow = []
+        local.slow.append((text, sql, shape, callers, elapsed))
+
+    def flush(self, conn: Optional[sqlite3.Connection]):
+        """Ends the running statement and logs pending slow ones. Called at the
+        end of every Database method, when the connection is free for EXPLAIN;
+        without one, the plan waits for the statement's next slow call."""
+        local = self._local
+        self._close(time.perf_counter())
+        slow = getattr(local, 'slow', None)
+        if not slow:
+            return
+        local.slow = []
+        for text, sql, shape, callers, elapsed in slow:
+            with self._lock:
+                plan = self._stats[text]['plan'] if text in self._stats else None
+            if plan is None and conn is not None and sql.lstrip().upper().startswith(self._EXPLAINABLE):
+                plan = self._explain(conn, sql)
+                with self._lock:
+                    if text in self._stats:
+                        self._stats[text]['plan'] = plan
+            logger.warning(f"Slow SQL ({elapsed * 1000:.1f} ms) in {callers}, params {shape}: {text}"
+                           + ("\n  plan: " + '\n  plan: '.join(plan) if plan else ''))
+
+    def _explain(self, conn: sqlite3.Connection, sql: str) -> List[str]:
+        self._local.explaining = True
+        try:
+            rows = conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+            # (id, parent, notused, detail); indent children under parents.
+            depth = {0: 0}
+            plan = []
+            for node, parent, _, detail in rows:
+                depth[node] = depth.get(parent, 0) + 1
+                plan.append('  ' * (depth[node] - 1) + detail)
+            return plan
+        except sqlite3.Error as e:
+            return [f'(unavailable: {e})']
+        finally:
+            self._local.explaining = False
+
+    def top(self, limit: int = 20, order: str = 'total_ms') -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = [dict(e) for e in self._stats.values()]
+        for e in entries:
+            e['mean_ms'] = e['total_ms'] / e['calls']
+        return sorted(entries, key=lambda e: e[order], reverse=True)[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+def _instrument(cls):
+    """Wraps every public method of cls to record its duration, list sizes
+    and failures. sqlite3 'database is locked' errors are counted as busy."""
+    def wrap(name, fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                metrics.inc('db_method_errors_total', (name, 'busy' if 'locked' in str(e) else 'sqlite'))
+                raise
+            except HTTPException as e:
+                metrics.inc('db_method_errors_total', (name, 'http_%d' % e.status_code))
+                raise
+            except Exception:
+                metrics.inc('db_method_errors_total', (name, 'error'))
+                raise
+            finally:
+                metrics.observe('db_method_duration_seconds', (name,), time.perf_counter() - started)
+                tracer = args[0].tracer
+                if tracer is not None:
+                    # The connection the method ran on, if any: generator
+                    # methods return on the event loop without touching one.
+                    tracer.flush(getattr(args[0]._local, 'conn', None))
+            if isinstance(result, list):
+                metrics.inc('db_method_rows_total', (name,), len(result))
+            return result
+        return timed
+
+    for name, fn in list(vars(cls).items()):
+        if name.startswith('_') or name == 'close' or not callable(fn):
+            continue
+        if isinstance(fn, (staticmethod, classmethod)):
+            continue
+        setattr(cls, name, wrap(name, fn))
+    return cls
+
+
 # Database class
+@contextmanager
+def _file_lock(path: str):
+    """Exclusive advisory lock on path, held across processes for the block."""
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@_instrument
 class Database:
-    def __init__(self, db_name='car_rental.db'):
-        self.conn = sqlite3.connect(db_name, check_same_thread=False)
-        self.create_tables()
-        self._bootstrap_admin()
+    # Storage profile applied to every pooled connection. journal_mode=WAL lets
+    # readers run alongside the rental/return writers; override any entry via
+    # Database(pragmas={...}).
+    DEFAULT_PRAGMAS: Dict[str, Any] = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -16000,  # negative = KiB, i.e. ~16 MB per connection
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    }
+
+    def __init__(self, db_name='car_rental.db', pragmas: Optional[Dict[str, Any]] = None,
+                 tracer: Optional[QueryTracer] = None):
+        self.db_name = db_name
+        self.tracer = tracer
+        if tracer is not None:
+            tracer.watch(type(self))
+        self.pragmas = {**self.DEFAULT_PRAGMAS, **(pragmas or {})}
+        # One connection per worker thread, so concurrent `with self.conn:`
+        # blocks never share a transaction.
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = TimedLock('connections')
+        # Dashboard counters for get_stats: loaded on first use, then kept
+        # current by the write methods and fully recomputed once per day.
+        self._stats: Optional[Dict[str, Any]] = None
+        self._stats_day: Optional[str] = None
+        self._stats_lock = TimedLock('stats')
+        # Bumped by every recompute. A write bumps the counters only if the
+        # snapshot is the one that existed when its transaction began.
+        self._stats_generation = 0
+        # Parsed settings snapshot: (version, data, raw JSON). The version lives
+        # in the settings row and is bumped by every save_settings.
+        self._settings: Optional[Tuple[int, Dict[str, Any], str]] = None
+        self._settings_lock = TimedLock('settings')
+        # Built on first availability check, then maintained by add_rental and
+        # update_rental_end. The generation counts rebuilds, like
+        # _stats_generation does for the stats snapshot.
+        self._availability: Optional[AvailabilityIndex] = None
+        self._availability_generation = 0
+        self._availability_lock = TimedLock('availability')
+        # Called as listener(alert_date, kind, source_id) for items that will
+        # enter the notification window later; set by ExpiryScheduler.
+        self.notification_listener: Optional[Callable[[str, str, int], None]] = None
+        # Cross-process cache coherence: triggers bump a per-table counter in
+        # table_changes on every write to a cached table. _seen_changes holds
+        # the counts this process's caches agree with; a higher count means
+        # another process (or a write outside _write_txn) changed that table,
+        # and only the caches built from it are dropped.
+        self._seen_changes: Optional[Dict[str, int]] = None
+        self._changes_lock = threading.Lock()
+        # (tables, callback): callback() runs when any of the tables changes
+        # elsewhere.
+        self.change_listeners: List[Tuple[set, Callable[[], None]]] = []
+
+    def initialize(self):
+        """Applies pending migrations and creates the default admin. Run once at
+        startup (the app does it in its lifespan), not on construction.
+
+        Serialized across processes with a lock file next to the database, so
+        uvicorn workers starting together do this one at a time; all but the
+        first find the schema current and the admin present."""
+        with _file_lock(self.db_name + '.lock'):
+            self.create_tables()
+            self._bootstrap_admin()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.tracer is not None:
+            conn = self.tracer.connect(self.db_name)
+        else:
+            conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    # Extra BEGIN IMMEDIATE attempts after busy_timeout expires, with jittered
+    # backoff, so a long writer in another worker delays requests rather than
+    # failing them.
+    BUSY_RETRIES = 3
+
+    def _begin_immediate(self, cursor: sqlite3.Cursor):
+        # Time spent here is time waiting for another writer (busy_timeout).
+        started = time.perf_counter()
+        for attempt in range(self.BUSY_RETRIES + 1):
+            try:
+                cursor.execute('BEGIN IMMEDIATE')
+                break
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) or attempt == self.BUSY_RETRIES:
+                    raise
+                metrics.inc('db_busy_retries_total')
+                time.sleep(random.uniform(0.05, 0.25) * (attempt + 1))
+        metrics.observe('db_lock_wait_seconds', ('sqlite_write',), time.perf_counter() - started)
+
+    @contextmanager
+    def _write_txn(self):
+        """`with self.conn:` for writes to cached tables.
+
+        Takes the write lock up front, first catching up with writes made
+        elsewhere, and reads the table counters again at the end of the body.
+        Our own increments are recorded as seen before the commit, while the
+        lock is still held, so no reader in this process can mistake them for
+        another process's writes. If the commit fails they are taken back.
+        """
+        if self.conn.in_transaction:
+            # Part of a caller's transaction; the counters move unaccounted and
+            # the next poll drops the affected caches.
+            self._local.stats_generation = None
+            self._local.availability_generation = None
+            yield
+            return
+        before = None
+        try:
+            with self.conn:
+                c = self.conn.cursor()
+                self._begin_immediate(c)
+                self._local.stats_generation = self._stats_generation
+                self._local.availability_generation = self._availability_generation
+                counts = self._change_counts(c)
+                self._observe_changes(counts)
+                yield
+                after = self._change_counts(c)
+                with self._changes_lock:
+                    before = dict(self._seen_changes)
+                    self._seen_changes.update(after)
+        except BaseException:
+            if before is not None:
+                with self._changes_lock:
+                    self._seen_changes = before
+            raise
+
+    # Process-local caches and the tables they are built from.
+    CACHE_TABLES: Dict[str, set] = {
+        'stats': {'cars', 'customers', 'rentals', 'sales', 'insurances', 'legal_documents', 'maintenance', 'users'},
+        'settings': {'settings'},
+        'availability': {'rentals'},
+    }
+
+    # Tables whose writes bump table_changes, whoever makes them: everything
+    # behind CACHE_TABLES, plus session deletes for the admin session cache.
+    WATCHED_TABLES: Dict[str, Tuple[str, ...]] = {
+        **{table: ('INSERT', 'UPDATE', 'DELETE')
+           for table in sorted(set().union(*CACHE_TABLES.values()))},
+        'sessions': ('DELETE',),
+    }
+
+    @staticmethod
+    def _change_counts(c: sqlite3.Cursor) -> Dict[str, int]:
+        return dict(c.execute('SELECT table_name, value FROM table_changes').fetchall())
+
+    def _observe_changes(self, counts: Dict[str, int]):
+        with self._changes_lock:
+            if self._seen_changes is None:
+                self._seen_changes = counts
+                return
+            # Counters only grow; a lower count is a read from before one of
+            # our own commits, not a change.
+            changed = {table for table, value in counts.items() if value > self._seen_changes.get(table, -1)}
+            if not changed:
+                return
+            for table in changed:
+                self._seen_changes[table] = counts[table]
+        metrics.inc('db_cache_invalidations_total')
+        if changed & self.CACHE_TABLES['stats']:
+            with self._stats_lock:
+                self._stats = None
+        if changed & self.CACHE_TABLES['settings']:
+            with self._settings_lock:
+                self._settings = None
+        if changed & self.CACHE_TABLES['availability']:
+            with self._availability_lock:
+                self._availability = None
+        for tables, listener in self.change_listeners:
+            if changed & tables:
+                listener()
+
+    def sync_changes(self):
+        """Drops the process-local caches built from tables that changed
+        elsewhere. Polled by the app in the background (change_poll_seconds),
+        so cached reads never query the counters themselves."""
+        self._observe_changes(self._change_counts(self.conn.cursor()))
+
+    # Ordered schema migrations: (version, description, method name). Each step
+    # runs exactly once per database; append new steps, never edit shipped ones.
+    MIGRATIONS: List[Tuple[int, str, str]] = [
+        (1, 'base schema', '_migration_base_schema'),
+        (2, 'hot-query indexes', '_migration_hot_query_indexes'),
+        (3, 'rental customer index', '_migration_rental_customer_index'),
+        (4, 'settings version', '_migration_settings_version'),
+        (5, 'upload blob store', '_migration_upload_blobs'),
+        (6, 'compliance indexes', '_migration_compliance_indexes'),
+        (7, 'notifications', '_migration_notifications'),
+        (8, 'per-table change counters', '_migration_table_changes'),
+        (9, 'login attempts', '_migration_login_attempts'),
+    ]
 
     def create_tables(self):
         try:
+            # Warm start: a single read, and no write lock, when nothing is pending.
+            try:
+                row = self.conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()
+                if row[0] >= self.MIGRATIONS[-1][0]:
+                    return
+            except sqlite3.OperationalError:
+                pass  # new database, no schema_version table yet
             with self.conn:
                 cursor = self.conn.cursor()
                 cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS cars (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        make TEXT NOT NULL,
-                        model TEXT NOT NULL,
-                        year INTEGER NOT NULL,
-                        price_per_day REAL NOT NULL,
-                        available BOOLEAN NOT NULL DEFAULT 1
-                    )
-                ''')
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS customers (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    CREATE TABLE IF NOT EXISTS schema_version (
+                        version INTEGER PRIMARY KEY,
                         name TEXT NOT NULL,
-                        email TEXT NOT NULL UNIQUE
+                        applied_at TEXT NOT NULL
                     )
                 ''')
-                # Ensure new columns exist on customers
-                cursor.execute("PRAGMA table_info(customers)")
-                cols = [r[1] for r in cursor.fetchall()]
-                if 'id_card_url' not in cols:
-                    cursor.execute("ALTER TABLE customers ADD COLUMN id_card_url TEXT")
-                if 'driving_license_url' not in cols:
-                    cursor.execute("ALTER TABLE customers ADD COLUMN driving_license_url TEXT")
-                if 'phone' not in cols:
-                    cursor.execute("ALTER TABLE customers ADD COLUMN phone TEXT")
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS rentals (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        car_id INTEGER NOT NULL,
-                        customer_id INTEGER NOT NULL,
-                        start_date TEXT NOT NULL,
-                        end_date TEXT,
-                        total_cost REAL,
-                        deposit_amount REAL NOT NULL DEFAULT 0.0,
-                        is_paid BOOLEAN NOT NULL DEFAULT 0,
-                        payment_method TEXT,
-                        FOREIGN KEY (car_id) REFERENCES cars(id),
-                        FOREIGN KEY (customer_id) REFERENCES customers(id)
-                    )
-                ''')
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS sales (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        rental_id INTEGER NOT NULL,
-                        customer_id INTEGER NOT NULL,
-                        car_id INTEGER NOT NULL,
-                        total_cost REAL NOT NULL,
-                        sale_date TEXT NOT NULL,
-                        FOREIGN KEY (rental_id) REFERENCES rentals(id),
-                        FOREIGN KEY (customer_id) REFERENCES customers(id),
-                        FOREIGN KEY (car_id) REFERENCES cars(id)
-                    )
-                ''')
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS insurances (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        car_id INTEGER NOT NULL,
-                        provider TEXT NOT NULL,
-                        policy_number TEXT NOT NULL,
-                        start_date TEXT NOT NULL,
-                        end_date TEXT NOT NULL,
-                        coverage TEXT,
-                        FOREIGN KEY (car_id) REFERENCES cars(id)
-                    )
-                ''')
-                # Ensure new columns exist on insurances
-                cursor.execute("PRAGMA table_info(insurances)")
-                ins_cols = [r[1] for r in cursor.fetchall()]
-                if 'file_url' not in ins_cols:
-                    cursor.execute("ALTER TABLE insurances ADD COLUMN file_url TEXT")
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS legal_documents (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        car_id INTEGER NOT NULL,
-                        doc_type TEXT NOT NULL,
-                        number TEXT,
-                        issue_date TEXT,
-                        expiry_date TEXT,
-                        file_url TEXT,
-                        FOREIGN KEY (car_id) REFERENCES cars(id)
-                    )
-                ''')
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS maintenance (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        car_id INTEGER NOT NULL,
-                        maint_type TEXT NOT NULL,
-                        due_date TEXT NOT NULL,
-                        status TEXT NOT NULL DEFAULT 'pending',
-                        cost REAL DEFAULT 0.0,
-                        notes TEXT,
-                        FOREIGN KEY (car_id) REFERENCES cars(id)
-                    )
-                ''')
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS users (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        name TEXT NOT NULL,
-                        email TEXT NOT NULL UNIQUE,
-                        role TEXT NOT NULL DEFAULT 'staff',
-                        active BOOLEAN NOT NULL DEFAULT 1
-                    )
-                ''')
-                # Ensure password & sessions support
-                cursor.execute("PRAGMA table_info(users)")
-                user_cols = [r[1] for r in cursor.fetchall()]
-                if 'password_hash' not in user_cols:
-                    cursor.execute("ALTER TABLE users ADD COLUMN password_hash TEXT")
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS sessions (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER NOT NULL,
-                        token TEXT NOT NULL UNIQUE,
-                        expires_at TEXT NOT NULL,
-                        FOREIGN KEY (user_id) REFERENCES users(id)
-                    )
-                ''')
-                # Settings (single-row JSON blob)
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS settings (
-                        id INTEGER PRIMARY KEY,
-                        data TEXT NOT NULL
-                    )
-                ''')
-                # Ensure one row exists with defaults
-                cursor.execute('SELECT COUNT(1) FROM settings WHERE id = 1')
-                if cursor.fetchone()[0] == 0:
-                    default_settings = {
-                        "general": {
-                            "companyName": "Akalanka Enterprises",
-                            "email": "brinslykevin@gmail.com",
-                            "phone": "+94 72 081 5252",
-                            "address": "Marawila, Sri Lanka",
-                            "currency": "LKR",
-                            "language": "en",
-                        },
-                        "branding": {
-                            "accent": "#2563EB",
-                            "logoUrl": "/logo.jpg",
-                            "footerNote": "This is a system-generated document.",
-                        },
-                        "pdf": {
-                            "quoteValidityDays": 14,
-                            "showZebraRows": True,
-                            "showTotalsCard": True,
-                            "headerBadge": "QUOTATION",
-                            "notesDefault": "This quotation is valid for 14 days. Prices may change based on availability and final requirements.",
-                        },
-                        "notifications": {
-                            "emailOnInvoice": True,
-                            "emailOnRentalStart": False,
-                            "emailOnRentalEnd": True,
-                        },
-                    }
+            if self.get_schema_version() >= self.MIGRATIONS[-1][0]:
+                return
+            for version, name, method in self.MIGRATIONS:
+                with self.conn:
+                    cursor = self.conn.cursor()
+                    # Take the write lock before re-checking, so concurrent
+                    # starters cannot apply the same step twice.
+                    self._begin_immediate(cursor)
+                    cursor.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,))
+                    if cursor.fetchone():
+                        continue
+                    getattr(self, method)(cursor)
                     cursor.execute(
-                        'INSERT INTO settings (id, data) VALUES (1, ?)',
-                        (json.dumps(default_settings),)
+                        'INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)',
+                        (version, name, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
                     )
+                logger.info(f"Applied schema migration {version}: {name}")
         except sqlite3.Error as e:
             logger.error(
                 f"Error creating tables: {str(e)}\n{traceback.format_exc()}")
             raise HTTPException(
                 status_code=500, detail="Unable to initialize database. Please try again later.")
 
+    def get_schema_version(self) -> int:
+        c = self.conn.cursor()
+        c.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+        return c.fetchone()[0]
+
+    def _migration_base_schema(self, cursor: sqlite3.Cursor):
+        # Also upgrades databases created before schema_version existed, hence
+        # the IF NOT EXISTS / column checks.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cars (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                make TEXT NOT NULL,
+                model TEXT NOT NULL,
+                year INTEGER NOT NULL,
+                price_per_day REAL NOT NULL,
+                available BOOLEAN NOT NULL DEFAULT 1
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS customers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                email TEXT NOT NULL UNIQUE
+            )
+        ''')
+        # Ensure new columns exist on customers
+        cursor.execute("PRAGMA table_info(customers)")
+        cols = [r[1] for r in cursor.fetchall()]
+        if 'id_card_url' not in cols:
+            cursor.execute("ALTER TABLE customers ADD COLUMN id_card_url TEXT")
+        if 'driving_license_url' not in cols:
+            cursor.execute("ALTER TABLE customers ADD COLUMN driving_license_url TEXT")
+        if 'phone' not in cols:
+            cursor.execute("ALTER TABLE customers ADD COLUMN phone TEXT")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS rentals (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                car_id INTEGER NOT NULL,
+                customer_id INTEGER NOT NULL,
+                start_date TEXT NOT NULL,
+                end_date TEXT,
+                total_cost REAL,
+                deposit_amount REAL NOT NULL DEFAULT 0.0,
+                is_paid BOOLEAN NOT NULL DEFAULT 0,
+                payment_method TEXT,
+                FOREIGN KEY (car_id) REFERENCES cars(id),
+                FOREIGN KEY (customer_id) REFERENCES customers(id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sales (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                rental_id INTEGER NOT NULL,
+                customer_id INTEGER NOT NULL,
+                car_id INTEGER NOT NULL,
+                total_cost REAL NOT NULL,
+                sale_date TEXT NOT NULL,
+                FOREIGN KEY (rental_id) REFERENCES rentals(id),
+                FOREIGN KEY (customer_id) REFERENCES customers(id),
+                FOREIGN KEY (car_id) REFERENCES cars(id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS insurances (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                car_id INTEGER NOT NULL,
+                provider TEXT NOT NULL,
+                policy_number TEXT NOT NULL,
+                start_date TEXT NOT NULL,
+                end_date TEXT NOT NULL,
+                coverage TEXT,
+                FOREIGN KEY (car_id) REFERENCES cars(id)
+            )
+        ''')
+        # Ensure new columns exist on insurances
+        cursor.execute("PRAGMA table_info(insurances)")
+        ins_cols = [r[1] for r in cursor.fetchall()]
+        if 'file_url' not in ins_cols:
+            cursor.execute("ALTER TABLE insurances ADD COLUMN file_url TEXT")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS legal_documents (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                car_id INTEGER NOT NULL,
+                doc_type TEXT NOT NULL,
+                number TEXT,
+                issue_date TEXT,
+                expiry_date TEXT,
+                file_url TEXT,
+                FOREIGN KEY (car_id) REFERENCES cars(id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS maintenance (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                car_id INTEGER NOT NULL,
+                maint_type TEXT NOT NULL,
+                due_date TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                cost REAL DEFAULT 0.0,
+                notes TEXT,
+                FOREIGN KEY (car_id) REFERENCES cars(id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                email TEXT NOT NULL UNIQUE,
+                role TEXT NOT NULL DEFAULT 'staff',
+                active BOOLEAN NOT NULL DEFAULT 1
+            )
+        ''')
+        # Ensure password & sessions support
+        cursor.execute("PRAGMA table_info(users)")
+        user_cols = [r[1] for r in cursor.fetchall()]
+        if 'password_hash' not in user_cols:
+            cursor.execute("ALTER TABLE users ADD COLUMN password_hash TEXT")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                token TEXT NOT NULL UNIQUE,
+                expires_at TEXT NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES users(id)
+            )
+        ''')
+        # Settings (single-row JSON blob)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS settings (
+                id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL
+            )
+        ''')
+        # Ensure one row exists with defaults
+        cursor.execute('SELECT COUNT(1) FROM settings WHERE id = 1')
+        if cursor.fetchone()[0] == 0:
+            default_settings = {
+                "general": {
+                    "companyName": "Akalanka Enterprises",
+                    "email": "brinslykevin@gmail.com",
+                    "phone": "+94 72 081 5252",
+                    "address": "Marawila, Sri Lanka",
+                    "currency": "LKR",
+                    "language": "en",
+                },
+                "branding": {
+                    "accent": "#2563EB",
+                    "logoUrl": "/logo.jpg",
+                    "footerNote": "This is a system-generated document.",
+                },
+                "pdf": {
+                    "quoteValidityDays": 14,
+                    "showZebraRows": True,
+                    "showTotalsCard": True,
+                    "headerBadge": "QUOTATION",
+                    "notesDefault": "This quotation is valid for 14 days. Prices may change based on availability and final requirements.",
+                },
+                "notifications": {
+                    "emailOnInvoice": True,
+                    "emailOnRentalStart": False,
+                    "emailOnRentalEnd": True,
+                },
+            }
+            cursor.execute(
+                'INSERT INTO settings (id, data) VALUES (1, ?)',
+                (json.dumps(default_settings),)
+            )
+
+    def _migration_hot_query_indexes(self, cursor: sqlite3.Cursor):
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rentals_car_dates ON rentals (car_id, start_date, end_date)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_maintenance_car_status_due ON maintenance (car_id, status, due_date)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_token_expires ON sessions (token, expires_at)')
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_sales_rental ON sales (rental_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_insurances_end_date ON insurances (end_date)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_legal_documents_expiry ON legal_documents (expiry_date)')
+
+    def _migration_rental_customer_index(self, cursor: sqlite3.Cursor):
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rentals_customer ON rentals (customer_id)')
+
+    def _migration_settings_version(self, cursor: sqlite3.Cursor):
+        cursor.execute('ALTER TABLE settings ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+
+    def _migration_upload_blobs(self, cursor: sqlite3.Cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS blobs (
+                digest TEXT PRIMARY KEY,
+                url TEXT NOT NULL UNIQUE,
+                size INTEGER NOT NULL,
+                content_type TEXT,
+                last_seen_at TEXT NOT NULL
+            )
+        ''')
+        # Every column that can point at an upload, as one references table.
+        cursor.execute('''
+            CREATE VIEW IF NOT EXISTS blob_references AS
+                SELECT 'customers' AS owner_table, id AS owner_id, 'id_card_url' AS column_name, id_card_url AS url
+                FROM customers WHERE id_card_url IS NOT NULL
+                UNION ALL
+                SELECT 'customers', id, 'driving_license_url', driving_license_url
+                FROM customers WHERE driving_license_url IS NOT NULL
+                UNION ALL
+                SELECT 'insurances', id, 'file_url', file_url FROM insurances WHERE file_url IS NOT NULL
+                UNION ALL
+                SELECT 'legal_documents', id, 'file_url', file_url FROM legal_documents WHERE file_url IS NOT NULL
+                UNION ALL
+                SELECT 'settings', id, 'branding.logoUrl', json_extract(data, '$.branding.logoUrl')
+                FROM settings WHERE json_extract(data, '$.branding.logoUrl') IS NOT NULL
+        ''')
+
+    def _migration_compliance_indexes(self, cursor: sqlite3.Cursor):
+        # Per-car "latest policy / document" lookups read these in index order.
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_insurances_car_end ON insurances (car_id, end_date)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_legal_documents_car_type ON legal_documents (car_id, doc_type, expiry_date)')
+
+    def _migration_notifications(self, cursor: sqlite3.Cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS notifications (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                source_id INTEGER NOT NULL,
+                car_id INTEGER NOT NULL,
+                due_date TEXT NOT NULL,
+                message TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                UNIQUE (kind, source_id)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_due ON notifications (due_date)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_maintenance_status_due ON maintenance (status, due_date)')
+
+    def _migration_table_changes(self, cursor: sqlite3.Cursor):
+        # One counter per table, so a write only invalidates the caches built
+        # from the table it touched.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS table_changes (
+                table_name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        ''')
+        for table, events in self.WATCHED_TABLES.items():
+            cursor.execute('INSERT OR IGNORE INTO table_changes (table_name, value) VALUES (?, 0)', (table,))
+            for event in events:
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_changes AFTER {event} ON {table}
+                    BEGIN UPDATE table_changes SET value = value + 1 WHERE table_name = '{table}'; END
+                ''')
+
+    def _migration_login_attempts(self, cursor: sqlite3.Cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS login_attempts (
+                email TEXT NOT NULL,
+                attempted_at REAL NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_login_attempts_email ON login_attempts (email, attempted_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_login_attempts_time ON login_attempts (attempted_at)')
+
     def _hash_password(self, password: str) -> str:
-        salt = secrets.token_hex(16)
-        dk = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), bytes.fromhex(salt), 100_000)
-        return f"{salt}${dk.hex()}"
+        return hash_password(password)
 
     def _verify_password(self, password: str, stored: str) -> bool:
-        try:
-            salt, hexhash = stored.split('$', 1)
-            dk = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), bytes.fromhex(salt), 100_000)
-            return dk.hex() == hexhash
-        except Exception:
-            return False
+        return verify_password(password, stored)
 
     def _bootstrap_admin(self):
         try:
@@ -317,37 +1332,61 @@ class Database:
         except sqlite3.Error as e:
             logger.error(f"Error bootstrapping admin: {str(e)}\n{traceback.format_exc()}")
 
+    @staticmethod
+    def _validate_car(car: Car):
+        if not car.make or not car.model:
+            raise HTTPException(
+                status_code=400, detail="Invalid input: 'make' and 'model' are required.")
+        if car.year < 1900 or car.year > datetime.now().year + 1:
+            raise HTTPException(
+                status_code=400, detail=f"Invalid input: 'year' must be between 1900 and {datetime.now().year + 1}.")
+        if car.price_per_day <= 0:
+            raise HTTPException(
+                status_code=400, detail="Invalid input: 'price_per_day' must be greater than 0.")
+
     def add_car(self, car: Car) -> int:
         try:
-            if not car.make or not car.model:
-                raise HTTPException(
-                    status_code=400, detail="Invalid input: 'make' and 'model' are required.")
-            if car.year < 1900 or car.year > datetime.now().year + 1:
-                raise HTTPException(
-                    status_code=400, detail=f"Invalid input: 'year' must be between 1900 and {datetime.now().year + 1}.")
-            if car.price_per_day <= 0:
-                raise HTTPException(
-                    status_code=400, detail="Invalid input: 'price_per_day' must be greater than 0.")
-            with self.conn:
+            self._validate_car(car)
+            with self._write_txn():
                 cursor = self.conn.cursor()
                 cursor.execute('''
                     INSERT INTO cars (make, model, year, price_per_day, available)
                     VALUES (?, ?, ?, ?, ?)
                 ''', (car.make, car.model, car.year, car.price_per_day, car.available))
-                return cursor.lastrowid
+            self._bump_stats(vehicles=1)
+            return cursor.lastrowid
         except sqlite3.Error as e:
             logger.error(
                 f"Database error in add_car: {str(e)}\n{traceback.format_exc()}")
             raise HTTPException(
                 status_code=500, detail="Failed to add car due to a server error. Please try again.")
 
-    def get_all_cars(self) -> List[Car]:
+    # List reads return plain dicts shaped like the models, so endpoints can
+    # serialize them directly instead of building and re-validating a model
+    # per row.
+    @staticmethod
+    def _car_row_to_dict(row) -> dict:
+        return {'id': row[0], 'make': row[1], 'model': row[2], 'year': row[3],
+                'price_per_day': row[4], 'available': bool(row[5])}
+
+    def get_all_cars(self, limit: Optional[int] = None, cursor: Optional[int] = None,
+                     available: Optional[bool] = None) -> List[dict]:
         try:
+            where, params = [], []
+            if available is not None:
+                where.append('available = ?')
+                params.append(int(available))
+            if cursor:
+                where.append('id > ?')
+                params.append(cursor)
+            sql = 'SELECT * FROM cars' + _where(where) + ' ORDER BY id'
+            if limit:
+                sql += ' LIMIT ?'
+                params.append(limit)
             with self.conn:
-                cursor = self.conn.cursor()
-                cursor.execute('SELECT * FROM cars')
-                rows = cursor.fetchall()
-                return [Car(id=row[0], make=row[1], model=row[2], year=row[3], price_per_day=row[4], available=bool(row[5])) for row in rows]
+                c = self.conn.cursor()
+                c.execute(sql, params)
+                return [self._car_row_to_dict(row) for row in c.fetchall()]
         except sqlite3.Error as e:
             logger.error(
                 f"Database error in get_all_cars: {str(e)}\n{traceback.format_exc()}")
@@ -401,13 +1440,12 @@ class Database:
             raise HTTPException(
                 status_code=500, detail=f"Failed to retrieve car with ID {car_id} due to a server error. Please try again.")
 
-    def get_available_cars(self) -> List[Car]:
+    def get_available_cars(self) -> List[dict]:
         try:
             with self.conn:
                 cursor = self.conn.cursor()
                 cursor.execute('SELECT * FROM cars WHERE available = 1')
-                rows = cursor.fetchall()
-                return [Car(id=row[0], make=row[1], model=row[2], year=row[3], price_per_day=row[4], available=bool(row[5])) for row in rows]
+                return [self._car_row_to_dict(row) for row in cursor.fetchall()]
         except sqlite3.Error as e:
             logger.error(
                 f"Database error in get_available_cars: {str(e)}\n{traceback.format_exc()}")
@@ -416,7 +1454,7 @@ class Database:
 
     def update_car_availability(self, car_id: int, available: bool):
         try:
-            with self.conn:
+            with self._write_txn():
                 cursor = self.conn.cursor()
                 cursor.execute('''
                     UPDATE cars SET available = ? WHERE id = ?
@@ -427,21 +1465,26 @@ class Database:
             raise HTTPException(
                 status_code=500, detail=f"Failed to update availability for car ID {car_id} due to a server error. Please try again.")
 
+    @staticmethod
+    def _validate_customer(customer: Customer):
+        if not customer.name or not customer.email:
+            raise HTTPException(
+                status_code=400, detail="Invalid input: 'name' and 'email' are required.")
+        if "@" not in customer.email:
+            raise HTTPException(
+                status_code=400, detail="Invalid input: 'email' must be a valid email address.")
+
     def add_customer(self, customer: Customer) -> int:
         try:
-            if not customer.name or not customer.email:
-                raise HTTPException(
-                    status_code=400, detail="Invalid input: 'name' and 'email' are required.")
-            if "@" not in customer.email:
-                raise HTTPException(
-                    status_code=400, detail="Invalid input: 'email' must be a valid email address.")
-            with self.conn:
+            self._validate_customer(customer)
+            with self._write_txn():
                 cursor = self.conn.cursor()
                 cursor.execute('''
                     INSERT INTO customers (name, email, phone, id_card_url, driving_license_url)
                     VALUES (?, ?, ?, ?, ?)
                 ''', (customer.name, customer.email, customer.phone, customer.id_card_url, customer.driving_license_url))
-                return cursor.lastrowid
+            self._bump_stats(customers=1)
+            return cursor.lastrowid
         except sqlite3.IntegrityError as e:
             logger.error(
                 f"Database error in add_customer: {str(e)}\n{traceback.format_exc()}")
@@ -453,23 +1496,26 @@ class Database:
             raise HTTPException(
                 status_code=500, detail="Failed to add customer due to a server error. Please try again.")
 
-    def get_all_customers(self) -> List[Customer]:
+    CUSTOMER_COLUMNS = ('id', 'name', 'email', 'phone', 'id_card_url', 'driving_license_url')
+
+    def get_all_customers(self, limit: Optional[int] = None, cursor: Optional[int] = None,
+                          q: Optional[str] = None) -> List[dict]:
         try:
+            where, params = [], []
+            if q:
+                where.append('(name LIKE ? OR email LIKE ?)')
+                params.extend([f"%{q}%", f"%{q}%"])
+            if cursor:
+                where.append('id > ?')
+                params.append(cursor)
+            sql = 'SELECT id, name, email, phone, id_card_url, driving_license_url FROM customers' + _where(where) + ' ORDER BY id'
+            if limit:
+                sql += ' LIMIT ?'
+                params.append(limit)
             with self.conn:
-                cursor = self.conn.cursor()
-                cursor.execute('SELECT id, name, email, phone, id_card_url, driving_license_url FROM customers')
-                rows = cursor.fetchall()
-                return [
-                    Customer(
-                        id=row[0],
-                        name=row[1],
-                        email=row[2],
-                        phone=row[3],
-                        id_card_url=row[4],
-                        driving_license_url=row[5],
-                    )
-                    for row in rows
-                ]
+                c = self.conn.cursor()
+                c.execute(sql, params)
+                return [dict(zip(self.CUSTOMER_COLUMNS, row)) for row in c.fetchall()]
         except sqlite3.Error as e:
             logger.error(
                 f"Database error in get_all_customers: {str(e)}\n{traceback.format_exc()}")
@@ -512,14 +1558,22 @@ class Database:
             except ValueError:
                 raise HTTPException(
                     status_code=400, detail="Invalid date format: Use YYYY-MM-DD.")
-            with self.conn:
+            with self._write_txn():
+                # Re-checked under the write lock: another worker may have
+                # booked the car since the caller's check.
+                if not self._availability_index().is_free(rental.car_id, rental.start_date, rental.end_date):
+                    raise HTTPException(
+                        status_code=400, detail=f"Car with ID {rental.car_id} is not available for the selected dates.")
                 cursor = self.conn.cursor()
                 cursor.execute('''
                     INSERT INTO rentals (car_id, customer_id, start_date, end_date, total_cost, deposit_amount, is_paid, payment_method)
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                 ''', (rental.car_id, rental.customer_id, rental.start_date, rental.end_date, rental.total_cost or 0.0,
                     rental.deposit_amount, rental.is_paid, rental.payment_method))
-                return cursor.lastrowid
+            self._bump_stats(lambda day: {'rentals_active': int(self._is_active_rental(rental.end_date, day))})
+            self._update_availability(
+                lambda index: index.add(rental.car_id, cursor.lastrowid, rental.start_date, rental.end_date))
+            return cursor.lastrowid
         except sqlite3.IntegrityError as e:
             logger.error(
                 f"Database error in add_rental: {str(e)}\n{traceback.format_exc()}")
@@ -541,59 +1595,111 @@ class Database:
             if total_cost < 0:
                 raise HTTPException(
                     status_code=400, detail="Invalid input: 'total_cost' cannot be negative.")
-            with self.conn:
+            with self._write_txn():
                 cursor = self.conn.cursor()
+                cursor.execute('SELECT car_id, end_date FROM rentals WHERE id = ?', (rental_id,))
+                row = cursor.fetchone()
                 cursor.execute('''
                     UPDATE rentals SET end_date = ?, total_cost = ? WHERE id = ?
                 ''', (end_date, total_cost, rental_id))
+            if row:
+                self._bump_stats(lambda day: {'rentals_active': int(self._is_active_rental(end_date, day))
+                                              - int(self._is_active_rental(row[1], day))})
+                self._update_availability(lambda index: index.set_end(row[0], rental_id, end_date))
         except sqlite3.Error as e:
             logger.error(
                 f"Database error in update_rental_end: {str(e)}\n{traceback.format_exc()}")
             raise HTTPException(
                 status_code=500, detail=f"Failed to update rental ID {rental_id} due to a server error. Please try again.")
 
-    def get_all_rentals(self) -> List[dict]:
+    RENTAL_SELECT = '''
+        SELECT r.id, r.car_id, r.customer_id, r.start_date, r.end_date, r.total_cost,
+            r.deposit_amount, r.is_paid, r.payment_method,
+            c.make, c.model, c.year, c.price_per_day, c.available,
+            cu.name, cu.email
+        FROM rentals r
+        JOIN cars c ON r.car_id = c.id
+        JOIN customers cu ON r.customer_id = cu.id
+    '''
+
+    @staticmethod
+    def _rental_filters(status: Optional[str] = None, car_id: Optional[int] = None,
+                        customer_id: Optional[int] = None, start_from: Optional[str] = None,
+                        start_to: Optional[str] = None, ends_from: Optional[str] = None) -> Tuple[List[str], List[Any]]:
+        try:
+            for d in [start_from, start_to, ends_from]:
+                if d:
+                    datetime.strptime(d, "%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date format: Use YYYY-MM-DD.")
+        where, params = [], []
+        today = datetime.now().strftime("%Y-%m-%d")
+        if status == 'active':
+            where.append('(r.end_date IS NULL OR r.end_date > ?)')
+            params.append(today)
+        elif status == 'completed':
+            where.append('r.end_date <= ?')
+            params.append(today)
+        if car_id:
+            where.append('r.car_id = ?')
+            params.append(car_id)
+        if customer_id:
+            where.append('r.customer_id = ?')
+            params.append(customer_id)
+        if start_from:
+            where.append('r.start_date >= ?')
+            params.append(start_from)
+        if start_to:
+            where.append('r.start_date <= ?')
+            params.append(start_to)
+        if ends_from:
+            # Still out on that date: open-ended, or due back then or later.
+            where.append('(r.end_date IS NULL OR r.end_date >= ?)')
+            params.append(ends_from)
+        return where, params
+
+    @staticmethod
+    def _rental_row_to_dict(row) -> dict:
+        return {
+            "id": row[0],
+            "car_id": row[1],
+            "customer_id": row[2],
+            "start_date": row[3],
+            "end_date": row[4],
+            "total_cost": row[5] if row[5] is not None else 0.0,
+            "deposit_amount": row[6] if row[6] is not None else 0.0,
+            "is_paid": bool(row[7]) if row[7] is not None else False,
+            "payment_method": row[8],
+            "car": {
+                "id": row[1],
+                "make": row[9],
+                "model": row[10],
+                "year": row[11],
+                "price_per_day": row[12],
+                "available": bool(row[13])
+            },
+            "customer": {
+                "id": row[2],
+                "name": row[14],
+                "email": row[15]
+            }
+        }
+
+    def get_all_rentals(self, limit: Optional[int] = None, cursor: Optional[int] = None,
+                        **filters) -> List[dict]:
         try:
+            where, params = self._rental_filters(**filters)
+            if cursor:
+                where.append('r.id < ?')
+                params.append(cursor)
+            sql = self.RENTAL_SELECT + _where(where) + ' ORDER BY r.id DESC'
+            if limit:
+                sql += ' LIMIT ?'
+                params.append(limit)
             with self.conn:
-                cursor = self.conn.cursor()
-                cursor.execute('''
-                    SELECT r.id, r.car_id, r.customer_id, r.start_date, r.end_date, r.total_cost,
-                        r.deposit_amount, r.is_paid, r.payment_method,
-                        c.make, c.model, c.year, c.price_per_day, c.available,
-                        cu.name, cu.email
-                    FROM rentals r
-                    JOIN cars c ON r.car_id = c.id
-                    JOIN customers cu ON r.customer_id = cu.id
-                    ORDER BY r.id DESC
-                ''')
-                rows = cursor.fetchall()
-                result = []
-                for row in rows:
-                    result.append({
-                        "id": row[0],
-                        "car_id": row[1],
-                        "customer_id": row[2],
-                        "start_date": row[3],
-                        "end_date": row[4],
-                        "total_cost": row[5] if row[5] is not None else 0.0,
-                        "deposit_amount": row[6] if row[6] is not None else 0.0,
-                        "is_paid": bool(row[7]) if row[7] is not None else False,
-                        "payment_method": row[8],
-                        "car": {
-                            "id": row[1],
-                            "make": row[9],
-                            "model": row[10],
-                            "year": row[11],
-                            "price_per_day": row[12],
-                            "available": bool(row[13])
-                        },
-                        "customer": {
-                            "id": row[2],
-                            "name": row[14],
-                            "email": row[15]
-                        }
-                    })
-                return result
+                c = self.conn.cursor()
+                c.execute(sql, params)
+                return [self._rental_row_to_dict(row) for row in c.fetchall()]
         except sqlite3.Error as e:
             logger.error(
                 f"Database error in get_all_rentals: {str(e)}\n{traceback.format_exc()}")
@@ -685,7 +1791,7 @@ class Database:
             except ValueError:
                 raise HTTPException(
                     status_code=400, detail="Invalid date format for 'sale_date': Use YYYY-MM-DD.")
-            with self.conn:
+            with self._write_txn():
                 cursor = self.conn.cursor()
                 cursor.execute('''
                     INSERT INTO sales (rental_id, customer_id, car_id, total_cost, sale_date)
@@ -694,7 +1800,8 @@ class Database:
                 sale_id = cursor.lastrowid
                 logger.info(
                     f"Successfully created sale with ID {sale_id} for rental {sale.rental_id}")
-                return sale_id
+            self._bump_stats(invoices=1, revenue=sale.total_cost)
+            return sale_id
         except sqlite3.IntegrityError as e:
             logger.error(
                 f"Integrity error in add_sale for rental_id {sale.rental_id}: {str(e)}\n{traceback.format_exc()}")
@@ -726,18 +1833,267 @@ class Database:
             raise HTTPException(
                 status_code=500, detail=f"Failed to retrieve sale for rental ID {rental_id} due to a server error. Please try again.")
 
+    # --- Batch rentals ---
+    # Both batch methods validate every item up front, then apply the accepted
+    # ones inside a single BEGIN IMMEDIATE transaction. Rows rejected during
+    # validation are reported per item and skipped. New rows are inserted one
+    # execute at a time so each id comes from its own cursor.lastrowid.
+    def _fetch_by_ids(self, c: sqlite3.Cursor, sql: str, ids) -> Dict[int, tuple]:
+        ids = list(set(ids))
+        if not ids:
+            return {}
+        c.execute(sql.format(','.join('?' * len(ids))), ids)
+        return {row[0]: row for row in c.fetchall()}
+
+    def add_rentals_batch(self, rentals: List[Rental]) -> List[dict]:
+        results: List[dict] = [{"index": i, "ok": False} for i in range(len(rentals))]
+        accepted: List[Tuple[int, Rental]] = []
+        try:
+            with self._write_txn():
+                c = self.conn.cursor()
+                # Inside the write lock, so rentals booked by other workers are in the index.
+                index = self._availability_index()
+                cars = self._fetch_by_ids(c, 'SELECT id, price_per_day, available FROM cars WHERE id IN ({})',
+                                          [r.car_id for r in rentals])
+                customers = self._fetch_by_ids(c, 'SELECT id FROM customers WHERE id IN ({})',
+                                               [r.customer_id for r in rentals])
+                taken = set()
+                for i, rental in enumerate(rentals):
+                    car = cars.get(rental.car_id)
+                    if not car or not car[2] or rental.car_id in taken:
+                        results[i]["error"] = f"Car with ID {rental.car_id} is not available or does not exist."
+                        continue
+                    if rental.customer_id not in customers:
+                        results[i]["error"] = f"Customer with ID {rental.customer_id} not found."
+                        continue
+                    try:
+                        start = datetime.strptime(rental.start_date, "%Y-%m-%d")
+                    except ValueError:
+                        results[i]["error"] = "Invalid date format for 'start_date': Use YYYY-MM-DD."
+                        continue
+                    end_date = None
+                    if rental.days:
+                        if rental.days < 1:
+                            results[i]["error"] = "Invalid input: 'days' must be at least 1."
+                            continue
+                        end_date = (start + timedelta(days=rental.days)).strftime("%Y-%m-%d")
+                        rental.total_cost = rental.days * car[1]
+                    if not index.is_free(rental.car_id, rental.start_date, end_date):
+                        results[i]["error"] = f"Car with ID {rental.car_id} is not available for the selected dates."
+                        continue
+                    rental.end_date = end_date
+                    taken.add(rental.car_id)
+                    accepted.append((i, rental))
+                if not accepted:
+                    return results
+                rental_ids = []
+                for _, r in accepted:
+                    c.execute('''
+                        INSERT INTO rentals (car_id, customer_id, start_date, end_date, total_cost, deposit_amount, is_paid, payment_method)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', (r.car_id, r.customer_id, r.start_date, r.end_date, r.total_cost or 0.0,
+                          r.deposit_amount, r.is_paid, r.payment_method))
+                    rental_ids.append(c.lastrowid)
+                c.executemany('UPDATE cars SET available = 0 WHERE id = ?', [(r.car_id,) for _, r in accepted])
+            for (i, rental), rental_id in zip(accepted, rental_ids):
+                results[i].update(ok=True, rental_id=rental_id)
+            self._update_availability(lambda index: [
+                index.add(rental.car_id, rental_id, rental.start_date, rental.end_date)
+                for (_, rental), rental_id in zip(accepted, rental_ids)])
+            self._bump_stats(lambda day: {'rentals_active': sum(self._is_active_rental(r.end_date, day)
+                                                                for _, r in accepted)})
+            logger.info(f"Batch created {len(accepted)} of {len(rentals)} rentals")
+            return results
+        except sqlite3.Error as e:
+            logger.error(f"Database error in add_rentals_batch: {str(e)}\n{traceback.format_exc()}")
+            raise HTTPException(status_code=500, detail="Failed to create rentals due to a server error. Please try again.")
+
+    def return_rentals_batch(self, rental_ids: List[int]) -> List[dict]:
+        results: List[dict] = [{"index": i, "rental_id": rid, "ok": False} for i, rid in enumerate(rental_ids)]
+        current_date_str = datetime.now().strftime("%Y-%m-%d")
+        today_obj = datetime.strptime(current_date_str, "%Y-%m-%d")
+        updates, new_sales = [], []
+        try:
+            with self._write_txn():
+                c = self.conn.cursor()
+                rentals = self._fetch_by_ids(
+                    c, 'SELECT id, car_id, customer_id, start_date, end_date FROM rentals WHERE id IN ({})', rental_ids)
+                cars = self._fetch_by_ids(c, 'SELECT id, price_per_day FROM cars WHERE id IN ({})',
+                                          [r[1] for r in rentals.values()])
+                customers = self._fetch_by_ids(c, 'SELECT id FROM customers WHERE id IN ({})',
+                                               [r[2] for r in rentals.values()])
+                sales = {row[1]: row[0] for row in self._fetch_by_ids(
+                    c, 'SELECT id, rental_id FROM sales WHERE rental_id IN ({})', rental_ids).values()}
+                seen = set()
+                for i, rental_id in enumerate(rental_ids):
+                    rental = rentals.get(rental_id)
+                    if not rental or rental_id in seen:
+                        results[i]["error"] = f"Rental with ID {rental_id} not found." if not rental else "Duplicate rental ID in batch."
+                        continue
+                    _, car_id, customer_id, start_date, end_date = rental
+                    try:
+                        start_date_obj = datetime.strptime(start_date, "%Y-%m-%d")
+                        if end_date:
+                            datetime.strptime(end_date, "%Y-%m-%d")
+                    except ValueError:
+                        results[i]["error"] = "Invalid date format in the rental. Use YYYY-MM-DD."
+                        continue
+                    delta_days = (today_obj - start_date_obj).days
+                    if delta_days < 0:
+                        results[i]["error"] = "Cannot return before rental start date."
+                        continue
+                    if car_id not in cars:
+                        results[i]["error"] = f"Car with ID {car_id} not found."
+                        continue
+                    if rental_id not in sales and customer_id not in customers:
+                        results[i]["error"] = f"Customer with ID {customer_id} not found."
+                        continue
+                    total_cost = max(delta_days, 1) * cars[car_id][1]
+                    seen.add(rental_id)
+                    updates.append((i, rental_id, car_id, end_date, total_cost))
+                    if rental_id not in sales:
+                        new_sales.append((i, (rental_id, customer_id, car_id, total_cost, current_date_str)))
+                if not updates:
+                    return results
+                c.executemany('UPDATE rentals SET end_date = ?, total_cost = ? WHERE id = ?',
+                              [(current_date_str, total, rid) for _, rid, _, _, total in updates])
+                for _, row in new_sales:
+                    c.execute('''
+                        INSERT INTO sales (rental_id, customer_id, car_id, total_cost, sale_date)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', row)
+                    sales[row[0]] = c.lastrowid
+                c.executemany('UPDATE cars SET available = 1 WHERE id = ?', [(car_id,) for _, _, car_id, _, _ in updates])
+            for i, rental_id, car_id, old_end, total in updates:
+                results[i].update(ok=True, sale_id=sales[rental_id], total_cost=total)
+            self._update_availability(lambda index: [
+                index.set_end(car_id, rental_id, current_date_str) for _, rental_id, car_id, _, _ in updates])
+            self._bump_stats(
+                lambda day: {'rentals_active': -sum(self._is_active_rental(old_end, day)
+                                                    for _, _, _, old_end, _ in updates)},
+                invoices=len(new_sales), revenue=sum(row[3] for _, row in new_sales))
+            logger.info(f"Batch returned {len(updates)} of {len(rental_ids)} rentals, {len(new_sales)} sales created")
+            return results
+        except sqlite3.Error as e:
+            logger.error(f"Database error in return_rentals_batch: {str(e)}\n{traceback.format_exc()}")
+            raise HTTPException(status_code=500, detail="Failed to process returns due to a server error. Please try again.")
+
+    # --- CSV import ---
+    # Rows are validated with the same rules as add_car/add_customer and written
+    # in chunked executemany transactions. Invalid rows are reported by line
+    # number and skipped; they never abort the rest of the import. An upload
+    # that cannot be decoded or parsed stops the import with a 400 whose
+    # report says which rows were already committed.
+    def _import_rows(self, table: str, rows: Iterable[Tuple[int, dict]], parse: Callable[[dict], tuple],
+                     insert_sql: str, find_duplicates: Optional[Callable] = None,
+                     chunk_size: int = 500) -> dict:
+        report: Dict[str, Any] = {"total": 0, "inserted": 0, "committed_through_row": None, "errors": []}
+        chunk: List[Tuple[int, tuple]] = []
+        last_line = 1  # the header
+
+        def flush():
+            if find_duplicates:
+                duplicates = find_duplicates(chunk)
+                report["errors"].extend({"row": line, "error": error} for line, error in duplicates)
+                rejected = {line for line, _ in duplicates}
+                chunk[:] = [item for item in chunk if item[0] not in rejected]
+            try:
+                with self._write_txn():
+                    self.conn.executemany(insert_sql, [params for _, params in chunk])
+                report["inserted"] += len(chunk)
+            except sqlite3.IntegrityError:
+                # Lost a race with a concurrent insert; retry row by row so only
+                # the offending rows are rejected.
+                for line, params in chunk:
+                    try:
+                        with self._write_txn():
+                            self.conn.execute(insert_sql, params)
+                        report["inserted"] += 1
+                    except sqlite3.IntegrityError as e:
+                        report["errors"].append({"row": line, "error": str(e)})
+            report["committed_through_row"] = last_line
+            chunk.clear()
+
+        try:
+            for line, row in rows:
+                last_line = line
+                report["total"] += 1
+                try:
+                    chunk.append((line, parse(row)))
+                except HTTPException as e:
+                    report["errors"].append({"row": line, "error": e.detail})
+                except ValidationError as e:
+                    report["errors"].append({"row": line, "error": "; ".join(
+                        f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors())})
+                except ValueError as e:
+                    report["errors"].append({"row": line, "error": str(e)})
+                if len(chunk) >= chunk_size:
+                    flush()
+            if chunk:
+                flush()
+        except (UnicodeDecodeError, csv.Error) as e:
+            # Rows after the last flushed chunk were not written.
+            report["errors"].append({"row": last_line + 1, "error": f"Unreadable CSV: {e}"})
+            raise HTTPException(status_code=400, detail=report)
+        except sqlite3.Error as e:
+            logger.error(f"Database error importing {table}: {str(e)}\n{traceback.format_exc()}")
+            raise HTTPException(status_code=500, detail=f"Import of {table} failed after {report['inserted']} rows.")
+        finally:
+            with self._stats_lock:
+                self._stats = None  # counts changed in bulk; recompute on next read
+        logger.info(f"Imported {report['inserted']} of {report['total']} {table} rows")
+        return report
+
+    def import_cars(self, rows: Iterable[Tuple[int, dict]]) -> dict:
+        def parse(row: dict) -> tuple:
+            available = (row.get('available') or '1').strip().lower() not in ('0', 'false', 'no')
+            car = Car(make=row.get('make') or '', model=row.get('model') or '', year=row.get('year'),
+                      price_per_day=row.get('price_per_day'), available=available)
+            self._validate_car(car)
+            return (car.make, car.model, car.year, car.price_per_day, car.available)
+        return self._import_rows('cars', rows, parse, '''
+            INSERT INTO cars (make, model, year, price_per_day, available)
+            VALUES (?, ?, ?, ?, ?)
+        ''')
+
+    def import_customers(self, rows: Iterable[Tuple[int, dict]]) -> dict:
+        def parse(row: dict) -> tuple:
+            customer = Customer(name=row.get('name') or '', email=(row.get('email') or '').strip(),
+                                phone=row.get('phone') or None)
+            self._validate_customer(customer)
+            return (customer.name, customer.email, customer.phone)
+
+        def find_duplicates(chunk):
+            # Emails already stored, or repeated within this chunk, violate
+            # the UNIQUE constraint; report them instead of failing the chunk.
+            emails = [params[1] for _, params in chunk]
+            existing = set(self._fetch_by_ids(
+                self.conn.cursor(), 'SELECT email FROM customers WHERE email IN ({})', emails))
+            seen, dupes = set(), []
+            for line, params in chunk:
+                if params[1] in existing or params[1] in seen:
+                    dupes.append((line, f"Customer with email '{params[1]}' already exists."))
+                seen.add(params[1])
+            return dupes
+
+        return self._import_rows('customers', rows, parse, '''
+            INSERT INTO customers (name, email, phone) VALUES (?, ?, ?)
+        ''', find_duplicates)
+
     # --- Insurance ---
     def add_insurance(self, ins: Insurance) -> int:
         try:
             for d in [ins.start_date, ins.end_date]:
                 datetime.strptime(d, "%Y-%m-%d")
-            with self.conn:
+            with self._write_txn():
                 c = self.conn.cursor()
                 c.execute('''
                     INSERT INTO insurances (car_id, provider, policy_number, start_date, end_date, coverage, file_url)
                     VALUES (?, ?, ?, ?, ?, ?, ?)
                 ''', (ins.car_id, ins.provider, ins.policy_number, ins.start_date, ins.end_date, ins.coverage, ins.file_url))
-                return c.lastrowid
+            self._bump_stats(lambda day: {'insurance_expiring': int(self._in_expiry_window(ins.end_date, day))})
+            self.sync_notifications('insurance', car_id=ins.car_id)
+            return c.lastrowid
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid date format: Use YYYY-MM-DD.")
         except sqlite3.Error as e:
@@ -764,13 +2120,15 @@ class Database:
             for d in [doc.issue_date, doc.expiry_date]:
                 if d:
                     datetime.strptime(d, "%Y-%m-%d")
-            with self.conn:
+            with self._write_txn():
                 c = self.conn.cursor()
                 c.execute('''
                     INSERT INTO legal_documents (car_id, doc_type, number, issue_date, expiry_date, file_url)
                     VALUES (?, ?, ?, ?, ?, ?)
                 ''', (doc.car_id, doc.doc_type, doc.number, doc.issue_date, doc.expiry_date, doc.file_url))
-                return c.lastrowid
+            self._bump_stats(lambda day: {'docs_expiring': int(self._in_expiry_window(doc.expiry_date, day))})
+            self.sync_notifications('legal_doc', car_id=doc.car_id)
+            return c.lastrowid
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid date format: Use YYYY-MM-DD.")
         except sqlite3.Error as e:
@@ -788,19 +2146,95 @@ class Database:
             logger.error(f"Database error in get_legal_docs_by_car: {str(e)}\n{traceback.format_exc()}")
             raise HTTPException(status_code=500, detail="Failed to retrieve legal documents.")
 
+    # --- Compliance matrix ---
+    COMPLIANCE_MATRIX_SQL = f'''
+        WITH latest_insurance AS (
+            SELECT id, car_id, provider, policy_number, end_date,
+                ROW_NUMBER() OVER (PARTITION BY car_id ORDER BY end_date DESC, id DESC) AS rn
+            FROM insurances
+        ),
+        latest_docs AS (
+            SELECT id, car_id, doc_type, number, expiry_date,
+                ROW_NUMBER() OVER (PARTITION BY car_id, doc_type
+                                   ORDER BY COALESCE(expiry_date, '{OPEN_END_DATE}') DESC, id DESC) AS rn
+            FROM legal_documents
+        ),
+        docs_by_car AS (
+            SELECT car_id,
+                json_group_array(json_object(
+                    'id', id, 'doc_type', doc_type, 'number', number, 'expiry_date', expiry_date,
+                    'days_to_expiry', CAST(julianday(expiry_date) - julianday(:today) AS INTEGER)
+                )) AS docs,
+                SUM(expiry_date < :today) AS expired_docs
+            FROM latest_docs WHERE rn = 1
+            GROUP BY car_id
+        ),
+        active AS (
+            SELECT DISTINCT car_id FROM rentals WHERE end_date IS NULL OR end_date > :today
+        )
+        SELECT c.id, c.make, c.model, c.year,
+            i.id, i.provider, i.policy_number, i.end_date,
+            CAST(julianday(i.end_date) - julianday(:today) AS INTEGER),
+            d.docs, COALESCE(d.expired_docs, 0), a.car_id IS NOT NULL
+        FROM cars c
+        LEFT JOIN latest_insurance i ON i.car_id = c.id AND i.rn = 1
+        LEFT JOIN docs_by_car d ON d.car_id = c.id
+        LEFT JOIN active a ON a.car_id = c.id
+        ORDER BY c.id
+    '''
+
+    def get_compliance_matrix(self) -> List[dict]:
+        """Latest insurance and latest document of each type for every car, in one query.
+
+        days_to_expiry is negative once expired and None when a document has no
+        expiry date. rented_while_expired marks cars out on rental while their
+        latest policy or any latest document has lapsed.
+        """
+        today = datetime.now().strftime('%Y-%m-%d')
+        try:
+            with self.conn:
+                c = self.conn.cursor()
+                c.execute(self.COMPLIANCE_MATRIX_SQL, {'today': today})
+                rows = c.fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Database error in get_compliance_matrix: {str(e)}\n{traceback.format_exc()}")
+            raise HTTPException(status_code=500, detail="Failed to build compliance matrix.")
+        matrix = []
+        for (car_id, make, model, year, ins_id, provider, policy_number, ins_end, ins_days,
+             docs, expired_docs, has_active_rental) in rows:
+            insurance = None
+            if ins_id is not None:
+                insurance = {'id': ins_id, 'provider': provider, 'policy_number': policy_number,
+                             'end_date': ins_end, 'days_to_expiry': ins_days, 'valid': ins_days >= 0}
+            legal_docs = json.loads(docs) if docs else []
+            for doc in legal_docs:
+                doc['valid'] = doc['days_to_expiry'] is None or doc['days_to_expiry'] >= 0
+            expired = (insurance is not None and not insurance['valid']) or expired_docs > 0
+            matrix.append({
+                'car_id': car_id, 'make': make, 'model': model, 'year': year,
+                'insurance': insurance,
+                'legal_docs': legal_docs,
+                'has_active_rental': bool(has_active_rental),
+                'rented_while_expired': bool(has_active_rental) and expired,
+            })
+        return matrix
+
     # --- Maintenance ---
     def add_maintenance(self, m: Maintenance) -> int:
         try:
             datetime.strptime(m.due_date, "%Y-%m-%d")
             if m.status not in ("pending", "completed"):
                 raise HTTPException(status_code=400, detail="status must be 'pending' or 'completed'")
-            with self.conn:
+            with self._write_txn():
                 c = self.conn.cursor()
                 c.execute('''
                     INSERT INTO maintenance (car_id, maint_type, due_date, status, cost, notes)
                     VALUES (?, ?, ?, ?, ?, ?)
                 ''', (m.car_id, m.maint_type, m.due_date, m.status, m.cost or 0.0, m.notes))
-                return c.lastrowid
+            self._bump_stats(lambda day: {
+                'maintenance_due': int(m.status == 'pending' and self._in_expiry_window(m.due_date, day))})
+            self.sync_notifications('maintenance', source_id=c.lastrowid)
+            return c.lastrowid
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid date format: Use YYYY-MM-DD.")
         except sqlite3.Error as e:
@@ -811,11 +2245,17 @@ class Database:
         try:
             if status not in ("pending", "completed"):
                 raise HTTPException(status_code=400, detail="status must be 'pending' or 'completed'")
-            with self.conn:
+            with self._write_txn():
                 c = self.conn.cursor()
-                c.execute('UPDATE maintenance SET status = ? WHERE id = ?', (status, maint_id))
-                if c.rowcount == 0:
+                c.execute('SELECT status, due_date FROM maintenance WHERE id = ?', (maint_id,))
+                row = c.fetchone()
+                if not row:
                     raise HTTPException(status_code=404, detail=f"Maintenance ID {maint_id} not found")
+                c.execute('UPDATE maintenance SET status = ? WHERE id = ?', (status, maint_id))
+            self._bump_stats(lambda day: {
+                'maintenance_due': int(status == 'pending') - int(row[0] == 'pending')
+                if self._in_expiry_window(row[1], day) else 0})
+            self.sync_notifications('maintenance', source_id=maint_id)
         except sqlite3.Error as e:
             logger.error(f"Database error in update_maintenance_status: {str(e)}\n{traceback.format_exc()}")
             raise HTTPException(status_code=500, detail="Failed to update maintenance record.")
@@ -846,32 +2286,177 @@ class Database:
             logger.error(f"Database error in get_upcoming_maintenance: {str(e)}\n{traceback.format_exc()}")
             raise HTTPException(status_code=500, detail="Failed to retrieve upcoming maintenance.")
 
+    # --- Notifications ---
+    # Expiring policies and documents and due maintenance, kept in the
+    # notifications table so reads never rescan the source tables. Rows are
+    # written once an item is within EXPIRY_WINDOW_DAYS of its date (overdue
+    # items stay until resolved). Items further out are handed to
+    # notification_listener, which calls back into sync_notifications on the
+    # day they enter the window.
+    EXPIRY_WINDOW_DAYS = 30
+    # kind -> source_id, car_id, due_date, message of every item that can raise
+    # a notification. Only the newest policy per car and the newest document
+    # per car and type count, so renewing one retires the old alert.
+    NOTIFICATION_SOURCES = {
+        'insurance': '''
+            SELECT i.id AS source_id, i.car_id, i.end_date AS due_date,
+                'Insurance ' || i.policy_number || ' (' || i.provider || ') for ' || c.make || ' ' || c.model
+                    || ' expires on ' || i.end_date AS message
+            FROM insurances i JOIN cars c ON i.car_id = c.id
+            WHERE NOT EXISTS (
+                SELECT 1 FROM insurances newer
+                WHERE newer.car_id = i.car_id AND (newer.end_date > i.end_date
+                    OR (newer.end_date = i.end_date AND newer.id > i.id)))
+        ''',
+        'legal_doc': f'''
+            SELECT d.id AS source_id, d.car_id, d.expiry_date AS due_date,
+                d.doc_type || COALESCE(' ' || d.number, '') || ' for ' || c.make || ' ' || c.model
+                    || ' expires on ' || d.expiry_date AS message
+            FROM legal_documents d JOIN cars c ON d.car_id = c.id
+            WHERE d.expiry_date IS NOT NULL AND NOT EXISTS (
+                SELECT 1 FROM legal_documents newer
+                WHERE newer.car_id = d.car_id AND newer.doc_type = d.doc_type
+                    AND (COALESCE(newer.expiry_date, '{OPEN_END_DATE}') > d.expiry_date
+                        OR (newer.expiry_date = d.expiry_date AND newer.id > d.id)))
+        ''',
+        'maintenance': '''
+            SELECT m.id AS source_id, m.car_id, m.due_date,
+                m.maint_type || ' for ' || c.make || ' ' || c.model || ' due on ' || m.due_date AS message
+            FROM maintenance m JOIN cars c ON m.car_id = c.id
+            WHERE m.status = 'pending'
+        ''',
+    }
+
+    def _sync_notifications(self, c: sqlite3.Cursor, kind: str, scope: Optional[str] = None,
+                            scope_id: Optional[int] = None) -> List[Tuple[str, str, int]]:
+        """Re-derives the notification rows of one kind, optionally limited to
+        one car_id or source_id. Returns (alert_date, kind, source_id) for items
+        that are not yet due for a notification."""
+        now = datetime.now()
+        horizon = (now + timedelta(days=self.EXPIRY_WINDOW_DAYS)).strftime('%Y-%m-%d')
+        source = self.NOTIFICATION_SOURCES[kind]
+        scope_sql, scope_params = (f' AND {scope} = ?', [scope_id]) if scope else ('', [])
+        c.execute(f'''
+            DELETE FROM notifications WHERE kind = ?{scope_sql}
+                AND source_id NOT IN (SELECT source_id FROM ({source}) WHERE due_date <= ?{scope_sql})
+        ''', [kind] + scope_params + [horizon] + scope_params)
+        c.execute(f'''
+            INSERT INTO notifications (kind, source_id, car_id, due_date, message, created_at)
+            SELECT ?, source_id, car_id, due_date, message, ? FROM ({source}) WHERE due_date <= ?{scope_sql}
+            ON CONFLICT (kind, source_id) DO UPDATE SET
+                car_id = excluded.car_id, due_date = excluded.due_date, message = excluded.message
+        ''', [kind, now.strftime('%Y-%m-%d %H:%M:%S'), horizon] + scope_params)
+        c.execute(f'SELECT source_id, due_date FROM ({source}) WHERE due_date > ?{scope_sql}',
+                  [horizon] + scope_params)
+        return [((datetime.strptime(due, '%Y-%m-%d') - timedelta(days=self.EXPIRY_WINDOW_DAYS)).strftime('%Y-%m-%d'),
+                 kind, source_id) for source_id, due in c.fetchall()]
+
+    def _schedule_alerts(self, pending: List[Tuple[str, str, int]]):
+        if self.notification_listener is not None:
+            for alert in pending:
+                self.notification_listener(*alert)
+
+    def refresh_notifications(self) -> int:
+        """Rebuilds every notification row; returns how many items are scheduled for later."""
+        try:
+            pending = []
+            with self.conn:
+                c = self.conn.cursor()
+                self._begin_immediate(c)
+                for kind in self.NOTIFICATION_SOURCES:
+                    pending.extend(self._sync_notifications(c, kind))
+            self._schedule_alerts(pending)
+            return len(pending)
+        except sqlite3.Error as e:
+            logger.error(f"Database error in refresh_notifications: {str(e)}\n{traceback.format_exc()}")
+            raise HTTPException(status_code=500, detail="Failed to refresh notifications.")
+
+    def sync_notifications(self, kind: str, car_id: Optional[int] = None, source_id: Optional[int] = None):
+        # Notifications are derived data: a failure here is logged rather than
+        # failing the write that triggered it, and the next refresh repairs it.
+        scope, scope_id = ('car_id', car_id) if car_id is not None else ('source_id', source_id)
+        try:
+            with self.conn:
+                pending = self._sync_notifications(self.conn.cursor(), kind, scope, scope_id)
+            self._schedule_alerts(pending)
+        except sqlite3.Error as e:
+            logger.error(f"Database error in sync_notifications({kind}): {str(e)}\n{traceback.format_exc()}")
+
+    def get_notifications(self, kind: Optional[str] = None, car_id: Optional[int] = None) -> List[dict]:
+        try:
+            where, params = [], []
+            if kind:
+                where.append('kind = ?')
+                params.append(kind)
+            if car_id:
+                where.append('car_id = ?')
+                params.append(car_id)
+            today = datetime.now().strftime('%Y-%m-%d')
+            with self.conn:
+                c = self.conn.cursor()
+                c.execute(
+                    'SELECT id, kind, source_id, car_id, due_date, message, created_at,'
+                    ' CAST(julianday(due_date) - julianday(?) AS INTEGER) FROM notifications'
+                    + _where(where) + ' ORDER BY due_date, id',
+                    [today] + params
+                )
+                return [
+                    {'id': r[0], 'kind': r[1], 'source_id': r[2], 'car_id': r[3], 'due_date': r[4],
+                     'message': r[5], 'created_at': r[6], 'days_left': r[7], 'overdue': r[7] < 0}
+                    for r in c.fetchall()
+                ]
+        except sqlite3.Error as e:
+            logger.error(f"Database error in get_notifications: {str(e)}\n{traceback.format_exc()}")
+            raise HTTPException(status_code=500, detail="Failed to retrieve notifications.")
+
     # --- Users ---
-    def add_user(self, u: User) -> int:
+    def add_user(self, u: User, password_hash: Optional[str] = None) -> int:
         try:
             if not u.name or not u.email:
                 raise HTTPException(status_code=400, detail="name and email are required")
-            with self.conn:
-                c = self.conn.cursor()
+            if password_hash is None:
                 password_hash = self._hash_password(u.password or secrets.token_urlsafe(12))
+            with self._write_txn():
+                c = self.conn.cursor()
                 c.execute('''
                     INSERT INTO users (name, email, role, active, password_hash)
                     VALUES (?, ?, ?, ?, ?)
                 ''', (u.name, u.email, u.role, int(u.active), password_hash))
-                return c.lastrowid
+            self._bump_stats(users_active=int(u.active))
+            return c.lastrowid
         except sqlite3.IntegrityError:
             raise HTTPException(status_code=400, detail="User with this email already exists")
         except sqlite3.Error as e:
             logger.error(f"Database error in add_user: {str(e)}\n{traceback.format_exc()}")
             raise HTTPException(status_code=500, detail="Failed to add user.")
 
-    def get_users(self) -> List[User]:
+    def get_credentials(self, email: str) -> Optional[tuple]:
         try:
             with self.conn:
                 c = self.conn.cursor()
-                c.execute('SELECT * FROM users ORDER BY id DESC')
-                rows = c.fetchall()
-                return [User(id=r[0], name=r[1], email=r[2], role=r[3], active=bool(r[4])) for r in rows]
+                c.execute('SELECT id, name, email, role, active, password_hash FROM users WHERE email = ?', (email,))
+                return c.fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Database error in get_credentials: {str(e)}\n{traceback.format_exc()}")
+            raise HTTPException(status_code=500, detail='Failed to lookup user')
+
+    def set_password_hash(self, user_id: int, password_hash: str):
+        try:
+            with self._write_txn():
+                c = self.conn.cursor()
+                c.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
+        except sqlite3.Error as e:
+            logger.error(f"Database error in set_password_hash: {str(e)}\n{traceback.format_exc()}")
+            raise HTTPException(status_code=500, detail='Failed to update password')
+
+    def get_users(self) -> List[dict]:
+        try:
+            with self.conn:
+                c = self.conn.cursor()
+                c.execute('SELECT id, name, email, role, active FROM users ORDER BY id DESC')
+                # 'password' is part of the User shape but is never returned.
+                return [{'id': r[0], 'name': r[1], 'email': r[2], 'role': r[3], 'active': bool(r[4]), 'password': None}
+                        for r in c.fetchall()]
         except sqlite3.Error as e:
             logger.error(f"Database error in get_users: {str(e)}\n{traceback.format_exc()}")
             raise HTTPException(status_code=500, detail="Failed to retrieve users.")
@@ -897,24 +2482,84 @@ class Database:
             logger.error(f"Database error in get_user_by_email: {str(e)}\n{traceback.format_exc()}")
             raise HTTPException(status_code=500, detail='Failed to lookup user')
 
-    def get_user_by_session(self, token: str) -> Optional[User]:
+    def update_user(self, user_id: int, role: Optional[str] = None, active: Optional[bool] = None):
+        try:
+            if role is not None and role not in ("admin", "manager", "staff"):
+                raise HTTPException(status_code=400, detail="role must be 'admin', 'manager' or 'staff'")
+            with self._write_txn():
+                c = self.conn.cursor()
+                c.execute('SELECT active FROM users WHERE id = ?', (user_id,))
+                row = c.fetchone()
+                if not row:
+                    raise HTTPException(status_code=404, detail=f"User ID {user_id} not found")
+                c.execute('''
+                    UPDATE users SET role = COALESCE(?, role), active = COALESCE(?, active) WHERE id = ?
+                ''', (role, None if active is None else int(active), user_id))
+                # Checked after the update, inside the transaction, so two admins
+                # demoting each other at once cannot both succeed.
+                c.execute("SELECT COUNT(*) FROM users WHERE role = 'admin' AND active = 1")
+                if c.fetchone()[0] == 0:
+                    raise HTTPException(status_code=409, detail="At least one active admin must remain.")
+            if active is not None:
+                self._bump_stats(users_active=int(active) - int(bool(row[0])))
+        except sqlite3.Error as e:
+            logger.error(f"Database error in update_user: {str(e)}\n{traceback.format_exc()}")
+            raise HTTPException(status_code=500, detail="Failed to update user.")
+
+    def get_session(self, token: str) -> Optional[Tuple[User, str]]:
         try:
             with self.conn:
                 c = self.conn.cursor()
                 now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                 c.execute('''
-                    SELECT u.id, u.name, u.email, u.role, u.active
+                    SELECT u.id, u.name, u.email, u.role, u.active, s.expires_at
                     FROM sessions s JOIN users u ON s.user_id = u.id
                     WHERE s.token = ? AND s.expires_at > ?
                 ''', (token, now))
                 r = c.fetchone()
                 if r:
-                    return User(id=r[0], name=r[1], email=r[2], role=r[3], active=bool(r[4]))
+                    return User(id=r[0], name=r[1], email=r[2], role=r[3], active=bool(r[4])), r[5]
                 return None
         except sqlite3.Error as e:
-            logger.error(f"Database error in get_user_by_session: {str(e)}\n{traceback.format_exc()}")
+            logger.error(f"Database error in get_session: {str(e)}\n{traceback.format_exc()}")
             raise HTTPException(status_code=500, detail='Failed to validate session')
 
+    def get_user_by_session(self, token: str) -> Optional[User]:
+        session = self.get_session(token)
+        return session[0] if session else None
+
+    def _availability_index(self) -> AvailabilityIndex:
+        if self._availability is None:
+            with self._availability_lock:
+                if self._availability is None:
+                    # No `with self.conn:` here: callers may be inside a write transaction.
+                    c = self.conn.cursor()
+                    c.execute('SELECT id, car_id, start_date, end_date FROM rentals')
+                    self._availability = AvailabilityIndex(c.fetchall())
+                    self._availability_generation += 1
+                    if self.conn.in_transaction and getattr(self._local, 'availability_generation', None) is not None:
+                        # Built under our own write lock, ahead of the
+                        # transaction's writes, so they still need applying.
+                        self._local.availability_generation = self._availability_generation
+        return self._availability
+
+    def _update_availability(self, apply: Callable[[AvailabilityIndex], Any]):
+        """Applies a committed rental write to the availability index.
+
+        If the index was rebuilt after the write's transaction began, the
+        rebuild may already include the write, so it is dropped rather than
+        given the interval twice.
+        """
+        generation = getattr(self._local, 'availability_generation', None)
+        with self._availability_lock:
+            index = self._availability
+            if index is None:
+                return
+            if generation != self._availability_generation:
+                self._availability = None
+                return
+            apply(index)
+
     def check_car_availability(self, car_id: int, start_date: str, end_date: str) -> bool:
         try:
             try:
@@ -923,136 +2568,915 @@ class Database:
                     datetime.strptime(end_date, "%Y-%m-%d")
             except ValueError:
                 raise HTTPException(status_code=400, detail="Invalid date format: Use YYYY-MM-DD.")
-            with self.conn:
-                cursor = self.conn.cursor()
-                end_date_for_check = end_date if end_date else '9999-12-31'
-                cursor.execute('''
-                    SELECT * FROM rentals
-                    WHERE car_id = ? AND
-                    start_date <= ? AND
-                    COALESCE(end_date, '9999-12-31') >= ?
-                ''', (car_id, end_date_for_check, start_date))
-                row = cursor.fetchone()
-                return row is None
+            return self._availability_index().is_free(car_id, start_date, end_date)
         except sqlite3.Error as e:
             logger.error(f"Database error in check_car_availability: {str(e)}\n{traceback.format_exc()}")
             raise HTTPException(status_code=500, detail=f"Failed to check availability for car ID {car_id} due to a server error. Please try again.")
 
+    def get_cars_free_between(self, start_date: str, end_date: Optional[str] = None) -> List[dict]:
+        try:
+            try:
+                datetime.strptime(start_date, "%Y-%m-%d")
+                if end_date:
+                    datetime.strptime(end_date, "%Y-%m-%d")
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid date format: Use YYYY-MM-DD.")
+            if end_date and end_date < start_date:
+                raise HTTPException(status_code=400, detail="'end' must not be before 'start'.")
+            index = self._availability_index()
+            return [car for car in self.get_all_cars() if index.is_free(car['id'], start_date, end_date)]
+        except sqlite3.Error as e:
+            logger.error(f"Database error in get_cars_free_between: {str(e)}\n{traceback.format_exc()}")
+            raise HTTPException(status_code=500, detail="Failed to search available cars due to a server error. Please try again.")
+
+    @staticmethod
+    def _is_active_rental(end_date: Optional[str], today: str) -> bool:
+        return end_date is None or end_date > today
+
+    def _in_expiry_window(self, date: Optional[str], today: str) -> bool:
+        limit_date = (datetime.strptime(today, '%Y-%m-%d') + timedelta(days=self.EXPIRY_WINDOW_DAYS)).strftime('%Y-%m-%d')
+        return bool(date) and today <= date <= limit_date
+
+    def _bump_stats(self, day_deltas: Optional[Callable[[str], Dict[str, Any]]] = None, **deltas):
+        """Applies a committed write to the dashboard counters.
+
+        Counts that depend on the date come from day_deltas(day), evaluated
+        under the lock for the snapshot's day. If the snapshot was recomputed
+        after the write's transaction began, the recompute may already include
+        the write, so the snapshot is dropped rather than bumped twice.
+        """
+        generation = getattr(self._local, 'stats_generation', None)
+        with self._stats_lock:
+            if self._stats is None:
+                return
+            if generation != self._stats_generation:
+                self._stats = None
+                return
+            if day_deltas is not None:
+                deltas.update(day_deltas(self._stats_day))
+            for key, delta in deltas.items():
+                self._stats[key] += delta
+
+    def _compute_stats(self, today: str) -> dict:
+        limit_date = (datetime.strptime(today, '%Y-%m-%d') + timedelta(days=30)).strftime('%Y-%m-%d')
+        with self.conn:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM cars')
+            vehicles = cursor.fetchone()[0] or 0
+            cursor.execute('SELECT COUNT(*) FROM customers')
+            customers = cursor.fetchone()[0] or 0
+            cursor.execute('''
+                SELECT COUNT(*) FROM rentals
+                WHERE end_date IS NULL OR end_date > ?
+            ''', (today,))
+            rentals_active = cursor.fetchone()[0] or 0
+            cursor.execute('SELECT COUNT(*), COALESCE(SUM(total_cost), 0) FROM sales')
+            invoices, revenue = cursor.fetchone()
+            cursor.execute('SELECT COUNT(*) FROM insurances WHERE end_date BETWEEN ? AND ?', (today, limit_date))
+            insurance_expiring = cursor.fetchone()[0] or 0
+            cursor.execute('SELECT COUNT(*) FROM legal_documents WHERE expiry_date BETWEEN ? AND ?', (today, limit_date))
+            docs_expiring = cursor.fetchone()[0] or 0
+            cursor.execute("SELECT COUNT(*) FROM maintenance WHERE status='pending' AND due_date BETWEEN ? AND ?", (today, limit_date))
+            maintenance_due = cursor.fetchone()[0] or 0
+            cursor.execute('SELECT COUNT(*) FROM users WHERE active = 1')
+            users_active = cursor.fetchone()[0] or 0
+            return {
+                'vehicles': vehicles,
+                'customers': customers,
+                'rentals_active': rentals_active,
+                'invoices': invoices or 0,
+                'revenue': revenue or 0.0,
+                'insurance_expiring': insurance_expiring,
+                'docs_expiring': docs_expiring,
+                'maintenance_due': maintenance_due,
+                'users_active': users_active,
+            }
+
     def get_stats(self) -> dict:
         try:
-            with self.conn:
-                cursor = self.conn.cursor()
-                cursor.execute('SELECT COUNT(*) FROM cars')
-                vehicles = cursor.fetchone()[0] or 0
-                cursor.execute('SELECT COUNT(*) FROM customers')
-                customers = cursor.fetchone()[0] or 0
-                today = datetime.now().strftime('%Y-%m-%d')
-                cursor.execute('''
-                    SELECT COUNT(*) FROM rentals
-                    WHERE end_date IS NULL OR end_date > ?
-                ''', (today,))
-                rentals_active = cursor.fetchone()[0] or 0
-                cursor.execute('SELECT COUNT(*) FROM sales')
-                invoices = cursor.fetchone()[0] or 0
-                cursor.execute('SELECT COALESCE(SUM(total_cost), 0) FROM sales')
-                revenue = cursor.fetchone()[0] or 0.0
-                c2 = self.conn.cursor()
-                c2.execute('SELECT COUNT(*) FROM insurances WHERE end_date BETWEEN ? AND ?', (today, (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')))
-                insurance_expiring = c2.fetchone()[0] or 0
-                c2.execute('SELECT COUNT(*) FROM legal_documents WHERE expiry_date BETWEEN ? AND ?', (today, (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')))
-                docs_expiring = c2.fetchone()[0] or 0
-                c2.execute("SELECT COUNT(*) FROM maintenance WHERE status='pending' AND due_date BETWEEN ? AND ?", (today, (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')))
-                maintenance_due = c2.fetchone()[0] or 0
-                c2.execute('SELECT COUNT(*) FROM users WHERE active = 1')
-                users_active = c2.fetchone()[0] or 0
-                return {
-                    'vehicles': vehicles,
-                    'customers': customers,
-                    'rentals_active': rentals_active,
-                    'invoices': invoices,
-                    'revenue': revenue,
-                    'insurance_expiring': insurance_expiring,
-                    'docs_expiring': docs_expiring,
-                    'maintenance_due': maintenance_due,
-                    'users_active': users_active,
-                }
+            today = datetime.now().strftime('%Y-%m-%d')
+            with self._stats_lock:
+                # The date-window counts shift at midnight; recomputing everything
+                # then also corrects any drift from concurrent writers.
+                if self._stats is None or self._stats_day != today:
+                    self._stats = self._compute_stats(today)
+                    self._stats_day = today
+                    self._stats_generation += 1
+                return dict(self._stats)
         except sqlite3.Error as e:
             logger.error(f"Database error in get_stats: {str(e)}\n{traceback.format_exc()}")
             raise HTTPException(status_code=500, detail="Failed to compute stats due to a server error. Please try again.")
 
-    def get_settings(self) -> Dict[str, Any]:
+    def get_settings_snapshot(self) -> Tuple[int, Dict[str, Any], str]:
+        """Returns (version, data, raw JSON). Loaded once, then replaced by save_settings."""
+        snapshot = self._settings
+        if snapshot is not None:
+            return snapshot
         try:
             with self.conn:
                 c = self.conn.cursor()
-                c.execute('SELECT data FROM settings WHERE id = 1')
+                c.execute('SELECT version, data FROM settings WHERE id = 1')
                 row = c.fetchone()
-                return json.loads(row[0]) if row and row[0] else {}
+            version, raw = (row[0], row[1] or '{}') if row else (0, '{}')
+            with self._settings_lock:
+                if self._settings is None or self._settings[0] < version:
+                    self._settings = (version, json.loads(raw), raw)
+                return self._settings
         except sqlite3.Error as e:
             logger.error(f"Database error in get_settings: {str(e)}\n{traceback.format_exc()}")
             raise HTTPException(status_code=500, detail="Failed to load settings.")
 
-    def save_settings(self, data: Dict[str, Any]):
+    def get_settings(self) -> Dict[str, Any]:
+        # Callers get their own copy; the snapshot is shared.
+        return copy.deepcopy(self.get_settings_snapshot()[1])
+
+    def save_settings(self, data: Dict[str, Any]) -> int:
         try:
-            with self.conn:
+            raw = json.dumps(data)
+            with self._write_txn():
                 c = self.conn.cursor()
                 c.execute(
-                    'INSERT INTO settings (id, data) VALUES (1, ?)\n                     ON CONFLICT(id) DO UPDATE SET data=excluded.data',
-                    (json.dumps(data),)
+                    'INSERT INTO settings (id, data) VALUES (1, ?)\n                     ON CONFLICT(id) DO UPDATE SET data=excluded.data, version=settings.version + 1',
+                    (raw,)
                 )
+                c.execute('SELECT version FROM settings WHERE id = 1')
+                version = c.fetchone()[0]
+            with self._settings_lock:
+                self._settings = (version, copy.deepcopy(data), raw)
+            return version
         except sqlite3.Error as e:
             logger.error(f"Database error in save_settings: {str(e)}\n{traceback.format_exc()}")
             raise HTTPException(status_code=500, detail="Failed to save settings.")
 
+    # --- Upload blobs ---
+    def register_blob(self, stored: StoredUpload):
+        """Moves a spooled upload into the blob store and records it.
+
+        Runs under the write lock that gc_uploads holds while it moves blobs
+        aside, so the file is checked after any collection has finished and
+        written again if that collection took it.
+        """
+        try:
+            with self.conn:
+                c = self.conn.cursor()
+                self._begin_immediate(c)
+                c.execute('''
+                    INSERT INTO blobs (digest, url, size, content_type, last_seen_at) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(digest) DO UPDATE SET last_seen_at = excluded.last_seen_at
+                ''', (stored.digest, stored.url, stored.size, stored.content_type,
+                      datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+                dest_path = os.path.join(UPLOAD_ROOT, stored.url[len('/uploads/'):])
+                if not os.path.exists(dest_path):
+                    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                    os.replace(stored.tmp_path, dest_path)
+        except sqlite3.Error as e:
+            logger.error(f"Database error in register_blob: {str(e)}\n{traceback.format_exc()}")
+            raise HTTPException(status_code=500, detail="Failed to store upload.")
+        finally:
+            if os.path.exists(stored.tmp_path):
+                os.unlink(stored.tmp_path)  # already stored, or the insert failed
+
+    def gc_uploads(self, grace_seconds: int = 3600) -> dict:
+        """Deletes blobs that no row references any more.
+
+        Blobs seen within grace_seconds are kept, so a file uploaded just before
+        its row is inserted is never collected. Files are renamed aside inside
+        the write transaction and deleted after it commits; if it fails they
+        are put back.
+        """
+        tombstones: List[Tuple[str, str]] = []
+        try:
+            cutoff = (datetime.now() - timedelta(seconds=grace_seconds)).strftime('%Y-%m-%d %H:%M:%S')
+            blob_root = os.path.join(UPLOAD_ROOT, BLOB_DIR)
+            try:
+                with self.conn:
+                    c = self.conn.cursor()
+                    self._begin_immediate(c)
+                    c.execute('SELECT url FROM blob_references')
+                    # Settings may hold an absolute URL; compare from /uploads/ on.
+                    referenced = {u[u.find('/uploads/'):] for (u,) in c.fetchall() if '/uploads/' in u}
+                    c.execute('SELECT digest, url, size FROM blobs WHERE last_seen_at < ?', (cutoff,))
+                    garbage = [row for row in c.fetchall() if row[1] not in referenced]
+                    c.executemany('DELETE FROM blobs WHERE digest = ?', [(row[0],) for row in garbage])
+                    for digest, url, _ in garbage:
+                        path = os.path.join(UPLOAD_ROOT, url[len('/uploads/'):])
+                        if os.path.exists(path):
+                            tombstone = os.path.join(blob_root, f'.gc-{digest}-{secrets.token_hex(4)}')
+                            os.replace(path, tombstone)
+                            tombstones.append((path, tombstone))
+                        try:
+                            os.rmdir(os.path.dirname(path))  # only succeeds once the shard is empty
+                        except OSError:
+                            pass
+            except BaseException:
+                for path, tombstone in tombstones:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(tombstone, path)
+                raise
+            for _, tombstone in tombstones:
+                os.unlink(tombstone)
+            logger.info(f"Upload GC removed {len(garbage)} blobs")
+            return {"removed": len(garbage), "bytes_freed": sum(row[2] for row in garbage)}
+        except sqlite3.Error as e:
+            logger.error(f"Database error in gc_uploads: {str(e)}\n{traceback.format_exc()}")
+            raise HTTPException(status_code=500, detail="Failed to clean up uploads.")
+
+    # --- Exports ---
+    # dataset -> (columns, select, keyset id column, date column). Rows are read
+    # in id-ordered chunks, one short query per chunk, so memory stays flat.
+    EXPORT_QUERIES: Dict[str, Tuple[List[str], str, str, Optional[str]]] = {
+        'rentals': (
+            ['id', 'car_id', 'customer_id', 'start_date', 'end_date', 'total_cost',
+             'deposit_amount', 'is_paid', 'payment_method', 'car_make', 'car_model',
+             'car_year', 'customer_name', 'customer_email'],
+            '''
+                SELECT r.id, r.car_id, r.customer_id, r.start_date, r.end_date,
+                    COALESCE(r.total_cost, 0.0), COALESCE(r.deposit_amount, 0.0),
+                    COALESCE(r.is_paid, 0), r.payment_method,
+                    c.make, c.model, c.year, cu.name, cu.email
+                FROM rentals r
+                JOIN cars c ON r.car_id = c.id
+                JOIN customers cu ON r.customer_id = cu.id
+            ''',
+            'r.id', 'r.start_date',
+        ),
+        'sales': (
+            ['id', 'rental_id', 'customer_id', 'car_id', 'total_cost', 'sale_date'],
+            'SELECT id, rental_id, customer_id, car_id, total_cost, sale_date FROM sales',
+            'id', 'sale_date',
+        ),
+        'customers': (
+            ['id', 'name', 'email', 'phone', 'id_card_url', 'driving_license_url'],
+            'SELECT id, name, email, phone, id_card_url, driving_license_url FROM customers',
+            'id', None,
+        ),
+    }
+
+    def iter_export(self, dataset: str, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                    chunk_size: int = 1000) -> Iterator[List[tuple]]:
+        if dataset not in self.EXPORT_QUERIES:
+            raise HTTPException(status_code=404, detail=f"Unknown export '{dataset}'.")
+        try:
+            for d in [date_from, date_to]:
+                if d:
+                    datetime.strptime(d, "%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date format: Use YYYY-MM-DD.")
+        _, select, id_col, date_col = self.EXPORT_QUERIES[dataset]
+        where, params = [], []
+        if date_col and date_from:
+            where.append(f'{date_col} >= ?')
+            params.append(date_from)
+        if date_col and date_to:
+            where.append(f'{date_col} <= ?')
+            params.append(date_to)
+        return self._export_chunks(dataset, select, id_col, where, params, chunk_size)
+
+    def _export_chunks(self, dataset, select, id_col, where, params, chunk_size) -> Iterator[List[tuple]]:
+        last_id = 0
+        while True:
+            sql = select + _where(where + [f'{id_col} > ?']) + f' ORDER BY {id_col} LIMIT ?'
+            try:
+                # self.conn is resolved per chunk: the streaming response may
+                # resume this generator on a different worker thread.
+                rows = self.conn.execute(sql, params + [last_id, chunk_size]).fetchall()
+            except sqlite3.Error as e:
+                logger.error(f"Database error in iter_export({dataset}): {str(e)}\n{traceback.format_exc()}")
+                raise
+            if not rows:
+                return
+            yield rows
+            if len(rows) < chunk_size:
+                return
+            last_id = rows[-1][0]
+
+    # --- Invoices ---
+    # One row per sale, with the same fields GET /rentals/{id}/invoice returns.
+    INVOICE_COLUMNS = ['sale_id', 'rental_id', 'customer_name', 'customer_email', 'car_make', 'car_model',
+                       'car_year', 'start_date', 'end_date', 'total_cost', 'deposit_amount', 'is_paid',
+                       'payment_method', 'sale_date']
+    INVOICE_SELECT = '''
+        SELECT s.id, r.id, cu.name, cu.email, c.make, c.model, c.year, r.start_date, r.end_date,
+            COALESCE(r.total_cost, 0.0), COALESCE(r.deposit_amount, 0.0), COALESCE(r.is_paid, 0),
+            COALESCE(r.payment_method, 'N/A'), s.sale_date
+        FROM sales s
+        JOIN rentals r ON s.rental_id = r.id
+        JOIN cars c ON r.car_id = c.id
+        JOIN customers cu ON r.customer_id = cu.id
+    '''
+
+    @classmethod
+    def _invoice_row_to_dict(cls, row) -> dict:
+        invoice = dict(zip(cls.INVOICE_COLUMNS, row))
+        invoice['is_paid'] = bool(invoice['is_paid'])
+        return invoice
+
+    def get_invoices(self, limit: Optional[int] = None, cursor: Optional[int] = None,
+                     date_from: Optional[str] = None, date_to: Optional[str] = None,
+                     paid: Optional[bool] = None, customer_id: Optional[int] = None,
+                     rental_ids: Optional[List[int]] = None) -> List[dict]:
+        """Invoice ledger, newest sale first, paged by sale id."""
+        try:
+            for d in [date_from, date_to]:
+                if d:
+                    datetime.strptime(d, "%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date format: Use YYYY-MM-DD.")
+        where, params = [], []
+        if date_from:
+            where.append('s.sale_date >= ?')
+            params.append(date_from)
+        if date_to:
+            where.append('s.sale_date <= ?')
+            params.append(date_to)
+        if paid is not None:
+            where.append('COALESCE(r.is_paid, 0) = ?')
+            params.append(int(paid))
+        if customer_id:
+            where.append('r.customer_id = ?')
+            params.append(customer_id)
+        if rental_ids:
+            where.append(f's.rental_id IN ({",".join("?" * len(rental_ids))})')
+            params.extend(rental_ids)
+        if cursor:
+            where.append('s.id < ?')
+            params.append(cursor)
+        sql = self.INVOICE_SELECT + _where(where) + ' ORDER BY s.id DESC'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        try:
+            with self.conn:
+                c = self.conn.cursor()
+                c.execute(sql, params)
+                return [self._invoice_row_to_dict(row) for row in c.fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Database error in get_invoices: {str(e)}\n{traceback.format_exc()}")
+            raise HTTPException(
+                status_code=500, detail="Failed to retrieve invoices due to a server error. Please try again.")
+
+    def get_invoice(self, rental_id: int) -> Optional[dict]:
+        invoices = self.get_invoices(rental_ids=[rental_id])
+        return invoices[0] if invoices else None
+
+    def iter_invoices(self, date_from: str, date_to: str, chunk_size: int = 200) -> Iterator[List[dict]]:
+        """Invoices for sales dated date_from..date_to (inclusive), in sale id order."""
+        try:
+            for d in [date_from, date_to]:
+                datetime.strptime(d, "%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date format: Use YYYY-MM-DD.")
+        chunks = self._export_chunks('invoices', self.INVOICE_SELECT, 's.id',
+                                     ['s.sale_date >= ?', 's.sale_date <= ?'], [date_from, date_to], chunk_size)
+        return ([self._invoice_row_to_dict(row) for row in rows] for rows in chunks)
+
+    def close(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+class AsyncDatabase:
+    """Async facade over Database.
+
+    Every call runs on a dedicated DB executor instead of Starlette's shared
+    threadpool, so endpoint concurrency is bounded by the number of database
+    workers (each with its own pooled connection), not by the threadpool size.
+    """
+
+    def __init__(self, database: Database, max_workers: int = 8):
+        self.database = database
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='db')
+
+    async def run(self, fn, *args, **kwargs):
+        # Runs fn on one DB worker thread, so a multi-step `with db.conn:`
+        # block stays on a single connection.
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    def __getattr__(self, name):
+        attr = getattr(self.database, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+        return call
+
+    async def iterate(self, iterator: Iterator) -> AsyncIterator:
+        # Pulls each item of a blocking iterator (e.g. iter_export) on the DB executor.
+        done = object()
+        while True:
+            item = await self.run(next, iterator, done)
+            if item is done:
+                return
+            yield item
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.database.close()
+
+
+class SessionCache:
+    """Bounded LRU of session lookups used by require_admin.
+
+    Keys are SHA-256 digests of the bearer token. An entry lives until the
+    session's expires_at or max_age seconds, whichever comes first; logout and
+    user updates invalidate it explicitly.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_age: int = 300):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries: 'OrderedDict[str, Tuple[User, datetime]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, token: str) -> Optional[User]:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= datetime.now():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, token: str, user: User, expires_at: str):
+        deadline = min(datetime.strptime(expires_at, '%Y-%m-%d %H:%M:%S'),
+                       datetime.now() + timedelta(seconds=self.max_age))
+        with self._lock:
+            self._entries[self._key(token)] = (user, deadline)
+            self._entries.move_to_end(self._key(token))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_token(self, token: str):
+        with self._lock:
+            self._entries.pop(self._key(token), None)
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for key in [k for k, (u, _) in self._entries.items() if u.id == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Worker processes for the pools below are spawned, never forked: by the time
+# a pool starts, the DB executor, the event loop and SQLite's threads exist,
+# and a forked child can inherit one of their locks mid-acquire.
+_POOL_CONTEXT = multiprocessing.get_context('spawn')
+
+
+class PasswordHasher:
+    """Runs PBKDF2 on a bounded process pool so logins don't hold the GIL
+    (or a request thread) for tens of milliseconds each."""
+
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        # Created on first use so importing the app doesn't spawn processes.
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=_POOL_CONTEXT)
+        return self._pool
+
+    async def hash(self, password: str) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor(), hash_password, password)
+
+    async def verify(self, password: str, stored: str) -> bool:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor(), verify_password, password, stored)
+
     def close(self):
-        self.conn.close()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
 
 
-# FastAPI App
-app = FastAPI()
+class InvoiceRenderer:
+    """Renders invoice PDFs on a process pool and caches them on disk.
+
+    Files are keyed by sale_id, settings version and a digest of the invoice
+    fields: returning a rental again rewrites its dates and total under the
+    same sale, and every settings save bumps the version, so a cached file is
+    only reused while all three are unchanged.
+    """
+
+    def __init__(self, cache_dir: str = 'invoice_cache', max_workers: int = 2):
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=_POOL_CONTEXT)
+        return self._pool
+
+    def _path(self, invoice: Dict[str, Any], version: int) -> str:
+        digest = hashlib.sha256(json.dumps(invoice, sort_keys=True, default=str).encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"invoice-{invoice['sale_id']}-v{version}-{digest}.pdf")
+
+    def _read(self, path: str) -> Optional[bytes]:
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, sale_id: int, path: str, data: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.part')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        # Files rendered from older settings or invoice data are never read again.
+        for stale in glob.glob(os.path.join(self.cache_dir, f'invoice-{sale_id}-v*.pdf')):
+            if stale != path:
+                try:
+                    os.unlink(stale)
+                except FileNotFoundError:
+                    pass
+
+    async def render(self, invoice: Dict[str, Any], settings_snapshot: Tuple[int, Dict[str, Any], str]) -> bytes:
+        version, settings, _ = settings_snapshot
+        path = self._path(invoice, version)
+        data = await run_in_threadpool(self._read, path)
+        if data is None:
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(self._executor(), render_invoice_pdf, invoice, settings)
+            await run_in_threadpool(self._write, invoice['sale_id'], path, data)
+        return data
+
+    async def render_many(self, invoices: AsyncIterator[Dict[str, Any]],
+                          settings_snapshot: Tuple[int, Dict[str, Any], str]) -> AsyncIterator[Tuple[Dict[str, Any], bytes]]:
+        """Yields (invoice, pdf) in input order, keeping a few renders in flight per worker."""
+        window = self.max_workers * 2
+        pending = deque()
+        try:
+            async for invoice in invoices:
+                pending.append((invoice, asyncio.ensure_future(self.render(invoice, settings_snapshot))))
+                if len(pending) >= window:
+                    invoice, future = pending.popleft()
+                    yield invoice, await future
+            while pending:
+                invoice, future = pending.popleft()
+                yield invoice, await future
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+
+class LoginThrottle:
+    """Per-account failed-login limiter: max_failures within window seconds
+    locks the account until the oldest failure ages out.
+
+    Each attempt reserves a slot before the (slow, off-thread) password check
+    and counts as a failure unless it is refunded, so parallel guesses cannot
+    all pass the lockout check before the first failure is recorded. Slots
+    live in the login_attempts table, so the limit holds across every worker
+    sharing the database. Blocking; call through AsyncDatabase.run."""
+
+    def __init__(self, db: Database, max_failures: int = 5, window: int = 900):
+        self.db = db
+        self.max_failures = max_failures
+        self.window = window
+
+    def reserve(self, email: str) -> int:
+        """Takes an attempt slot. Returns 0 when one was taken, otherwise the
+        seconds until the account may try again."""
+        now = time.time()
+        key = email.lower()
+        with self.db.conn:
+            c = self.db.conn.cursor()
+            self.db._begin_immediate(c)
+            c.execute('DELETE FROM login_attempts WHERE attempted_at <= ?', (now - self.window,))
+            c.execute('SELECT COUNT(*), MIN(attempted_at) FROM login_attempts WHERE email = ?', (key,))
+            count, oldest = c.fetchone()
+            if count >= self.max_failures:
+                return int(self.window - (now - oldest)) + 1
+            c.execute('INSERT INTO login_attempts (email, attempted_at) VALUES (?, ?)', (key, now))
+            return 0
+
+    def refund(self, email: str):
+        """Gives back the newest slot, for attempts that failed for reasons
+        other than the credentials."""
+        with self.db.conn:
+            self.db.conn.execute('''
+                DELETE FROM login_attempts WHERE rowid =
+                    (SELECT rowid FROM login_attempts WHERE email = ? ORDER BY attempted_at DESC LIMIT 1)
+            ''', (email.lower(),))
+
+    def reset(self, email: str):
+        with self.db.conn:
+            self.db.conn.execute('DELETE FROM login_attempts WHERE email = ?', (email.lower(),))
+
+
+class ExpiryScheduler:
+    """Heap-based timer queue for notifications.
+
+    Holds (alert_date, kind, source_id) for items that will enter the
+    notification window later. When an entry comes due it re-syncs just that
+    item, so entries left behind by edits or deletions are harmless.
+    """
+
+    # Upper bound on a single sleep, so clock changes are picked up.
+    MAX_SLEEP = 3600
+
+    def __init__(self, adb: AsyncDatabase):
+        self.adb = adb
+        self._heap: List[Tuple[str, str, int]] = []
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def schedule(self, alert_date: str, kind: str, source_id: int):
+        # Called from DB worker threads.
+        entry = (alert_date, kind, source_id)
+        with self._lock:
+            if entry in self._queued:
+                return
+            self._queued.add(entry)
+            heapq.heappush(self._heap, entry)
+            wake = self._heap[0] == entry
+        if wake and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _pop_due(self, today: str) -> List[Tuple[str, str, int]]:
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= today:
+                entry = heapq.heappop(self._heap)
+                self._queued.discard(entry)
+                due.append(entry)
+        return due
+
+    def _seconds_until_next(self) -> float:
+        with self._lock:
+            next_date = self._heap[0][0] if self._heap else None
+        if next_date is None:
+            return self.MAX_SLEEP
+        delay = (datetime.strptime(next_date, '%Y-%m-%d') - datetime.now()).total_seconds()
+        return min(max(delay, 0), self.MAX_SLEEP)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self.adb.database.notification_listener = self.schedule
+        scheduled = await self.adb.refresh_notifications()
+        logger.info(f"Notifications refreshed; {scheduled} future alerts scheduled")
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            for _, kind, source_id in self._pop_due(datetime.now().strftime('%Y-%m-%d')):
+                try:
+                    await self.adb.sync_notifications(kind, source_id=source_id)
+                except Exception as e:
+                    logger.error(f"Failed to sync notification {kind}/{source_id}: {str(e)}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._seconds_until_next())
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self):
+        self.adb.database.notification_listener = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class AppConfig(BaseModel):
+    """Settings for create_app. from_env() reads the same variables the app
+    has always used."""
+    db_name: str = 'car_rental.db'
+    cors_origins: List[str] = ['http://localhost:5173']
+    db_workers: int = 8
+    hash_workers: int = 2
+    pdf_workers: int = 2
+    invoice_cache_dir: str = 'invoice_cache'
+    sql_trace: bool = False
+    sql_slow_ms: float = 100.0
+    # Startup (migrations check, admin bootstrap, notification refresh) longer
+    # than this is logged as a warning.
+    startup_budget_ms: float = 2000.0
+    # How often each worker checks for writes made by other workers, which
+    # bounds how long its caches (sessions, stats, settings, availability
+    # for reads outside a write) can lag a change made elsewhere.
+    change_poll_seconds: float = 1.0
+
+    @classmethod
+    def from_env(cls) -> 'AppConfig':
+        env = os.environ
+        return cls(
+            db_name=env.get('DB_PATH', cls.model_fields['db_name'].default),
+            cors_origins=[o.strip() for o in env['CORS_ORIGINS'].split(',')] if env.get('CORS_ORIGINS')
+            else cls.model_fields['cors_origins'].default,
+            db_workers=int(env.get('DB_WORKERS', 8)),
+            hash_workers=int(env.get('HASH_WORKERS', 2)),
+            pdf_workers=int(env.get('PDF_WORKERS', 2)),
+            invoice_cache_dir=env.get('INVOICE_CACHE_DIR', 'invoice_cache'),
+            sql_trace=env.get('SQL_TRACE') == '1',
+            sql_slow_ms=float(env.get('SQL_SLOW_MS', 100)),
+            startup_budget_ms=float(env.get('STARTUP_BUDGET_MS', 2000)),
+            change_poll_seconds=float(env.get('CHANGE_POLL_SECONDS', 1.0)),
+        )
+
+
+class Services:
+    """The database and helpers one app instance serves requests with.
+
+    Built from the app's AppConfig when its lifespan starts and kept on
+    app.state.services; routes reach it through get_services/get_adb. Two
+    apps in one process (tests, benchmarks) therefore never share state.
+    """
+
+    def __init__(self, config: AppConfig):
+        self.config = config
+        self.query_tracer = QueryTracer(slow_ms=config.sql_slow_ms) if config.sql_trace else None
+        self.db = Database(config.db_name, tracer=self.query_tracer)
+        self.adb = AsyncDatabase(self.db, max_workers=config.db_workers)
+        self.session_cache = SessionCache()
+        self.db.change_listeners.append(({'users', 'sessions'}, self.session_cache.clear))
+        self.password_hasher = PasswordHasher(max_workers=config.hash_workers)
+        self.login_throttle = LoginThrottle(self.db)
+        self.expiry_scheduler = ExpiryScheduler(self.adb)
+        self.invoice_renderer = InvoiceRenderer(config.invoice_cache_dir, max_workers=config.pdf_workers)
+
+    def close(self):
+        self.password_hasher.close()
+        self.invoice_renderer.close()
+        self.adb.close()
+
 
-# Ensure uploads directory exists and mount static files
-os.makedirs('uploads/customers', exist_ok=True)
-os.makedirs('uploads/branding', exist_ok=True)
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
-@app.post("/upload-logo")
-def upload_logo(file: UploadFile = File(...)):
+async def _poll_changes(adb: AsyncDatabase, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await adb.sync_changes()
+        except Exception as e:
+            logger.error(f"Change poll failed: {str(e)}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Everything that touches the disk or the database happens here, not at
+    # import, so importing main (workers, tooling, benchmarks) stays cheap.
+    config: AppConfig = app.state.config
+    started = time.perf_counter()
+    os.makedirs(os.path.join(UPLOAD_ROOT, BLOB_DIR), exist_ok=True)
+    os.makedirs(config.invoice_cache_dir, exist_ok=True)
+    services = app.state.services = Services(config)
+    await services.adb.initialize()
+    await services.expiry_scheduler.start()
+    metrics.gauge('db_connections', 'Open SQLite connections (one per worker thread).', (),
+                  lambda: {(): len(services.db._connections)})
+    global _startup_seconds
+    _startup_seconds = time.perf_counter() - started
+    if _startup_seconds * 1000 > config.startup_budget_ms:
+        logger.warning(f"Startup took {_startup_seconds * 1000:.0f} ms, over the "
+                       f"{config.startup_budget_ms:.0f} ms budget")
+    else:
+        logger.info(f"Startup took {_startup_seconds * 1000:.0f} ms")
+    poller = asyncio.create_task(_poll_changes(services.adb, config.change_poll_seconds))
+    try:
+        yield
+    finally:
+        poller.cancel()
+        await services.expiry_scheduler.stop()
+        services.close()
+
+
+def get_services(request: Request) -> Services:
+    return request.app.state.services
+
+
+def get_adb(request: Request) -> AsyncDatabase:
+    return request.app.state.services.adb
+
+
+router = APIRouter()
+
+class UploadFiles(StaticFiles):
+    """StaticFiles for /uploads with long-lived caching.
+
+    Upload URLs are never rewritten (blobs are named by their SHA-256 digest,
+    older files by timestamp), so responses are marked immutable for a year and
+    browsers stop revalidating. Blobs get their digest as a strong ETag.
+    FileResponse already answers Range requests and uses the server's pathsend
+    extension, where available, to avoid copying large PDFs through Python.
+    """
+
+    CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        headers = {'cache-control': self.CACHE_CONTROL}
+        stem = os.path.splitext(os.path.basename(full_path))[0]
+        if re.fullmatch(r'[0-9a-f]{64}', stem):
+            headers['etag'] = f'"{stem}"'
+        response = FileResponse(full_path, status_code=status_code, headers=headers, stat_result=stat_result)
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+class MetricsMiddleware:
+    """Records request count and latency per route template.
+
+    Labels use the matched route's path ("/rentals/{rental_id}/invoice"), not
+    the raw URL, so ids do not multiply the series. Requests that match no
+    route are labelled "unmatched".
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the shared scope.
+            route = scope.get('route')
+            template = getattr(route, 'path', None) or 'unmatched'
+            method = scope['method']
+            metrics.inc('http_requests_total', (method, template, str(status)))
+            metrics.observe('http_request_duration_seconds', (method, template), time.perf_counter() - started)
+
+
+async def store_upload(adb: AsyncDatabase, upload: UploadFile, category: str) -> str:
+    stored = await run_in_threadpool(save_upload, upload, category)
+    await adb.register_blob(stored)
+    return stored.url
+
+
+@router.post("/upload-logo")
+async def upload_logo(file: UploadFile = File(...), adb: AsyncDatabase = Depends(get_adb)):
     try:
         if not file or not file.filename:
             raise HTTPException(status_code=400, detail="No file uploaded")
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
-        filename = f"branding/{timestamp}_{_safe_filename(file.filename)}"
-        dest_path = os.path.join("uploads", filename)
-        with open(dest_path, "wb") as out:
-            out.write(file.file.read())
-        return {"url": f"/uploads/{filename}"}
+        return {"url": await store_upload(adb, file, 'branding')}
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error in /upload-logo: {str(e)}\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail="Logo upload failed")
 
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:5173"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-db = Database()
-
-from fastapi import Depends, Header
+_process_started = time.time()
+_startup_seconds: Optional[float] = None
+metrics.gauge('process_start_time_seconds', 'Unix time the process started.', (),
+              lambda: {(): _process_started})
+metrics.gauge('startup_duration_seconds', 'Time the lifespan startup took.', (),
+              lambda: {(): _startup_seconds} if _startup_seconds is not None else {})
 
 # --- Auth dependencies & routes ---
 
-def require_admin(authorization: Optional[str] = Header(None)) -> User:
+async def require_admin(authorization: Optional[str] = Header(None),
+                        services: Services = Depends(get_services)) -> User:
     if not authorization or not authorization.lower().startswith('bearer '):
         raise HTTPException(status_code=401, detail='Missing or invalid Authorization header')
     token = authorization.split(' ', 1)[1].strip()
-    user = db.get_user_by_session(token)
+    user = services.session_cache.get(token)
     if not user:
-        raise HTTPException(status_code=401, detail='Invalid or expired session')
+        session = await services.adb.get_session(token)
+        if not session:
+            raise HTTPException(status_code=401, detail='Invalid or expired session')
+        user, expires_at = session
+        services.session_cache.put(token, user, expires_at)
     if user.role != 'admin' or not user.active:
         raise HTTPException(status_code=403, detail='Admin access required')
     return user
@@ -1061,35 +3485,42 @@ class LoginPayload(BaseModel):
     email: str
     password: str
 
-@app.post('/auth/login')
-def login(payload: LoginPayload):
+@router.post('/auth/login')
+async def login(payload: LoginPayload, services: Services = Depends(get_services)):
+    adb, password_hasher, login_throttle = services.adb, services.password_hasher, services.login_throttle
+    # The slot is taken before the password check and kept as a failure
+    # unless the credentials turn out to be valid.
+    retry_after = await adb.run(login_throttle.reserve, payload.email)
+    if retry_after:
+        raise HTTPException(status_code=429, detail='Too many failed login attempts. Try again later.',
+                            headers={'Retry-After': str(retry_after)})
     try:
-        with db.conn:
-            c = db.conn.cursor()
-            c.execute('SELECT id, name, email, role, active, password_hash FROM users WHERE email = ?', (payload.email,))
-            row = c.fetchone()
-            if not row:
-                raise HTTPException(status_code=401, detail='Invalid credentials')
-            user_id, name, email, role, active, password_hash = row
-            # verify password
-            if not db._verify_password(payload.password, password_hash or ''):
-                raise HTTPException(status_code=401, detail='Invalid credentials')
-            if not active:
-                raise HTTPException(status_code=403, detail='User is inactive')
-            token, exp = db.create_session(user_id)
-            return {"token": token, "expires_at": exp, "user": {"id": user_id, "name": name, "email": email, "role": role}}
+        row = await adb.get_credentials(payload.email)
+        # verify password off the event loop, on the hashing pool
+        if not row or not await password_hasher.verify(payload.password, row[5] or ''):
+            raise HTTPException(status_code=401, detail='Invalid credentials')
+        user_id, name, email, role, active, password_hash = row
+        await adb.run(login_throttle.reset, payload.email)
+        if not active:
+            raise HTTPException(status_code=403, detail='User is inactive')
+        if password_needs_rehash(password_hash):
+            await adb.set_password_hash(user_id, await password_hasher.hash(payload.password))
+        token, exp = await adb.create_session(user_id)
+        return {"token": token, "expires_at": exp, "user": {"id": user_id, "name": name, "email": email, "role": role}}
     except HTTPException:
         raise
     except Exception as e:
+        await adb.run(login_throttle.refund, payload.email)
         logger.error(f"Error in /auth/login: {str(e)}\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail='Login failed')
 
-@app.post('/auth/logout')
-def logout(authorization: Optional[str] = Header(None)):
+def _logout(services: Services, authorization: Optional[str]):
     try:
         if authorization and authorization.lower().startswith('bearer '):
             token = authorization.split(' ', 1)[1].strip()
-            with db.conn:
+            services.session_cache.invalidate_token(token)
+            db = services.db
+            with db._write_txn():
                 c = db.conn.cursor()
                 c.execute('DELETE FROM sessions WHERE token = ?', (token,))
         return {"ok": True}
@@ -1097,11 +3528,52 @@ def logout(authorization: Optional[str] = Header(None)):
         logger.error(f"Error in /auth/logout: {str(e)}\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail='Logout failed')
 
+@router.post('/auth/logout')
+async def logout(authorization: Optional[str] = Header(None), services: Services = Depends(get_services)):
+    return await services.adb.run(_logout, services, authorization)
+
 
-@app.get("/cars", response_model=List[Car])
-def get_cars():
+def _set_next_cursor(response: Response, items: list, limit: Optional[int], key: str = 'id'):
+    # Keyset pagination: a full page means more rows may follow the last id.
+    # Each list keeps the order it has always had, and the cursor continues in
+    # that order: /cars and /customers ascend by id (next page: id > cursor),
+    # /rentals and /invoices are newest first (next page: id < cursor).
+    if limit and len(items) == limit:
+        last = items[-1]
+        response.headers['X-Next-Cursor'] = str(last[key] if isinstance(last, dict) else getattr(last, key))
+
+
+class FastJSONResponse(Response):
+    """orjson-encoded response for list endpoints.
+
+    The Database list methods already return plain dicts in the model's shape.
+    Returning a Response skips FastAPI's response_model validation and
+    jsonable_encoder pass, leaving one orjson call for the whole list. The
+    route's response_model still documents the schema.
+    """
+
+    media_type = 'application/json'
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+
+def _list_response(items: list, limit: Optional[int] = None, key: str = 'id') -> FastJSONResponse:
+    response = FastJSONResponse(items)
+    _set_next_cursor(response, items, limit, key)
+    return response
+
+
+@router.get("/cars", response_model=List[Car])
+async def get_cars(
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[int] = Query(None, ge=1),
+    available: Optional[bool] = None,
+    adb: AsyncDatabase = Depends(get_adb),
+):
     try:
-        return db.get_all_cars()
+        cars = await adb.get_all_cars(limit=limit, cursor=cursor, available=available)
+        return _list_response(cars, limit)
     except HTTPException:
         raise
     except Exception as e:
@@ -1112,10 +3584,10 @@ def get_cars():
 
 
 # New endpoint: /cars/inventory
-@app.get("/cars/inventory", response_model=List[dict])
-def get_cars_inventory():
+@router.get("/cars/inventory", response_model=List[dict])
+async def get_cars_inventory(adb: AsyncDatabase = Depends(get_adb)):
     try:
-        return db.get_cars_with_maintenance_summary()
+        return _list_response(await adb.get_cars_with_maintenance_summary())
     except HTTPException:
         raise
     except Exception as e:
@@ -1123,10 +3595,14 @@ def get_cars_inventory():
         raise HTTPException(status_code=500, detail="Unable to retrieve vehicle inventory.")
 
 
-@app.get("/cars/available", response_model=List[Car])
-def get_available_cars():
+@router.get("/cars/available", response_model=List[Car])
+async def get_available_cars(start: Optional[str] = None, end: Optional[str] = None,
+                             adb: AsyncDatabase = Depends(get_adb)):
     try:
-        return db.get_available_cars()
+        if start:
+            # Every car with no booking overlapping [start, end]
+            return _list_response(await adb.get_cars_free_between(start, end))
+        return _list_response(await adb.get_available_cars())
     except HTTPException:
         raise
     except Exception as e:
@@ -1136,10 +3612,10 @@ def get_available_cars():
             status_code=500, detail="Unable to retrieve available cars due to a server error. Please try again.")
 
 
-@app.post("/cars", response_model=int)
-def add_car(car: Car):
+@router.post("/cars", response_model=int)
+async def add_car(car: Car, adb: AsyncDatabase = Depends(get_adb)):
     try:
-        return db.add_car(car)
+        return await adb.add_car(car)
     except HTTPException:
         raise
     except Exception as e:
@@ -1149,10 +3625,16 @@ def add_car(car: Car):
             status_code=500, detail="Failed to add car due to a server error. Please try again.")
 
 
-@app.get("/customers", response_model=List[Customer])
-def get_customers():
+@router.get("/customers", response_model=List[Customer])
+async def get_customers(
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[int] = Query(None, ge=1),
+    q: Optional[str] = None,
+    adb: AsyncDatabase = Depends(get_adb),
+):
     try:
-        return db.get_all_customers()
+        customers = await adb.get_all_customers(limit=limit, cursor=cursor, q=q)
+        return _list_response(customers, limit)
     except HTTPException:
         raise
     except Exception as e:
@@ -1162,13 +3644,14 @@ def get_customers():
             status_code=500, detail="Unable to retrieve customers due to a server error. Please try again.")
 
 
-@app.post("/customers", response_model=int)
-def add_customer(
+@router.post("/customers", response_model=int)
+async def add_customer(
     name: str = Form(...),
     email: str = Form(...),
     phone: Optional[str] = Form(None),
     id_card: Optional[UploadFile] = File(None),
     driving_license: Optional[UploadFile] = File(None),
+    adb: AsyncDatabase = Depends(get_adb),
 ):
     try:
         # Basic validation
@@ -1180,27 +3663,13 @@ def add_customer(
         # Save files if provided
         id_card_url = None
         dl_url = None
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
-
-        def _safe_filename(fname: str) -> str:
-            return fname.replace("/", "_").replace("\\", "_")
-
         if id_card is not None and id_card.filename:
-            filename = f"customers/{timestamp}_id_{_safe_filename(id_card.filename)}"
-            dest_path = os.path.join("uploads", filename)
-            with open(dest_path, "wb") as out:
-                out.write(id_card.file.read())
-            id_card_url = f"/uploads/{filename}"
-
+            id_card_url = await store_upload(adb, id_card, 'customers')
         if driving_license is not None and driving_license.filename:
-            filename = f"customers/{timestamp}_dl_{_safe_filename(driving_license.filename)}"
-            dest_path = os.path.join("uploads", filename)
-            with open(dest_path, "wb") as out:
-                out.write(driving_license.file.read())
-            dl_url = f"/uploads/{filename}"
+            dl_url = await store_upload(adb, driving_license, 'customers')
 
         cust = Customer(name=name, email=email, phone=phone, id_card_url=id_card_url, driving_license_url=dl_url)
-        return db.add_customer(cust)
+        return await adb.add_customer(cust)
     except HTTPException:
         raise
     except Exception as e:
@@ -1212,10 +3681,23 @@ def add_customer(
         )
 
 
-@app.get("/rentals", response_model=List[dict])
-def get_rentals():
+@router.get("/rentals", response_model=List[dict])
+async def get_rentals(
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[int] = Query(None, ge=1),
+    status: Optional[str] = Query(None, pattern='^(active|completed)$'),
+    car_id: Optional[int] = None,
+    customer_id: Optional[int] = None,
+    start_from: Optional[str] = None,
+    start_to: Optional[str] = None,
+    ends_from: Optional[str] = None,
+    adb: AsyncDatabase = Depends(get_adb),
+):
     try:
-        return db.get_all_rentals()
+        rentals = await adb.get_all_rentals(
+            limit=limit, cursor=cursor, status=status, car_id=car_id,
+            customer_id=customer_id, start_from=start_from, start_to=start_to, ends_from=ends_from)
+        return _list_response(rentals, limit)
     except HTTPException:
         raise
     except Exception as e:
@@ -1225,10 +3707,10 @@ def get_rentals():
             status_code=500, detail="Unable to retrieve rentals due to a server error. Please try again.")
 
 
-@app.get("/rentals/active", response_model=List[dict])
-def get_active_rentals():
+@router.get("/rentals/active", response_model=List[dict])
+async def get_active_rentals(adb: AsyncDatabase = Depends(get_adb)):
     try:
-        return db.get_active_rentals()
+        return _list_response(await adb.get_active_rentals())
     except HTTPException:
         raise
     except Exception as e:
@@ -1238,8 +3720,7 @@ def get_active_rentals():
             status_code=500, detail="Failed to retrieve active rentals due to a server error. Please try again.")
 
 
-@app.post("/rentals", response_model=int)
-def add_rental(rental: Rental):
+def _create_rental(db: Database, rental: Rental) -> int:
     try:
         with db.conn:
             car = db.get_car_by_id(rental.car_id)
@@ -1286,8 +3767,12 @@ def add_rental(rental: Rental):
             status_code=500, detail="Failed to create rental due to a server error. Please try again.")
 
 
-@app.put("/rentals/{rental_id}/return", response_model=int)
-def return_car(rental_id: int):
+@router.post("/rentals", response_model=int)
+async def add_rental(rental: Rental, adb: AsyncDatabase = Depends(get_adb)):
+    return await adb.run(_create_rental, adb.database, rental)
+
+
+def _return_rental(db: Database, rental_id: int) -> int:
     try:
         with db.conn:
             rental = db.get_rental_by_id(rental_id)
@@ -1380,44 +3865,99 @@ def return_car(rental_id: int):
             status_code=500, detail=f"Failed to process return for rental ID {rental_id} due to a server error. Please try again.")
 
 
-@app.get("/rentals/{rental_id}/invoice")
-def get_invoice(rental_id: int):
+MAX_BATCH_SIZE = 500
+
+
+class RentalReturnBatch(BaseModel):
+    rental_ids: List[int]
+
+
+@router.post("/rentals/batch", response_model=List[dict])
+async def add_rentals_batch(rentals: List[Rental], adb: AsyncDatabase = Depends(get_adb)):
+    try:
+        if len(rentals) > MAX_BATCH_SIZE:
+            raise HTTPException(status_code=400, detail=f"A batch may contain at most {MAX_BATCH_SIZE} rentals.")
+        return await adb.add_rentals_batch(rentals)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in /rentals/batch endpoint: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail="Failed to create rentals due to a server error. Please try again.")
+
+
+@router.post("/rentals/returns/batch", response_model=List[dict])
+async def return_rentals_batch(payload: RentalReturnBatch, adb: AsyncDatabase = Depends(get_adb)):
     try:
-        rental = db.get_rental_by_id(rental_id)
+        if len(payload.rental_ids) > MAX_BATCH_SIZE:
+            raise HTTPException(status_code=400, detail=f"A batch may contain at most {MAX_BATCH_SIZE} returns.")
+        return await adb.return_rentals_batch(payload.rental_ids)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in /rentals/returns/batch endpoint: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail="Failed to process returns due to a server error. Please try again.")
+
+
+@router.put("/rentals/{rental_id}/return", response_model=int)
+async def return_car(rental_id: int, adb: AsyncDatabase = Depends(get_adb)):
+    return await adb.run(_return_rental, adb.database, rental_id)
+
+
+@router.get("/invoices", response_model=List[dict])
+async def get_invoices(
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[int] = Query(None, ge=1),
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    paid: Optional[bool] = None,
+    customer_id: Optional[int] = None,
+    rental_ids: Optional[List[int]] = Query(None),
+    adb: AsyncDatabase = Depends(get_adb),
+):
+    """Invoice ledger: one row per completed rental, from a single JOIN.
+
+    Pass rental_ids (repeated) to fetch specific invoices in one round trip.
+    """
+    try:
+        if rental_ids and len(rental_ids) > MAX_BATCH_SIZE:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} rental_ids may be requested at once.")
+        invoices = await adb.get_invoices(limit=limit, cursor=cursor, date_from=date_from, date_to=date_to,
+                                          paid=paid, customer_id=customer_id, rental_ids=rental_ids)
+        return _list_response(invoices, limit, key='sale_id')
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in /invoices endpoint: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve invoices due to a server error. Please try again.")
+
+
+@router.get("/rentals/{rental_id}/invoice")
+async def get_invoice(rental_id: int, adb: AsyncDatabase = Depends(get_adb)):
+    try:
+        invoice = await adb.get_invoice(rental_id)
+        if invoice:
+            return invoice
+        # Not invoiceable; the lookups below only work out which error to report.
+        rental = await adb.get_rental_by_id(rental_id)
         if not rental:
             raise HTTPException(
                 status_code=404, detail=f"Rental with ID {rental_id} not found.")
         if not rental.end_date:
             raise HTTPException(
                 status_code=400, detail=f"Rental with ID {rental_id} is not completed. Invoice cannot be generated.")
-        sale = db.get_sale_by_rental_id(rental_id)
+        sale = await adb.get_sale_by_rental_id(rental_id)
         if not sale:
             raise HTTPException(
                 status_code=404, detail=f"Sale for rental ID {rental_id} not found.")
-        car = db.get_car_by_id(rental.car_id)
+        car = await adb.get_car_by_id(rental.car_id)
         if not car:
             raise HTTPException(
                 status_code=404, detail=f"Car with ID {rental.car_id} not found.")
-        customer = db.get_customer_by_id(rental.customer_id)
+        customer = await adb.get_customer_by_id(rental.customer_id)
         if not customer:
             raise HTTPException(
                 status_code=404, detail=f"Customer with ID {rental.customer_id} not found.")
-        return {
-            "rental_id": rental.id,
-            "sale_id": sale.id,
-            "customer_name": customer.name,
-            "customer_email": customer.email,
-            "car_make": car.make,
-            "car_model": car.model,
-            "car_year": car.year,
-            "start_date": rental.start_date,
-            "end_date": rental.end_date,
-            "total_cost": rental.total_cost or 0.0,
-            "deposit_amount": rental.deposit_amount,
-            "is_paid": rental.is_paid,
-            "payment_method": rental.payment_method or "N/A",
-            "sale_date": sale.sale_date
-        }
+        raise HTTPException(status_code=404, detail=f"Invoice for rental ID {rental_id} not found.")
     except HTTPException:
         raise
     except Exception as e:
@@ -1427,8 +3967,79 @@ def get_invoice(rental_id: int):
             status_code=500, detail=f"Failed to generate invoice for rental ID {rental_id} due to a server error. Please try again.")
 
 
-@app.post('/cars/{car_id}/insurance', response_model=int)
-def create_insurance(
+@router.get("/rentals/{rental_id}/invoice.pdf")
+async def get_invoice_pdf(rental_id: int, services: Services = Depends(get_services)):
+    invoice = await get_invoice(rental_id, adb=services.adb)
+    try:
+        pdf = await services.invoice_renderer.render(invoice, await services.adb.get_settings_snapshot())
+    except Exception as e:
+        logger.error(f"Error rendering invoice PDF for rental ID {rental_id}: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail="Failed to render invoice PDF. Please try again.")
+    return Response(
+        content=pdf,
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'inline; filename="invoice-{invoice["sale_id"]}.pdf"'},
+    )
+
+
+class _ZipSink:
+    """Write-only, non-seekable target for ZipFile; drained after each entry."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+async def _invoice_zip(renderer: InvoiceRenderer, invoices: AsyncIterator[Dict[str, Any]],
+                       settings_snapshot) -> AsyncIterator[bytes]:
+    sink = _ZipSink()
+    # PDF content streams are already deflated, so entries are stored as-is.
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        async for invoice, pdf in renderer.render_many(invoices, settings_snapshot):
+            archive.writestr(f"invoice-{invoice['sale_id']}.pdf", pdf)
+            yield sink.drain()
+    yield sink.drain()
+
+
+@router.get("/invoices/pdf")
+async def get_invoices_pdf(date_from: str = Query(..., alias="from"), date_to: str = Query(..., alias="to"),
+                           services: Services = Depends(get_services)):
+    try:
+        adb = services.adb
+        # One settings version for the whole archive, even if settings change mid-stream.
+        settings_snapshot = await adb.get_settings_snapshot()
+        chunks = adb.iterate(adb.database.iter_invoices(date_from, date_to))
+
+        async def invoices():
+            async for rows in chunks:
+                for invoice in rows:
+                    yield invoice
+
+        return StreamingResponse(
+            _invoice_zip(services.invoice_renderer, invoices(), settings_snapshot),
+            media_type="application/zip",
+            headers={"Content-Disposition": f'attachment; filename="invoices-{date_from}-to-{date_to}.zip"'},
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in /invoices/pdf: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail="Failed to export invoices due to a server error. Please try again.")
+
+
+@router.post('/cars/{car_id}/insurance', response_model=int)
+async def create_insurance(
     car_id: int,
     provider: str = Form(...),
     policy_number: str = Form(...),
@@ -1436,22 +4047,16 @@ def create_insurance(
     end_date: str = Form(...),
     coverage: Optional[str] = Form(None),
     file: Optional[UploadFile] = File(None),
+    adb: AsyncDatabase = Depends(get_adb),
 ):
     try:
-        if not db.get_car_by_id(car_id):
+        if not await adb.get_car_by_id(car_id):
             raise HTTPException(status_code=404, detail=f'Car {car_id} not found')
 
         # Save uploaded file if present
         file_url = None
         if file is not None and file.filename:
-            os.makedirs('uploads/insurances', exist_ok=True)
-            timestamp = datetime.now().strftime('%Y%m%d%H%M%S%f')
-            safe_name = file.filename.replace('/', '_').replace('\\', '_')
-            rel_path = f"insurances/{timestamp}_{safe_name}"
-            abs_path = os.path.join('uploads', rel_path)
-            with open(abs_path, 'wb') as out:
-                out.write(file.file.read())
-            file_url = f"/uploads/{rel_path}"
+            file_url = await store_upload(adb, file, 'insurances')
 
         ins = Insurance(
             car_id=car_id,
@@ -1462,7 +4067,7 @@ def create_insurance(
             coverage=coverage,
             file_url=file_url,
         )
-        return db.add_insurance(ins)
+        return await adb.add_insurance(ins)
     except HTTPException:
         raise
     except Exception as e:
@@ -1471,13 +4076,13 @@ def create_insurance(
         raise HTTPException(status_code=500, detail='Failed to add insurance')
 
 
-@app.get('/cars/{car_id}/insurance', response_model=List[Insurance])
-def list_insurance(car_id: int):
+@router.get('/cars/{car_id}/insurance', response_model=List[Insurance])
+async def list_insurance(car_id: int, adb: AsyncDatabase = Depends(get_adb)):
     try:
-        if not db.get_car_by_id(car_id):
+        if not await adb.get_car_by_id(car_id):
             raise HTTPException(
                 status_code=404, detail=f'Car {car_id} not found')
-        return db.get_insurance_by_car(car_id)
+        return await adb.get_insurance_by_car(car_id)
     except HTTPException:
         raise
     except Exception as e:
@@ -1487,32 +4092,51 @@ def list_insurance(car_id: int):
             status_code=500, detail='Failed to retrieve insurance')
 
 
+@router.get('/notifications', response_model=List[dict])
+async def list_notifications(kind: Optional[str] = None, car_id: Optional[int] = None,
+                             adb: AsyncDatabase = Depends(get_adb)):
+    try:
+        if kind and kind not in Database.NOTIFICATION_SOURCES:
+            raise HTTPException(status_code=400, detail=f"kind must be one of {', '.join(Database.NOTIFICATION_SOURCES)}")
+        return _list_response(await adb.get_notifications(kind=kind, car_id=car_id))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in /notifications endpoint: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail='Failed to retrieve notifications')
+
+
+@router.get('/compliance/matrix', response_model=List[dict])
+async def get_compliance_matrix(adb: AsyncDatabase = Depends(get_adb)):
+    try:
+        return _list_response(await adb.get_compliance_matrix())
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in /compliance/matrix endpoint: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail='Failed to build compliance matrix')
+
+
 # --- Legal Docs & Maintenance & Users endpoints ---
 
-@app.post('/cars/{car_id}/legal-docs', response_model=int)
-def create_legal_doc(
+@router.post('/cars/{car_id}/legal-docs', response_model=int)
+async def create_legal_doc(
     car_id: int,
     doc_type: str = Form(...),
     number: Optional[str] = Form(None),
     issue_date: Optional[str] = Form(None),
     expiry_date: Optional[str] = Form(None),
     file: Optional[UploadFile] = File(None),
+    adb: AsyncDatabase = Depends(get_adb),
 ):
     try:
-        if not db.get_car_by_id(car_id):
+        if not await adb.get_car_by_id(car_id):
             raise HTTPException(status_code=404, detail=f'Car {car_id} not found')
 
         # Save uploaded file if present
         file_url = None
         if file is not None and file.filename:
-            os.makedirs('uploads/legal_docs', exist_ok=True)
-            timestamp = datetime.now().strftime('%Y%m%d%H%M%S%f')
-            safe_name = file.filename.replace('/', '_').replace('\\', '_')
-            rel_path = f"legal_docs/{timestamp}_{safe_name}"
-            abs_path = os.path.join('uploads', rel_path)
-            with open(abs_path, 'wb') as out:
-                out.write(file.file.read())
-            file_url = f"/uploads/{rel_path}"
+            file_url = await store_upload(adb, file, 'legal_docs')
 
         doc = LegalDocument(
             car_id=car_id,
@@ -1522,41 +4146,41 @@ def create_legal_doc(
             expiry_date=expiry_date,
             file_url=file_url,
         )
-        return db.add_legal_doc(doc)
+        return await adb.add_legal_doc(doc)
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error in POST /cars/{car_id}/legal-docs: {str(e)}\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail='Failed to add legal document')
 
-@app.get('/cars/{car_id}/legal-docs', response_model=List[LegalDocument])
-def list_legal_docs(car_id: int):
+@router.get('/cars/{car_id}/legal-docs', response_model=List[LegalDocument])
+async def list_legal_docs(car_id: int, adb: AsyncDatabase = Depends(get_adb)):
     try:
-        if not db.get_car_by_id(car_id):
+        if not await adb.get_car_by_id(car_id):
             raise HTTPException(status_code=404, detail=f'Car {car_id} not found')
-        return db.get_legal_docs_by_car(car_id)
+        return await adb.get_legal_docs_by_car(car_id)
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error in GET /cars/{car_id}/legal-docs: {str(e)}\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail='Failed to retrieve legal documents')
 
-@app.post('/maintenance', response_model=int)
-def create_maintenance(m: Maintenance):
+@router.post('/maintenance', response_model=int)
+async def create_maintenance(m: Maintenance, adb: AsyncDatabase = Depends(get_adb)):
     try:
-        if not db.get_car_by_id(m.car_id):
+        if not await adb.get_car_by_id(m.car_id):
             raise HTTPException(status_code=404, detail=f'Car {m.car_id} not found')
-        return db.add_maintenance(m)
+        return await adb.add_maintenance(m)
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error in POST /maintenance: {str(e)}\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail='Failed to add maintenance record')
 
-@app.get('/maintenance/upcoming', response_model=List[dict])
-def upcoming_maintenance(days: int = Query(30, ge=1, le=365)):
+@router.get('/maintenance/upcoming', response_model=List[dict])
+async def upcoming_maintenance(days: int = Query(30, ge=1, le=365), adb: AsyncDatabase = Depends(get_adb)):
     try:
-        return db.get_upcoming_maintenance(days)
+        return _list_response(await adb.get_upcoming_maintenance(days))
     except HTTPException:
         raise
     except Exception as e:
@@ -1569,10 +4193,10 @@ from pydantic import BaseModel
 class MaintenanceStatusUpdate(BaseModel):
     status: str
 
-@app.put('/maintenance/{maint_id}')
-def update_maintenance_status(maint_id: int, payload: MaintenanceStatusUpdate):
+@router.put('/maintenance/{maint_id}')
+async def update_maintenance_status(maint_id: int, payload: MaintenanceStatusUpdate, adb: AsyncDatabase = Depends(get_adb)):
     try:
-        db.update_maintenance_status(maint_id, payload.status)
+        await adb.update_maintenance_status(maint_id, payload.status)
         return {"ok": True}
     except HTTPException:
         raise
@@ -1580,44 +4204,201 @@ def update_maintenance_status(maint_id: int, payload: MaintenanceStatusUpdate):
         logger.error(f"Error in PUT /maintenance/{maint_id}: {str(e)}\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail='Failed to update maintenance record')
 
-@app.post('/users', response_model=int)
-def create_user(u: User, _admin: User = Depends(require_admin)):
+@router.post('/users', response_model=int)
+async def create_user(u: User, _admin: User = Depends(require_admin), services: Services = Depends(get_services)):
     try:
-        return db.add_user(u)
+        password_hash = await services.password_hasher.hash(u.password or secrets.token_urlsafe(12))
+        return await services.adb.add_user(u, password_hash=password_hash)
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error in POST /users: {str(e)}\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail='Failed to add user')
 
-@app.get('/users', response_model=List[User])
-def list_users(_admin: User = Depends(require_admin)):
+class UserUpdate(BaseModel):
+    role: Optional[str] = None
+    active: Optional[bool] = None
+
+@router.put('/users/{user_id}')
+async def update_user(user_id: int, payload: UserUpdate, _admin: User = Depends(require_admin),
+                      services: Services = Depends(get_services)):
+    try:
+        await services.adb.update_user(user_id, role=payload.role, active=payload.active)
+        services.session_cache.invalidate_user(user_id)
+        return {"ok": True}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in PUT /users/{user_id}: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail='Failed to update user')
+
+@router.post('/upload-gc')
+async def gc_uploads(grace_seconds: int = Query(3600, ge=0), _admin: User = Depends(require_admin),
+                     adb: AsyncDatabase = Depends(get_adb)):
     try:
-        return db.get_users()
+        return await adb.gc_uploads(grace_seconds)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in POST /upload-gc: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail='Failed to clean up uploads')
+
+@router.get('/users', response_model=List[User])
+async def list_users(_admin: User = Depends(require_admin), adb: AsyncDatabase = Depends(get_adb)):
+    try:
+        return _list_response(await adb.get_users())
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error in GET /users: {str(e)}\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail='Failed to retrieve users')
 
-@app.get("/stats")
-def get_stats():
+@router.get("/stats")
+async def get_stats(adb: AsyncDatabase = Depends(get_adb)):
     try:
-        return db.get_stats()
+        return await adb.get_stats()
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error in /stats endpoint: {str(e)}\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail="Unable to retrieve stats due to a server error. Please try again.")
 
-# --- Settings endpoints ---
-@app.get("/settings")
-def api_get_settings():
-    return db.get_settings()
+@router.get('/debug/queries', response_model=List[dict])
+async def debug_queries(limit: int = Query(20, ge=1, le=1000),
+                        order: str = Query('total_ms', pattern='^(total_ms|mean_ms|max_ms|calls)$'),
+                        _admin: User = Depends(require_admin), services: Services = Depends(get_services)):
+    query_tracer = services.query_tracer
+    if query_tracer is None:
+        raise HTTPException(status_code=404, detail='SQL tracing is disabled; start the server with SQL_TRACE=1')
+    return _list_response(query_tracer.top(limit, order))
+
+@router.get("/metrics")
+async def get_metrics():
+    return Response(metrics.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+# --- Import endpoints ---
+def _csv_upload_rows(upload: UploadFile) -> Iterator[Tuple[int, dict]]:
+    # Decodes the spooled upload lazily, so rows are streamed rather than
+    # loaded into memory; yields (line number, row) with trimmed headers.
+    text = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(text)
+    reader.fieldnames = [(name or '').strip().lower() for name in (reader.fieldnames or [])]
+    for row in reader:
+        yield reader.line_num, row
+
+
+@router.post("/import/cars")
+async def import_cars(file: UploadFile = File(...), adb: AsyncDatabase = Depends(get_adb)):
+    try:
+        if not file.filename:
+            raise HTTPException(status_code=400, detail="No file uploaded")
+        return await adb.import_cars(_csv_upload_rows(file))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in /import/cars: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail="Car import failed due to a server error. Please try again.")
+
+
+@router.post("/import/customers")
+async def import_customers(file: UploadFile = File(...), adb: AsyncDatabase = Depends(get_adb)):
+    try:
+        if not file.filename:
+            raise HTTPException(status_code=400, detail="No file uploaded")
+        return await adb.import_customers(_csv_upload_rows(file))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in /import/customers: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail="Customer import failed due to a server error. Please try again.")
+
+# --- Export endpoints ---
+EXPORT_MEDIA_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+async def _csv_chunks(columns: List[str], chunks: AsyncIterator[List[tuple]]) -> AsyncIterator[str]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    async for rows in chunks:
+        writer.writerows(rows)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+async def _ndjson_chunks(columns: List[str], chunks: AsyncIterator[List[tuple]]) -> AsyncIterator[bytes]:
+    async for rows in chunks:
+        yield b''.join(orjson.dumps(dict(zip(columns, row))) + b'\n' for row in rows)
+
 
-@app.post("/settings")
-def api_save_settings(payload: Dict[str, Any]):
+@router.get("/export/{dataset}.{fmt}")
+async def export_dataset(dataset: str, fmt: str, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                         adb: AsyncDatabase = Depends(get_adb)):
+    try:
+        if fmt not in EXPORT_MEDIA_TYPES:
+            raise HTTPException(status_code=404, detail=f"Unsupported export format '{fmt}'. Use csv or ndjson.")
+        # iter_export only validates and builds the generator; rows are read on the DB executor.
+        chunks = adb.iterate(adb.database.iter_export(dataset, date_from, date_to))
+        columns = Database.EXPORT_QUERIES[dataset][0]
+        body = _csv_chunks(columns, chunks) if fmt == 'csv' else _ndjson_chunks(columns, chunks)
+        return StreamingResponse(
+            body,
+            media_type=EXPORT_MEDIA_TYPES[fmt],
+            headers={"Content-Disposition": f'attachment; filename="{dataset}.{fmt}"'},
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in /export/{dataset}.{fmt}: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail="Export failed due to a server error. Please try again.")
+
+# --- Settings endpoints ---
+@router.get("/settings")
+async def api_get_settings(if_none_match: Optional[str] = Header(None), adb: AsyncDatabase = Depends(get_adb)):
+    version, _, raw = await adb.get_settings_snapshot()
+    etag = f'"settings-{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(',')]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=raw, media_type="application/json", headers=headers)
+
+@router.post("/settings")
+async def api_save_settings(payload: Dict[str, Any], adb: AsyncDatabase = Depends(get_adb)):
     if not isinstance(payload, dict):
         raise HTTPException(status_code=400, detail="Invalid payload")
-    db.save_settings(payload)
-    return {"ok": True}
\ No newline at end of file
+    version = await adb.save_settings(payload)
+    return {"ok": True, "version": version}
+
+
+def create_app(config: Optional[AppConfig] = None) -> FastAPI:
+    """Builds the app. Its services, and all startup work (directories,
+    migrations, default admin, notification refresh), come from the lifespan,
+    so calling this is cheap. Use as `uvicorn main:create_app --factory`."""
+    config = config or AppConfig.from_env()
+    app = FastAPI(lifespan=lifespan)
+    app.state.config = config
+    app.mount("/uploads", UploadFiles(directory=UPLOAD_ROOT, check_dir=False), name="uploads")
+    app.include_router(router)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=config.cors_origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "ETag"],
+    )
+    app.add_middleware(MetricsMiddleware)
+    return app
+
+
+def __getattr__(name: str):
+    # Compatibility for `uvicorn main:app` and older scripts: the module-level
+    # app is built from the environment on first access, not at import.
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
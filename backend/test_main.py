@@ -0,0 +1,278 @@
+import os
+import io
+import shutil
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException, UploadFile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import main  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # The app resolves uploads/ relative to the working directory.
+    monkeypatch.chdir(tmp_path)
+    database = main.Database(str(tmp_path / 'car_rental.db'))
+    database.initialize()
+    yield database
+    database.close()
+
+
+def test_last_active_admin_cannot_be_deactivated_or_demoted(db):
+    admin_id = db.get_user_by_email('admin@local').id
+    for change in [{'active': False}, {'role': 'staff'}]:
+        with pytest.raises(HTTPException) as exc:
+            db.update_user(admin_id, **change)
+        assert exc.value.status_code == 409
+    user = db.get_user_by_email('admin@local')
+    assert (user.role, user.active) == ('admin', True)
+
+    second = db.add_user(main.User(name='Second', email='second@local', role='admin'), password_hash='x')
+    db.update_user(admin_id, active=False)
+    with pytest.raises(HTTPException) as exc:
+        db.update_user(second, role='manager')
+    assert exc.value.status_code == 409
+
+
+def test_login_throttle_counts_attempts_in_flight(db):
+    throttle = main.LoginThrottle(db, max_failures=3, window=60)
+    # Three parallel attempts take every slot before any of them is verified.
+    assert [throttle.reserve('A@x') for _ in range(3)] == [0, 0, 0]
+    assert throttle.reserve('a@x') > 0
+    throttle.refund('a@x')
+    assert throttle.reserve('a@x') == 0
+    throttle.reset('a@x')
+    assert throttle.reserve('a@x') == 0
+
+
+def test_login_throttle_is_shared_by_workers(db):
+    other = main.Database(db.db_name)
+    try:
+        first, second = main.LoginThrottle(db, max_failures=2), main.LoginThrottle(other, max_failures=2)
+        assert first.reserve('a@x') == 0 and second.reserve('a@x') == 0
+        assert first.reserve('a@x') > 0 and second.reserve('a@x') > 0
+    finally:
+        other.close()
+
+
+def test_stats_counters_follow_writes(db):
+    today = datetime.now().strftime('%Y-%m-%d')
+    db.get_stats()
+    car_id = db.add_car(main.Car(make='Toyota', model='Yaris', year=2020, price_per_day=40))
+    customer_id = db.add_customer(main.Customer(name='Ann', email='ann@x'))
+    rental_id = db.add_rental(main.Rental(car_id=car_id, customer_id=customer_id, start_date=today, days=3))
+    assert db.get_stats() == db._compute_stats(today)
+    db.update_rental_end(rental_id, today, 40.0)
+    assert db.get_stats() == db._compute_stats(today)
+
+
+def test_stats_recompute_during_write_is_not_double_counted(db):
+    db.get_stats()
+    real_bump = db._bump_stats
+
+    def recompute_then_bump(*args, **kwargs):
+        # Another request recomputes the snapshot after the commit, so it
+        # already includes this write.
+        db._stats = None
+        db.get_stats()
+        real_bump(*args, **kwargs)
+
+    db._bump_stats = recompute_then_bump
+    db.add_car(main.Car(make='Toyota', model='Yaris', year=2020, price_per_day=40))
+    del db._bump_stats
+    assert db.get_stats()['vehicles'] == 1
+
+
+def test_availability_rebuild_during_write_is_not_double_counted(db):
+    car_id = db.add_car(main.Car(make='Toyota', model='Yaris', year=2020, price_per_day=40))
+    customer_id = db.add_customer(main.Customer(name='Ann', email='ann@x'))
+    db.check_car_availability(car_id, '2030-01-01', '2030-01-02')
+    real_bump = db._bump_stats
+
+    def rebuild_then_bump(*args, **kwargs):
+        # Another request rebuilds the index after the commit, so it already
+        # holds this rental.
+        db._availability = None
+        db._availability_index()
+        real_bump(*args, **kwargs)
+
+    db._bump_stats = rebuild_then_bump
+    rental_id = db.add_rental(main.Rental(car_id=car_id, customer_id=customer_id, start_date='2030-01-01'))
+    del db._bump_stats
+    db.update_rental_end(rental_id, '2030-01-05', 200)
+    assert not db.check_car_availability(car_id, '2030-01-03', '2030-01-04')
+    assert db.check_car_availability(car_id, '2030-01-10', '2030-01-12')
+
+
+def test_rental_batches_report_partial_failures(db):
+    today = datetime.now().strftime('%Y-%m-%d')
+    cars = [db.add_car(main.Car(make='Toyota', model='Yaris', year=2020, price_per_day=40)) for _ in range(2)]
+    customer_id = db.add_customer(main.Customer(name='Ann', email='ann@x'))
+    results = db.add_rentals_batch([
+        main.Rental(car_id=cars[0], customer_id=customer_id, start_date=today),
+        main.Rental(car_id=cars[0], customer_id=customer_id, start_date=today),
+        main.Rental(car_id=cars[1], customer_id=999, start_date=today),
+        main.Rental(car_id=cars[1], customer_id=customer_id, start_date=today, days=2),
+    ])
+    assert [r['ok'] for r in results] == [True, False, False, True]
+    assert 'not available' in results[1]['error'] and 'Customer' in results[2]['error']
+    for result, car_id in [(results[0], cars[0]), (results[3], cars[1])]:
+        assert db.get_rental_by_id(result['rental_id']).car_id == car_id
+
+    returned = db.return_rentals_batch([results[3]['rental_id'], 999, results[3]['rental_id'], results[0]['rental_id']])
+    assert [r['ok'] for r in returned] == [True, False, False, True]
+    for result in (returned[0], returned[3]):
+        assert db.get_sale_by_rental_id(result['rental_id']).id == result['sale_id']
+
+
+def test_csv_import_reports_unreadable_upload(db):
+    good = ''.join(f'Toyota,Yaris,2020,{40 + i}\n' for i in range(2000))
+    data = b'make,model,year,price_per_day\n' + good.encode() + b'Fiat,Panda,2019,\xff\xfe\n'
+    upload = UploadFile(file=io.BytesIO(data), filename='cars.csv')
+    with pytest.raises(HTTPException) as exc:
+        db.import_cars(main._csv_upload_rows(upload))
+    report = exc.value.status_code, exc.value.detail
+    assert report[0] == 400
+    # Whole chunks of 500 rows were committed before the decoder reached the bad bytes.
+    inserted = report[1]['inserted']
+    assert inserted and inserted % 500 == 0 and report[1]['committed_through_row'] == inserted + 1
+    assert 'Unreadable CSV' in report[1]['errors'][-1]['error']
+    assert db.get_stats()['vehicles'] == inserted
+
+
+def test_gc_uploads_keeps_blobs_that_are_registered_again(db):
+    def spool(data):
+        return main.save_upload(UploadFile(file=io.BytesIO(data), filename='scan.pdf'), 'legal_docs')
+
+    def path(stored):
+        return os.path.join(main.UPLOAD_ROOT, stored.url[len('/uploads/'):])
+
+    kept, dropped = spool(b'%PDF referenced'), spool(b'%PDF orphan')
+    db.register_blob(kept)
+    db.register_blob(dropped)
+    db.add_customer(main.Customer(name='Ann', email='ann@x', id_card_url=kept.url))
+    assert db.gc_uploads(grace_seconds=3600)['removed'] == 0
+    with db.conn:
+        db.conn.execute("UPDATE blobs SET last_seen_at = '2000-01-01 00:00:00'")
+
+    # An identical upload is spooled while the collection runs; registering
+    # it afterwards writes the blob back.
+    again = spool(b'%PDF orphan')
+    assert db.gc_uploads(grace_seconds=0) == {'removed': 1, 'bytes_freed': dropped.size}
+    assert os.path.exists(path(kept)) and not os.path.exists(path(dropped))
+    db.register_blob(again)
+    assert again.url == dropped.url and os.path.exists(path(again))
+    assert not [name for name in os.listdir(os.path.join(main.UPLOAD_ROOT, main.BLOB_DIR)) if name.startswith('.')]
+
+
+def test_apps_from_two_configs_keep_separate_services(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    monkeypatch.chdir(tmp_path)
+    first = main.create_app(main.AppConfig(db_name='first.db', invoice_cache_dir='first_cache'))
+    second = main.create_app(main.AppConfig(db_name='second.db', invoice_cache_dir='second_cache'))
+    with TestClient(first) as a, TestClient(second) as b:
+        assert first.state.services.db is not second.state.services.db
+        car = {'make': 'Toyota', 'model': 'Yaris', 'year': 2020, 'price_per_day': 40}
+        assert a.post('/cars', json=car).status_code == 200
+        assert len(a.get('/cars').json()) == 1
+        assert b.get('/cars').json() == []
+    assert os.path.exists('first.db') and os.path.exists('second.db')
+
+
+def test_migrations_upgrade_the_baseline_database(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / 'car_rental.db'
+    shutil.copyfile(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'car_rental.db'), path)
+    with sqlite3.connect(path) as conn:
+        before = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                  for table in ['cars', 'customers', 'rentals', 'sales', 'users']}
+    database = main.Database(str(path))
+    try:
+        database.initialize()
+        versions = [row[0] for row in database.conn.execute('SELECT version FROM schema_version ORDER BY version')]
+        assert versions == [version for version, _, _ in main.Database.MIGRATIONS]
+        for table, count in before.items():
+            assert database.conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] == count
+        tables = {row[0] for row in database.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        assert {'table_changes', 'login_attempts', 'blobs', 'notifications'} <= tables
+        assert 'change_counter' not in tables
+        today = datetime.now().strftime('%Y-%m-%d')
+        assert database.get_stats() == database._compute_stats(today)
+        # A second start finds nothing to do.
+        database.initialize()
+    finally:
+        database.close()
+
+
+def test_caches_follow_writes_from_another_worker(db):
+    other = main.Database(db.db_name)
+    try:
+        cleared = []
+        db.change_listeners.append(({'users', 'sessions'}, lambda: cleared.append(True)))
+        db.sync_changes()
+        assert db.get_stats()['vehicles'] == 0
+        db.get_settings_snapshot()
+        index = db._availability_index()
+
+        other.add_car(main.Car(make='Toyota', model='Yaris', year=2020, price_per_day=40))
+        assert db.get_stats()['vehicles'] == 0  # cached until the next poll
+        db.sync_changes()
+        assert db.get_stats()['vehicles'] == 1
+        # Only caches built from the cars table were dropped.
+        assert db._availability is index and db._settings is not None and not cleared
+
+        other.save_settings({'general': {'companyName': 'Other'}})
+        other.update_user(db.get_user_by_email('admin@local').id, role='admin')
+        db.sync_changes()
+        assert db.get_settings_snapshot()[1] == {'general': {'companyName': 'Other'}}
+        assert db._availability is index and cleared
+    finally:
+        other.close()
+
+
+def test_own_writes_do_not_invalidate_caches(db):
+    db.sync_changes()
+    db.get_stats()
+    invalidations = main.metrics._values['db_cache_invalidations_total'].get((), 0)
+    car_id = db.add_car(main.Car(make='Toyota', model='Yaris', year=2020, price_per_day=40))
+    customer_id = db.add_customer(main.Customer(name='Ann', email='ann@x'))
+    db.add_rental(main.Rental(car_id=car_id, customer_id=customer_id, start_date='2030-01-01', days=2))
+    db.sync_changes()
+    assert db._stats is not None and db._availability is not None
+    assert main.metrics._values['db_cache_invalidations_total'].get((), 0) == invalidations
+
+
+def test_invoice_cache_key_follows_invoice_data(db, tmp_path):
+    car_id = db.add_car(main.Car(make='Toyota', model='Yaris', year=2020, price_per_day=40))
+    customer_id = db.add_customer(main.Customer(name='Ann', email='ann@x'))
+    rental_id = db.add_rental(main.Rental(car_id=car_id, customer_id=customer_id, start_date='2030-01-01'))
+    db.update_rental_end(rental_id, '2030-01-05', 160)
+    db.add_sale(main.Sale(rental_id=rental_id, customer_id=customer_id, car_id=car_id,
+                          total_cost=160, sale_date='2030-01-05'))
+    renderer = main.InvoiceRenderer(str(tmp_path))
+    first = db.get_invoice(rental_id)
+    db.update_rental_end(rental_id, '2030-01-07', 240)
+    second = db.get_invoice(rental_id)
+    assert first['sale_id'] == second['sale_id']
+    assert renderer._path(first, 1) != renderer._path(second, 1)
+    assert renderer._path(second, 1) == renderer._path(db.get_invoice(rental_id), 1)
+
+
+def test_traced_generator_methods_open_no_connection(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    database = main.Database(str(tmp_path / 'car_rental.db'), tracer=main.QueryTracer())
+    database.initialize()
+    try:
+        # Like the event loop: a thread that has never used the database.
+        thread = threading.Thread(target=database.iter_export, args=('rentals',))
+        thread.start()
+        thread.join()
+        assert len(database._connections) == 1
+    finally:
+        database.close()
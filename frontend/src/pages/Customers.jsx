@@ -5,9 +5,13 @@ import { motion, AnimatePresence } from "framer-motion";
 import { PlusIcon, XMarkIcon, CheckIcon } from "@heroicons/react/24/outline";
 
 const API_BASE = "http://localhost:8000";
+// Customers are listed oldest first, one page at a time; "Load more" follows
+// the X-Next-Cursor header.
+const PAGE_SIZE = 50;
 
 function Customers() {
   const [customers, setCustomers] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [formData, setFormData] = useState({ name: "", email: "", phone: "" });
   const [showForm, setShowForm] = useState(false);
   const [error, setError] = useState(null);
@@ -17,10 +21,13 @@ function Customers() {
     fetchCustomers();
   }, []);
 
-  const fetchCustomers = async () => {
+  const fetchCustomers = async (cursor = null) => {
     try {
-      const res = await axios.get(`${API_BASE}/customers`);
-      setCustomers(res.data);
+      const res = await axios.get(`${API_BASE}/customers`, {
+        params: { limit: PAGE_SIZE, ...(cursor ? { cursor } : {}) },
+      });
+      setCustomers((prev) => (cursor ? [...prev, ...res.data] : res.data));
+      setNextCursor(res.headers["x-next-cursor"] || null);
       setError(null);
     } catch (err) {
       setError(
@@ -209,7 +216,7 @@ function Customers() {
                   key={customer.id}
                   initial={{ opacity: 0, y: 20 }}
                   animate={{ opacity: 1, y: 0 }}
-                  transition={{ duration: 0.3, delay: index * 0.05 }}
+                  transition={{ duration: 0.3, delay: (index % PAGE_SIZE) * 0.05 }}
                   className="border-t border-gray-200 hover:bg-gray-50 transition"
                 >
                   <td className="p-4 text-gray-600">{customer.id}</td>
@@ -253,6 +260,19 @@ function Customers() {
         </div>
       </motion.div>
 
+      {nextCursor && (
+        <div className="flex justify-center mt-4">
+          <motion.button
+            whileHover={{ scale: 1.05 }}
+            whileTap={{ scale: 0.95 }}
+            onClick={() => fetchCustomers(nextCursor)}
+            className="bg-gray-800 text-white px-4 py-2 rounded-lg shadow hover:bg-gray-700 transition-colors"
+          >
+            Load more
+          </motion.button>
+        </div>
+      )}
+
       {customers.length === 0 && (
         <motion.p
           initial={{ opacity: 0 }}
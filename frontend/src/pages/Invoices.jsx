@@ -8,6 +8,10 @@ import { PDFDownloadLink, Document, Page, Text, View, StyleSheet } from '@react-
 
 const API_BASE = 'http://localhost:8000';
 
+// Invoices are listed newest first, one page at a time; "Load more" follows
+// the X-Next-Cursor header.
+const PAGE_SIZE = 50;
+
 // Styles for PDF document
 const pdfStyles = StyleSheet.create({
   page: {
@@ -207,40 +211,28 @@ function InvoicePDF({ invoice }) {
 }
 
 function Invoices() {
-  const [rentals, setRentals] = useState([]);
+  // The ledger rows carry every invoice field, so selecting one needs no extra request
+  const [invoices, setInvoices] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [selectedRentalId, setSelectedRentalId] = useState('');
-  const [invoice, setInvoice] = useState(null);
   const [error, setError] = useState(null);
+  const invoice = invoices.find((inv) => String(inv.rental_id) === selectedRentalId) || null;
 
   useEffect(() => {
-    if (!selectedRentalId) return;
-    // Auto-generate (fetch) invoice on selection
-    const run = async () => {
-      try {
-        const res = await axios.get(`${API_BASE}/rentals/${selectedRentalId}/invoice`);
-        setInvoice(res.data);
-        setError(null);
-      } catch (err) {
-        setError(err.response?.data?.detail || 'Failed to generate invoice. Please try again.');
-        console.error('Error fetching invoice:', err);
-      }
-    };
-    run();
-  }, [selectedRentalId]);
-
-  useEffect(() => {
-    fetchCompletedRentals();
+    fetchInvoices();
   }, []);
 
-  const fetchCompletedRentals = async () => {
+  const fetchInvoices = async (cursor = null) => {
     try {
-      const res = await axios.get(`${API_BASE}/rentals`);
-      const completed = res.data.filter((r) => r.end_date);
-      setRentals(completed);
+      const res = await axios.get(`${API_BASE}/invoices`, {
+        params: { limit: PAGE_SIZE, ...(cursor ? { cursor } : {}) },
+      });
+      setInvoices((prev) => (cursor ? [...prev, ...res.data] : res.data));
+      setNextCursor(res.headers['x-next-cursor'] || null);
       setError(null);
     } catch (err) {
-      setError(err.response?.data?.detail || 'Failed to fetch rentals. Please try again.');
-      console.error('Error fetching rentals:', err);
+      setError(err.response?.data?.detail || 'Failed to fetch invoices. Please try again.');
+      console.error('Error fetching invoices:', err);
     }
   };
 
@@ -292,18 +284,15 @@ function Invoices() {
                 </tr>
               </thead>
               <tbody>
-                {rentals.map((rental, index) => {
-                  const cust = rental.customer || {};
-                  const car = rental.car || {};
-                  const carLabel = (car.year || car.make || car.model)
-                    ? `${car.year ?? ''} ${car.make ?? ''} ${car.model ?? ''}`.trim()
-                    : `Car #${rental.car_id}`;
+                {invoices.map((inv, index) => {
+                  const rental = { id: inv.rental_id, start_date: inv.start_date, end_date: inv.end_date };
+                  const carLabel = `${inv.car_year ?? ''} ${inv.car_make ?? ''} ${inv.car_model ?? ''}`.trim();
                   return (
                     <motion.tr
-                      key={rental.id}
+                      key={inv.sale_id}
                       initial={{ opacity: 0, y: 10 }}
                       animate={{ opacity: 1, y: 0 }}
-                      transition={{ duration: 0.25, delay: index * 0.03 }}
+                      transition={{ duration: 0.25, delay: (index % PAGE_SIZE) * 0.03 }}
                       className={`border-t border-gray-200 transition cursor-pointer ${
                         selectedRentalId === String(rental.id)
                           ? 'bg-gray-100 font-medium'
@@ -322,12 +311,8 @@ function Invoices() {
                       </td>
                       <td className="p-3 text-gray-700 align-middle">{rental.id}</td>
                       <td className="p-3 text-gray-700 align-middle truncate">
-                        <div className="max-w-[14rem] truncate" title={cust.name || `Customer #${rental.customer_id}` }>
-                          {cust.name ? (
-                            <span>{cust.name}</span>
-                          ) : (
-                            <span>Customer #{rental.customer_id}</span>
-                          )}
+                        <div className="max-w-[14rem] truncate" title={inv.customer_name}>
+                          <span>{inv.customer_name}</span>
                         </div>
                       </td>
                       <td className="p-3 text-gray-700 align-middle truncate">
@@ -342,6 +327,18 @@ function Invoices() {
             </table>
           </div>
         </div>
+        {nextCursor && (
+          <div className="flex justify-center">
+            <motion.button
+              whileHover={{ scale: 1.05 }}
+              whileTap={{ scale: 0.95 }}
+              onClick={() => fetchInvoices(nextCursor)}
+              className="bg-gray-800 text-white px-4 py-2 rounded-lg shadow hover:bg-gray-700 transition-colors"
+            >
+              Load more
+            </motion.button>
+          </div>
+        )}
       </div>
 
       <AnimatePresence>
@@ -412,7 +409,7 @@ function Invoices() {
         )}
       </AnimatePresence>
 
-      {rentals.length === 0 && (
+      {invoices.length === 0 && (
         <motion.p
           initial={{ opacity: 0 }}
           animate={{ opacity: 1 }}
@@ -14,11 +14,17 @@ import QuotationPDF from "./QuotationPDF";
 
 const API_BASE = "http://localhost:8000";
 
+// Rentals are listed newest first, one page at a time; "Load more" follows the
+// X-Next-Cursor header.
+const PAGE_SIZE = 50;
+
 function Rentals() {
   const [rentals, setRentals] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [openRentals, setOpenRentals] = useState([]);
   const [availableCars, setAvailableCars] = useState([]);
-  const [allCars, setAllCars] = useState([]);
   const [customers, setCustomers] = useState([]);
+  const [customerSearch, setCustomerSearch] = useState("");
   const [formData, setFormData] = useState({
     car_id: "",
     customer_id: "",
@@ -34,34 +40,47 @@ function Rentals() {
 
   useEffect(() => {
     fetchRentals();
+    fetchOpenRentals();
     fetchAvailableCars();
-    fetchCustomers();
-    fetchAllCars();
   }, []);
-  const fetchAllCars = async () => {
+
+  useEffect(() => {
+    // Debounced server-side search for the customer picker
+    const timer = setTimeout(() => fetchCustomers(customerSearch), 250);
+    return () => clearTimeout(timer);
+  }, [customerSearch]);
+
+  const fetchRentals = async (cursor = null) => {
     try {
-      const res = await axios.get(`${API_BASE}/cars`);
-      setAllCars(res.data);
+      const res = await axios.get(`${API_BASE}/rentals`, {
+        params: { limit: PAGE_SIZE, ...(cursor ? { cursor } : {}) },
+      });
+      setRentals((prev) => (cursor ? [...prev, ...res.data] : res.data));
+      setNextCursor(res.headers["x-next-cursor"] || null);
       setError(null);
     } catch (err) {
       setError(
-        err.response?.data?.detail || "Failed to fetch cars. Please try again."
+        err.response?.data?.detail ||
+          "Failed to fetch rentals. Please try again."
       );
-      console.error("Error fetching all cars:", err);
+      console.error("Error fetching rentals:", err);
     }
   };
 
-  const fetchRentals = async () => {
+  const fetchOpenRentals = async () => {
+    // Rentals that can still be returned: open, or due back today or later
     try {
-      const res = await axios.get(`${API_BASE}/rentals`);
-      setRentals(res.data);
-      setError(null);
+      const today = new Date().toISOString().split("T")[0];
+      const res = await axios.get(`${API_BASE}/rentals`, {
+        params: { ends_from: today },
+      });
+      setOpenRentals(res.data);
     } catch (err) {
       setError(
         err.response?.data?.detail ||
           "Failed to fetch rentals. Please try again."
       );
-      console.error("Error fetching rentals:", err);
+      console.error("Error fetching open rentals:", err);
     }
   };
 
@@ -79,9 +98,11 @@ function Rentals() {
     }
   };
 
-  const fetchCustomers = async () => {
+  const fetchCustomers = async (q = "") => {
     try {
-      const res = await axios.get(`${API_BASE}/customers`);
+      const res = await axios.get(`${API_BASE}/customers`, {
+        params: { limit: PAGE_SIZE, ...(q ? { q } : {}) },
+      });
       setCustomers(res.data);
       setError(null);
     } catch (err) {
@@ -121,6 +142,7 @@ function Rentals() {
       });
       setError(null);
       fetchRentals();
+      fetchOpenRentals();
       fetchAvailableCars();
     } catch (err) {
       setError(
@@ -138,6 +160,7 @@ function Rentals() {
       setSelectedRentalId("");
       setError(null);
       fetchRentals();
+      fetchOpenRentals();
       fetchAvailableCars();
     } catch (err) {
       setError(
@@ -196,17 +219,11 @@ function Rentals() {
             className="p-3 border border-gray-300 rounded-lg focus:outline-none focus:ring-2 focus:ring-gray-500 transition"
           >
             <option value="">Select Rental to Return</option>
-            {rentals
-              .filter(
-                (r) =>
-                  !r.end_date ||
-                  r.end_date >= new Date().toISOString().split("T")[0]
-              )
-              .map((rental) => (
-                <option key={rental.id} value={rental.id}>
-                  ID: {rental.id} - Car: {rental.car_id}
-                </option>
-              ))}
+            {openRentals.map((rental) => (
+              <option key={rental.id} value={rental.id}>
+                ID: {rental.id} - Car: {rental.car_id}
+              </option>
+            ))}
           </motion.select>
           <motion.button
             whileHover={{ scale: 1.05 }}
@@ -247,6 +264,13 @@ function Rentals() {
                   </option>
                 ))}
               </select>
+              <input
+                type="search"
+                value={customerSearch}
+                onChange={(e) => setCustomerSearch(e.target.value)}
+                placeholder="Search customers by name or email"
+                className="w-full p-3 border border-gray-300 rounded-lg focus:outline-none focus:ring-2 focus:ring-gray-500 transition"
+              />
               <select
                 name="customer_id"
                 value={formData.customer_id}
@@ -346,37 +370,21 @@ function Rentals() {
                   key={rental.id}
                   initial={{ opacity: 0, y: 20 }}
                   animate={{ opacity: 1, y: 0 }}
-                  transition={{ duration: 0.3, delay: index * 0.05 }}
+                  transition={{ duration: 0.3, delay: (index % PAGE_SIZE) * 0.05 }}
                   className="border-t border-gray-200 hover:bg-gray-50 transition"
                 >
                   <td className="p-4 text-gray-600">{rental.id}</td>
                   <td className="p-4 text-gray-600">
-                    {(() => {
-                      const car = allCars.find((c) => c.id === rental.car_id);
-                      return car ? (
-                        <span>
-                          {car.year} {car.make} {car.model}{" "}
-                          <span className="text-gray-400">(#{car.id})</span>
-                        </span>
-                      ) : (
-                        <span>Car #{rental.car_id}</span>
-                      );
-                    })()}
+                    <span>
+                      {rental.car.year} {rental.car.make} {rental.car.model}{" "}
+                      <span className="text-gray-400">(#{rental.car_id})</span>
+                    </span>
                   </td>
                   <td className="p-4 text-gray-600">
-                    {(() => {
-                      const cust = customers.find(
-                        (c) => c.id === rental.customer_id
-                      );
-                      return cust ? (
-                        <span>
-                          {cust.name}{" "}
-                          <span className="text-gray-400">(#{cust.id})</span>
-                        </span>
-                      ) : (
-                        <span>Customer #{rental.customer_id}</span>
-                      );
-                    })()}
+                    <span>
+                      {rental.customer.name}{" "}
+                      <span className="text-gray-400">(#{rental.customer_id})</span>
+                    </span>
                   </td>
                   <td className="p-4 text-gray-600">{rental.start_date}</td>
                   <td className="p-4 text-gray-600">
@@ -458,6 +466,19 @@ function Rentals() {
         </div>
       </motion.div>
 
+      {nextCursor && (
+        <div className="flex justify-center mt-4">
+          <motion.button
+            whileHover={{ scale: 1.05 }}
+            whileTap={{ scale: 0.95 }}
+            onClick={() => fetchRentals(nextCursor)}
+            className="bg-gray-800 text-white px-4 py-2 rounded-lg shadow hover:bg-gray-700 transition-colors"
+          >
+            Load more
+          </motion.button>
+        </div>
+      )}
+
       {rentals.length === 0 && (
         <motion.p
           initial={{ opacity: 0 }}
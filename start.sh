@@ -22,7 +22,7 @@ pip install --upgrade pip
 pip install -r requirements.txt
 
 # Start FastAPI backend (on port 8000)
-uvicorn main:app --host 0.0.0.0 --port 8000 &
+uvicorn main:create_app --factory --host 0.0.0.0 --port 8000 &
 
 cd ..
 